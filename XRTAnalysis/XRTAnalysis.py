@@ -1,27 +1,69 @@
 import numpy as np
-# For fitting intrinsic power law
-from scipy.optimize import curve_fit
 from __deabsorb import deabsorb as deab
-import matplotlib.pyplot as plt
-from astropy.table import Table
-from astropy import units as u
+from __deabsorb import transmission_cache
+from __lazy import LazyModule
+from __timing import StageTimer
 
 import os
-# Checking if xspec can be imported
+
+# Heavy dependencies are imported on first use, see bin/TestImportTime.py
 # PyXSpec can be installed with heasoft!
-try :
-    import xspec
-except ImportError as e:
-    print ("%s\nHave you initialised heasoft?")
+# A missing xspec only raises once an xspec backed method is called
+xspec = LazyModule("xspec", "Have you initialised heasoft?")
+plt = LazyModule("matplotlib.pyplot")
+u = LazyModule("astropy.units")
+_table = LazyModule("astropy.table")
+_forwardfold = LazyModule("__forwardfold")
+_responsestore = LazyModule("__responsestore")
+_bands = LazyModule("__bands")
+_fitcache = LazyModule("__fitcache")
+_profile = LazyModule("__profile")
+_gridscan = LazyModule("__gridscan")
+_bootstrap = LazyModule("__bootstrap")
+_fits = LazyModule("astropy.io.fits")
+
+
+# xspec parameter numbers within one data group's copy of the model,
+# (model, cflux): (number of parameters, normalisation or lg10Flux, shape parameters)
+PARAMETERS = {("pwl", True) : (6, 4, [5]),
+              ("pwl", False) : (3, 3, [2]),
+              ("logpar", True) : (8, 4, [5, 6]),
+              ("logpar", False) : (5, 5, [2, 3])}
+
+# getFitResults keys of the shape parameters
+SHAPE_KEYS = {"pwl" : ["Index"], "logpar" : ["Alpha", "Beta"]}
 
 
 class XRT_Analysis():
 
-    def __init__(self, igrouped = None):
+    # backend = "xspec", fit through PyXspec
+    # backend = "numpy", forward-fold with __forwardfold, no xspec needed
+    def __init__(self, igrouped = None, backend = "xspec"):
+
+        if backend not in ("xspec", "numpy"):
+            raise ValueError("Unknown backend: %s" %backend)
+        self.backend = backend
+        self.fitter = _forwardfold.ForwardFold() if backend == "numpy" else None
+
+        # Stage timings, disabled (and close to free) unless enableTiming is called
+        self.timer = StageTimer()
+        self._timingMark = None
+
+        # Channels ignored in every loaded spectrum
+        self.ignoreRanges = ["bad", "**-0.3 10.-**"]
+
+        # Plot.setRebin of the last load, the binning of the SEDs in writeModel
+        self.bRebin = True
 
         # Name of the pha file to be analysed
+        # spectrumFiles keeps the full path of every loaded spectrum
+        # ngroups > 1 for a joint fit, one data group per spectrum (setJointPHA)
         self.grpFileName = igrouped
+        self.spectrumFiles = []
+        self.ngroups = 1
+        self.jointIndex = None
         if igrouped != None:
+            self.spectrumFiles = [os.path.abspath(igrouped)]
             self._initializeXSpec()
 
         # Model Specific things
@@ -37,6 +79,7 @@ class XRT_Analysis():
         # 2.56e20
         self.abs = "pha"
         self.nH = 2.56
+        self.nH_frozen = True
 
 
         # Energy Spectral Points
@@ -67,58 +110,161 @@ class XRT_Analysis():
 
 
         self.covar = None
+        self.fitParameters = None
+
+        # Optional on-disk memoisation of doFit, see useFitCache
+        self.fitCache = None
+
+        # Parameter errors in writeModel, see setErrorMethod
+        self.errorMethod = "profile"
+        self.errorWorkers = None
+        self.errorBootstrap = {"nboot" : 2000, "seed" : None}
+        self._errors = {}
 
         self.ifcFlux = True
-        xspec.Fit.statMethod = 'chi'
+        self.statMethod = "chi"
+        if self.backend == "xspec":
+            xspec.Fit.statMethod = 'chi'
 
 
     # Function to initialize XSpec
     def _initializeXSpec(self, bRebin = True):
-        # Clearing any previous states
-        xspec.AllData.clear()
-        xspec.AllData.show()
-        # load in the group pha file
-        self.spec = xspec.Spectrum(self.grpFileName)
-        # For plotting
-        xspec.Plot.xAxis = "kev"
-        if (bRebin):
-            print ("Rebinning")
-            xspec.Plot.setRebin(5,10)
-        # Ignoring invalid data chanels
-        xspec.AllData.ignore("bad")
-        xspec.AllData.ignore("**-0.3 10.-**")
+        self.bRebin = bRebin
+        with self.timer.stage("load"):
+            if self.backend == "numpy":
+                self.fitter.clear()
+                self.fitter.addSpectrum(self.grpFileName)
+                self.m1 = 0
+                return
+
+            # Clearing any previous states
+            xspec.AllData.clear()
+            xspec.AllData.show()
+            # load in the group pha file
+            self.spec = xspec.Spectrum(self.grpFileName)
+            # For plotting
+            xspec.Plot.xAxis = "kev"
+            if (bRebin):
+                print ("Rebinning")
+                xspec.Plot.setRebin(5,10)
+            # Ignoring invalid data chanels
+            for ignore in self.ignoreRanges:
+                xspec.AllData.ignore(ignore)
 
         self.m1 = 0
 
 
     def addSpectrum(self, grpFileName, grpFilePath="./", bRebin = True):
-        cwd = os.getcwd()
-        os.chdir(grpFilePath)
-        xspec.Spectrum(grpFileName)
-        # For plotting
-        xspec.Plot.xAxis = "kev"
-        if (bRebin):
-            print ("Rebinning")
-            xspec.Plot.setRebin(5,10)
-        # Ignoring invalid data chanels
-        xspec.AllData.ignore("bad")
-        xspec.AllData.ignore("**-0.3 10.-**")
-        os.chdir(cwd)
+        self.spectrumFiles.append(os.path.abspath(os.path.join(grpFilePath, grpFileName)))
+        self.bRebin = bRebin
+        with self.timer.stage("load"):
+            if self.backend == "numpy":
+                self.fitter.addSpectrum(os.path.join(grpFilePath, grpFileName))
+                return
+
+            cwd = os.getcwd()
+            os.chdir(grpFilePath)
+            xspec.Spectrum(grpFileName)
+            # For plotting
+            xspec.Plot.xAxis = "kev"
+            if (bRebin):
+                print ("Rebinning")
+                xspec.Plot.setRebin(5,10)
+            # Ignoring invalid data chanels
+            for ignore in self.ignoreRanges:
+                xspec.AllData.ignore(ignore)
+            os.chdir(cwd)
+
+
+    # Share converted RMFs between spectra and processes (numpy backend)
+    # directory defaults to ~/.cache/xrttools/responses
+    def useResponseStore(self, directory = None):
+        if self.backend != "numpy":
+            raise RuntimeError("XRT_Analysis::useResponseStore requires backend = \"numpy\"")
+        self.fitter.responses = _responsestore.ResponseStore(directory)
 
 
     # Use C-Statistics in fitting
     def setCStat(self):
-        xspec.Fit.statMethod = "cstat"
+        self.statMethod = "cstat"
+        if self.backend == "numpy":
+            self.fitter.statMethod = "cstat"
+        else:
+            xspec.Fit.statMethod = "cstat"
 
 
     # Set the grouped PHA file
     def setGroupedPHA(self, igrpFile, ipathFile="./", bRebin = True):
+        self.spectrumFiles = [os.path.abspath(os.path.join(ipathFile, igrpFile))]
+        self.ngroups = 1
+        if self.backend == "numpy":
+            self._setFitter(_forwardfold.ForwardFold)
+            self.grpFileName = os.path.join(ipathFile, igrpFile)
+            self._initializeXSpec(bRebin)
+            return
+
         cwd = os.getcwd()
         os.chdir(ipathFile)
         self.grpFileName = igrpFile
         self._initializeXSpec(bRebin)
         os.chdir(cwd)
 
+    # Load several grouped PHA files for a joint fit, each as its own data group
+    # setModel then ties the shape parameters (PhoIndex or alpha/beta) and nH
+    # across the groups and leaves each group's normalisation (or cflux) free
+    # Relative file names are taken from ipathFile
+    def setJointPHA(self, igrpFiles, ipathFile="./", bRebin = True):
+        self.spectrumFiles = [os.path.abspath(os.path.join(ipathFile, f)) for f in igrpFiles]
+        self.ngroups = len(self.spectrumFiles)
+        self.grpFileName = self.spectrumFiles[0]
+        self.bRebin = bRebin
+        self.m1 = 0
+        with self.timer.stage("load"):
+            if self.backend == "numpy":
+                self._setFitter(_forwardfold.JointForwardFold if self.ngroups > 1 else _forwardfold.ForwardFold)
+                for filename in self.spectrumFiles:
+                    self.fitter.addSpectrum(filename)
+                return
+
+            xspec.AllData.clear()
+            cwd = os.getcwd()
+            # "g:g file" puts spectrum g in data group g, keeping the others;
+            # BACKFILE/RESPFILE/ANCRFILE are relative to each spectrum
+            for g, filename in enumerate(self.spectrumFiles):
+                os.chdir(os.path.dirname(filename))
+                xspec.AllData("%d:%d %s" %(g + 1, g + 1, os.path.basename(filename)))
+            os.chdir(cwd)
+            xspec.Plot.xAxis = "kev"
+            if (bRebin):
+                print ("Rebinning")
+                xspec.Plot.setRebin(5,10)
+            for ignore in self.ignoreRanges:
+                xspec.AllData.ignore(ignore)
+
+
+    # Swap the numpy fitter (single or joint), keeping its configuration
+    def _setFitter(self, cls):
+        if type(self.fitter) is cls:
+            self.fitter.clear()
+            return
+        fitter = cls(self.fitter.responses)
+        for name in ("statMethod", "modelIntrinsic", "abs", "ifcFlux", "emin", "emax", "nH", "nH_frozen"):
+            setattr(fitter, name, getattr(self.fitter, name))
+        self.fitter = fitter
+
+
+    # xspec parameter numbers of the current model, worked out once per setModel:
+    # the shape parameters (set through data group 1, the other groups are
+    # linked to them) and the normalisation of every data group, local to its
+    # model copy ("norm") and in the global numbering used by Fit.error
+    def _jointParameters(self):
+        npar, norm, shape = PARAMETERS[(self.modelIntrinsic, self.ifcFlux)]
+        return {"npar" : npar,
+                "norm" : norm,
+                "shape" : shape,
+                "norm_global" : np.arange(self.ngroups) * npar + norm}
+
+
     # Setting the min/max of the Fit
     def setcfluxMinMax(self, emin, emax):
         self.emin = emin
@@ -152,6 +298,14 @@ class XRT_Analysis():
             self.setModel("pwl")
 
         self.modelType = absorb + str_cflux + mod
+        self.jointIndex = self._jointParameters()
+        if self.backend == "numpy":
+            self.fitter.emin = self.emin
+            self.fitter.emax = self.emax
+            self.fitter.setModel(self.modelIntrinsic, cflux, absorb)
+            self.setNH(self.nH)
+            return
+
         self.m1 = xspec.Model(self.modelType)
 
         if imodel.lower() == "pwl":
@@ -165,23 +319,173 @@ class XRT_Analysis():
             self.m1.cflux.Emax = self.emax
         self.setNH(self.nH)
 
+        # The copies of the other data groups are linked to group 1,
+        # only their normalisation (or lg10Flux) is freed
+        for g in range(2, self.ngroups + 1):
+            xspec.AllModels(g)(self.jointIndex["norm"]).untie()
+
     # Setting the Column Density
     def setNH(self, i_nH, i_fixed = True):
         self.nH = i_nH
-        if (self.abs == "pha"):
+        self.nH_frozen = i_fixed
+        if self.backend == "numpy":
+            self.fitter.setNH(i_nH, i_fixed)
+        elif (self.abs == "pha"):
             self.m1.phabs.nH = i_nH
             self.m1.phabs.nH.frozen = i_fixed
         elif (self.abs == "wabs"):
             self.m1.wabs.nH = i_nH
             self.m1.wabs.nH.frozen = i_fixed
 
+    # Memoise doFit on disk (opt-in)
+    # A fit is reused when the spectra, their BACKFILE/RESPFILE/ANCRFILE and
+    # the model configuration are unchanged; the oldest entries are removed
+    # beyond maxsize bytes. directory defaults to ~/.cache/xrttools/fits
+    def useFitCache(self, directory = None, maxsize = 256 * 1024 * 1024):
+        self.fitCache = _fitcache.FitCache(directory, maxsize)
+
+
+    # Files a fit depends on: the spectra and the files named in their headers
+    def _fitInputs(self):
+        files = []
+        for spec in self.spectrumFiles:
+            files.append(spec)
+            header = _fits.getheader(spec, "SPECTRUM")
+            for key in ("BACKFILE", "RESPFILE", "ANCRFILE"):
+                name = str(header.get(key, "none")).strip()
+                path = os.path.join(os.path.dirname(spec), name)
+                if name.lower() not in ("", "none") and os.path.isfile(path):
+                    files.append(path)
+        return files
+
+
+    def _fitCacheKey(self):
+        config = {"backend" : self.backend,
+                  "modelType" : self.modelType,
+                  "nH" : float(self.nH),
+                  "nH_frozen" : bool(self.nH_frozen),
+                  "emin" : float(self.emin),
+                  "emax" : float(self.emax),
+                  "statistic" : self.statMethod,
+                  "errors" : self.errorMethod,
+                  "ignore" : list(self.ignoreRanges),
+                  "rebin" : bool(self.bRebin)}
+        if self.ngroups > 1:
+            config["groups"] = self.ngroups
+        if self.errorMethod == "bootstrap":
+            config["bootstrap"] = self.errorBootstrap
+        return self.fitCache.key(self._fitInputs(), config)
+
+
+    # Drop the cached fit of the current configuration, or every cached fit
+    def invalidateFitCache(self, bAll = False):
+        if self.fitCache is None:
+            return
+        self.fitCache.invalidate(None if bAll else self._fitCacheKey())
+
+
+    def getFitCacheInfo(self):
+        return self.fitCache.info() if self.fitCache is not None else None
+
+
+    # What doFit leaves behind, stored in the fit cache
+    def _fitState(self):
+        state = {"modelDict" : {k : v for k, v in self.modelDict.items() if k != "Timing"},
+                 "covar" : self.covar,
+                 "covar_labels" : getattr(self, "covar_labels", None),
+                 "index" : getattr(self, "index", None),
+                 "fitParameters" : self.fitParameters}
+        if self.backend == "numpy":
+            state["fitter"] = {"params" : self.fitter.params,
+                               "covar_internal" : self.fitter.covar_internal,
+                               "statistic" : self.fitter.statistic,
+                               "dof" : self.fitter.dof}
+        return state
+
+
+    def _restoreFit(self, state):
+        self.modelDict = state["modelDict"]
+        self.covar = state["covar"]
+        self.covar_labels = state["covar_labels"]
+        self.index = state["index"]
+        self.fitParameters = state["fitParameters"]
+        if self.backend == "numpy":
+            for name, value in state["fitter"].items():
+                setattr(self.fitter, name, value)
+
+
+    # Record wall/CPU time and calls of each stage (load, fit, writeModel,
+    # errors, flux, plot, deabsorb, cache, bands, table, scan, bootstrap)
+    # Every call can be appended to a JSON lines file and/or passed to callback,
+    # with the context keywords (e.g. ObsID) added to each record
+    # Each fit result gets, as "Timing", what was recorded since the previous
+    # one (its loads, fit and errors); getTimings returns the running totals
+    def enableTiming(self, jsonl = None, callback = None, **context):
+        self.timer = StageTimer(True, jsonl, callback, context)
+        self._timingMark = None
+
+
+    def disableTiming(self):
+        self.timer = StageTimer()
+        self._timingMark = None
+
+
+    def getTimings(self):
+        return self.timer.summary()
+
+
+    def _attachTimings(self):
+        if self.timer.enabled:
+            self.modelDict["Timing"] = self.timer.summary(self._timingMark)
+            self._timingMark = self.timer.summary()
+
+
     # Appling the fit and doing some inital Corrections
     def doFit(self):
 
-        xspec.Fit.nIterations = 10000
-        # xspec.Fit.statMethod = 'chi'
-        xspec.Fit.perform()
-        self.writeModel()
+        key = None
+        if self.fitCache is not None:
+            with self.timer.stage("cache"):
+                key = self._fitCacheKey()
+                state = self.fitCache.get(key)
+            if state is not None:
+                self.timer.count("cache_hits")
+                self._restoreFit(state)
+                self._attachTimings()
+                return
+            self.timer.count("cache_misses")
+
+        if self.backend == "numpy":
+            with self.timer.stage("fit"):
+                self.fitter.fit()
+            with self.timer.stage("writeModel"):
+                self.modelDict = self.fitter.writeModel()
+            self.covar = self.modelDict.get("CoVar", None)
+            self.covar_labels = self.modelDict.get("CoVar_labels", None)
+            self.index = self.modelDict.get("Index", self.modelDict.get("Alpha"))
+            self.fitParameters = list(self.fitter.params)
+        else:
+            xspec.Fit.nIterations = 10000
+            # xspec.Fit.statMethod = 'chi'
+            with self.timer.stage("fit"):
+                xspec.Fit.perform()
+            with self.timer.stage("writeModel"):
+                if self.ngroups > 1:
+                    self.writeJointModel()
+                else:
+                    self.writeModel()
+            self.fitParameters = [self.m1(i).values[0] for i in range(1, self.m1.nParameters + 1)]
+            # then the free normalisation of every other data group
+            for g in range(2, self.ngroups + 1):
+                self.fitParameters.append(xspec.AllModels(g)(self.jointIndex["norm"]).values[0])
+        if self.errorMethod == "bootstrap":
+            self.bootstrapErrors(nworkers = self.errorWorkers or 1, **self.errorBootstrap)
+        self.timer.count("fits")
+
+        if key is not None:
+            with self.timer.stage("cache"):
+                self.fitCache.put(key, self._fitState())
+        self._attachTimings()
 
     '''
         With cflux we have the intrinsic integral flux and spectral parameters
@@ -205,30 +509,112 @@ class XRT_Analysis():
     def logpar(self, e, norm, alpha, beta):
         return norm*e**-(alpha + beta * np.log10(e))
 
+    # How writeModel gets the parameter errors (xspec backend)
+    # "profile"     Fit.error scans one after the other, each parameter once
+    # "parallel"    the same scans, each in its own worker process (nworkers)
+    # "covariance"  1 sigma from the fit covariance, no scan at all
+    # "bootstrap"   percentiles of nboot refitted Poisson realisations, see
+    #               bootstrapErrors (both backends, nworkers processes)
+    def setErrorMethod(self, method = "profile", nworkers = None, nboot = 2000, seed = None):
+        if method not in ("profile", "parallel", "covariance", "bootstrap"):
+            raise ValueError("Unknown error method: %s" %method)
+        self.errorMethod = method
+        self.errorWorkers = nworkers
+        self.errorBootstrap = {"nboot" : nboot, "seed" : seed}
+
+
+    # (lower, upper) 1 sigma bounds of xspec parameters, in the order given
+    # Results are kept for the rest of writeModel so no parameter is scanned twice
+    def _parameterErrors(self, indices):
+        todo = [i for i in indices if i not in self._errors]
+        self.timer.count("error_scans", len(todo) if self.errorMethod in ("profile", "parallel") else 0)
+        with self.timer.stage("errors"):
+            self._scanErrors(todo)
+        return [self._errors[i] for i in indices]
+
+
+    def _scanErrors(self, todo):
+        # The bootstrap replaces these once the fit is written
+        if self.errorMethod in ("covariance", "bootstrap"):
+            for i in todo:
+                value = self.m1(i).values[0]
+                sigma = self.m1(i).sigma
+                self._errors[i] = (value - sigma, value + sigma)
+        elif self.errorMethod == "parallel" and len(todo) > 1:
+            npar = self.m1.nParameters
+            values = [list(self.m1(i).values) for i in range(1, npar + 1)]
+            frozen = [self.m1(i).frozen for i in range(1, npar + 1)]
+            # Joint fit: the free normalisation of every other data group
+            norm = self.jointIndex["norm"] if self.ngroups > 1 else None
+            norms = [list(xspec.AllModels(g)(norm).values) for g in range(2, self.ngroups + 1)]
+            self._errors.update(_profile.parallel_errors(self.spectrumFiles, self.ignoreRanges,
+                                                         xspec.Fit.statMethod, self.modelType,
+                                                         values, frozen, todo, self.errorWorkers,
+                                                         norm = norm, norms = norms))
+        else:
+            for i in todo:
+                xspec.Fit.error("1. %d" %i)
+                err = xspec.AllModels(1)(i).error
+                self._errors[i] = (err[0], err[1])
+
+
+    # Absorbed flux (erg cm^-2 s^-1) in emin-emax and its 1 sigma bounds,
+    # propagated from the fit covariance with finite differences of calcFlux
+    def _covarianceFlux(self, emin, emax):
+        erange = "%g %g" %(emin, emax)
+        xspec.AllModels.calcFlux(erange)
+        flux = xspec.AllData(1).flux[0]
+
+        free = [i for i in range(1, self.m1.nParameters + 1)
+                if not self.m1(i).frozen and self.m1(i).link == ""]
+        n = len(free)
+        # Fit.covariance is the packed lower triangle, row by row
+        cov = np.zeros((n, n))
+        cov[np.tril_indices(n)] = xspec.Fit.covariance[:n * (n + 1) // 2]
+        cov = cov + np.tril(cov, -1).T
+
+        grad = np.zeros(n)
+        for j, i in enumerate(free):
+            value = self.m1(i).values[0]
+            h = 1.e-2 * np.sqrt(cov[j][j]) if cov[j][j] > 0 else 1.e-6
+            self.m1(i).values = value + h
+            xspec.AllModels.calcFlux(erange)
+            grad[j] = (xspec.AllData(1).flux[0] - flux) / h
+            self.m1(i).values = value
+        xspec.AllModels.calcFlux(erange)
+
+        sigma = np.sqrt(max(grad @ cov @ grad, 0.))
+        return flux, flux - sigma, flux + sigma
+
+
     # Writing results to a dictionary
     def writeModel(self):
         self.modelDict = {}
+        self._errors = {}
 
         self.modelDict["Chi2"] = xspec.Fit.statistic
         self.modelDict["DOF"] = xspec.Fit.dof
 
         # Plotting energy bins
-        xspec.Plot("data eeufspec model")
-        self.modelDict["Energy [keV]"] = np.array(xspec.Plot.x(1,2))
-        self.modelDict["e2dnde [keV cm^-2 s^-1]"] = np.array(xspec.Plot.y(1,2))
-        self.modelDict["Energy_err [keV]"] = np.array(xspec.Plot.xErr(1,2))
-        self.modelDict["e2dnde_err [keV cm^-2 s^-1]"] = np.array(xspec.Plot.yErr(1,2))
-
-        if self.abs == "wabs":
-            d = deab(self.nH, method = "wabs")
-        else:
-            d = deab(self.nH)
-        self.modelDict["e2dnde_deabsorbed [keV cm^-2 s^-1]"], \
-        self.modelDict["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] = \
-                    d.deabsorb(
-                                self.modelDict["Energy [keV]"],
-                                self.modelDict["e2dnde [keV cm^-2 s^-1]"],
-                                self.modelDict["e2dnde_err [keV cm^-2 s^-1]"])
+        with self.timer.stage("plot"):
+            xspec.Plot("data eeufspec model")
+            self.modelDict["Energy [keV]"] = np.array(xspec.Plot.x(1,2))
+            self.modelDict["e2dnde [keV cm^-2 s^-1]"] = np.array(xspec.Plot.y(1,2))
+            self.modelDict["Energy_err [keV]"] = np.array(xspec.Plot.xErr(1,2))
+            self.modelDict["e2dnde_err [keV cm^-2 s^-1]"] = np.array(xspec.Plot.yErr(1,2))
+
+        # Transmission curves are cached across fits, see getTransmissionCacheInfo
+        with self.timer.stage("deabsorb"):
+            if self.abs == "wabs":
+                d = deab(self.nH, method = "wabs")
+            else:
+                d = deab(self.nH)
+            self.modelDict["e2dnde_deabsorbed [keV cm^-2 s^-1]"], \
+            self.modelDict["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] = \
+                        d.deabsorb(
+                                    self.modelDict["Energy [keV]"],
+                                    self.modelDict["e2dnde [keV cm^-2 s^-1]"],
+                                    self.modelDict["e2dnde_err [keV cm^-2 s^-1]"])
 
 
         if (self.modelIntrinsic == "pwl") :
@@ -241,17 +627,14 @@ class XRT_Analysis():
             else:
                 # getting 1 sigma error instead of default 95%
                 if (self.ifcFlux):
-                    xspec.Fit.error("1. 4")  # cflux
-                    xspec.Fit.error("1. 5")  # index
+                    # cflux, index
+                    _, index_err = self._parameterErrors([4, 5])
                     self.index = float(self.m1.powerlaw.PhoIndex)
-                    index_err = xspec.AllModels(1)(5).error
                 else:
-                    xspec.Fit.error("1. 3")  # norm
-                    xspec.Fit.error("1. 2")  # index
+                    # norm, index
+                    norm_err, index_err = self._parameterErrors([3, 2])
                     norm = float(self.m1.powerlaw.norm)
                     self.index = float(self.m1.powerlaw.PhoIndex)
-                    index_err = xspec.AllModels(1)(2).error
-                    norm_err = xspec.AllModels(1)(3).error
                     # Covariance Matrix
                     cov = xspec.Fit.covariance
 
@@ -305,30 +688,21 @@ class XRT_Analysis():
                 if (self.ifcFlux):
                     pass
                     # getting 1 sigma error instead of default 95%
-                    xspec.Fit.error("1. 4")  # cflux
-                    xspec.Fit.error("1. 5")  # alpha
-                    xspec.Fit.error("1. 6")  # beta
+                    # cflux, alpha, beta
+                    _, alpha_err, beta_err = self._parameterErrors([4, 5, 6])
 
                     alpha = float(self.m1.logpar.alpha)
                     beta = float(self.m1.logpar.beta)
-
-                    alpha_err = xspec.AllModels(1)(5).error
-                    beta_err = xspec.AllModels(1)(6).error
                 else:
 
                     # getting 1 sigma error instead of default 95%
-                    xspec.Fit.error("1. 5")  # norm
-                    xspec.Fit.error("1. 2")  # alpha
-                    xspec.Fit.error("1. 3")  # beta
+                    # norm, alpha, beta
+                    norm_err, alpha_err, beta_err = self._parameterErrors([5, 2, 3])
 
                     alpha = float(self.m1.logpar.alpha)
                     beta = float(self.m1.logpar.beta)
                     norm = float(self.m1.logpar.norm)
 
-                    norm_err = xspec.AllModels(1)(5).error
-                    alpha_err = xspec.AllModels(1)(2).error
-                    beta_err = xspec.AllModels(1)(3).error
-
                     # Get covariance matrix
                     # Outputs a list, I'm sure the order makes sense to someone
                     # but not me
@@ -388,17 +762,16 @@ class XRT_Analysis():
 
             print ("Getting Flux")
             try:
-                err = xspec.Fit.error("1. 4")
+                # Already known if the model branch scanned it
+                par4 = self._parameterErrors([4])[0]
 
                 print("Sigma: ")
                 print (self.m1.cflux.lg10Flux.sigma)
                 print("Log error: ")
-                par4 = self.m1.cflux.lg10Flux.error
                 print (par4)
             except Exception as e:
 
                 print("Problem getting error. Chi^2 greater than 2? \n\t%s"%e)
-                err = -999
                 par4 = [0, 0]
             print("Flux     Flux + Errorup      Flux + Errordown")
             print (np.power(10., self.m1.cflux.lg10Flux.values[0]),
@@ -413,31 +786,35 @@ class XRT_Analysis():
             self.modelDict["Flux_erru [erg cm^-2 s^-1]"] = np.power(10., self.m1.cflux.lg10Flux.values[0] + self.m1.cflux.lg10Flux.sigma) - np.power(10., self.m1.cflux.lg10Flux.values[0])
 
         else :
-            iflux = xspec.AllModels.calcFlux("2. 10.0")
-            iflux_err = xspec.AllModels.calcFlux("2. 10.0 err")
-            iflux_err2 = xspec.AllModels.calcFlux("2. 10.0 1 err")
-
-            iflux = xspec.AllData(1).flux
+            with self.timer.stage("flux"):
+                if self.errorMethod in ("covariance", "bootstrap"):
+                    iflux = self._covarianceFlux(2., 10.)
+                else:
+                    # One Monte Carlo flux calculation gives the flux and its range
+                    xspec.AllModels.calcFlux("2. 10.0 err")
+                    iflux = xspec.AllData(1).flux
             self.modelDict["Flux [erg cm^-2 s^-1]"] = iflux[0]
             self.modelDict["Flux_errl [erg cm^-2 s^-1]"] = iflux[0] - iflux[1]
             self.modelDict["Flux_erru [erg cm^-2 s^-1]"] = iflux[2] - iflux[0]
 
         # Plotting model
-        xspec.Plot("model")
+        with self.timer.stage("plot"):
+            xspec.Plot("model")
 
-        modelenergies = np.array(xspec.Plot.x(1))
+            modelenergies = np.array(xspec.Plot.x(1))
 
-        # masking out bad channels
-        rangemask = ( modelenergies >= 0.3 ) & ( modelenergies <= 10.0 )
+            # masking out bad channels
+            rangemask = ( modelenergies >= 0.3 ) & ( modelenergies <= 10.0 )
 
-        self.modelDict["modelEnergy [keV]"] = modelenergies[rangemask]
-        self.modelDict["model_e2dnde [keV cm^-2 s^-1]"] = modelenergies[rangemask] \
-                                                          * modelenergies[rangemask] \
-                                                          * np.array(xspec.Plot.model())[rangemask]
+            self.modelDict["modelEnergy [keV]"] = modelenergies[rangemask]
+            self.modelDict["model_e2dnde [keV cm^-2 s^-1]"] = modelenergies[rangemask] \
+                                                              * modelenergies[rangemask] \
+                                                              * np.array(xspec.Plot.model())[rangemask]
 
         # Obtaining deabsorb model
-        intrinspec = d.deabsorb(self.modelDict["modelEnergy [keV]"],
-                                self.modelDict["model_e2dnde [keV cm^-2 s^-1]"])
+        with self.timer.stage("deabsorb"):
+            intrinspec = d.deabsorb(self.modelDict["modelEnergy [keV]"],
+                                    self.modelDict["model_e2dnde [keV cm^-2 s^-1]"])
 
 
         self.modelDict["model_intrinsic_e2dnde [keV cm^-2 s^-1]"] = np.array(intrinspec[0])
@@ -445,57 +822,265 @@ class XRT_Analysis():
 
 
 
+    # Writing the results of a joint fit to a dictionary
+    # The shared parameters are at the top level, as in writeModel, and
+    # "Groups" holds one dict per data group with its SED, model, Norm or
+    # cflux and Flux. Only the shared parameters are scanned with Fit.error,
+    # the group normalisations use their sigma from the fit
+    def writeJointModel(self):
+        self.modelDict = {}
+        self._errors = {}
+        idx = self.jointIndex
+        ngroups = self.ngroups
+
+        self.modelDict["Chi2"] = xspec.Fit.statistic
+        self.modelDict["DOF"] = xspec.Fit.dof
+        self.modelDict["nGroups"] = ngroups
+
+        values = [float(self.m1(i).values[0]) for i in idx["shape"]]
+        if (self.modelDict["Chi2"] / self.modelDict["DOF"] > 2. ):
+            errors = [(v, v) for v in values]
+        else:
+            errors = self._parameterErrors(idx["shape"])
+        for key, value, err in zip(SHAPE_KEYS[self.modelIntrinsic], values, errors):
+            self.modelDict[key] = value
+            self.modelDict[key + "_errl"] = value - float(err[0])
+            self.modelDict[key + "_erru"] = float(err[1]) - value
+        self.index = values[0]
+
+        with self.timer.stage("plot"):
+            xspec.Plot("data eeufspec model")
+            seds = [[np.array(xspec.Plot.x(g, 2)), np.array(xspec.Plot.y(g, 2)),
+                     np.array(xspec.Plot.xErr(g, 2)), np.array(xspec.Plot.yErr(g, 2))]
+                    for g in range(1, ngroups + 1)]
+            xspec.Plot("model")
+            models = [[np.array(xspec.Plot.x(g)), np.array(xspec.Plot.model(g))]
+                      for g in range(1, ngroups + 1)]
+
+        if not self.ifcFlux:
+            # One Monte Carlo flux calculation covers every spectrum
+            with self.timer.stage("flux"):
+                xspec.AllModels.calcFlux("2. 10.0 err")
+                fluxes = [xspec.AllData(g).flux for g in range(1, ngroups + 1)]
+
+        d = deab(self.nH, method = "wabs") if self.abs == "wabs" else deab(self.nH)
+        groups = []
+        for g in range(ngroups):
+            res = {"File" : self.spectrumFiles[g]}
+            res["Energy [keV]"], res["e2dnde [keV cm^-2 s^-1]"], \
+            res["Energy_err [keV]"], res["e2dnde_err [keV cm^-2 s^-1]"] = seds[g]
+            with self.timer.stage("deabsorb"):
+                res["e2dnde_deabsorbed [keV cm^-2 s^-1]"], \
+                res["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] = \
+                            d.deabsorb(res["Energy [keV]"],
+                                       res["e2dnde [keV cm^-2 s^-1]"],
+                                       res["e2dnde_err [keV cm^-2 s^-1]"])
+
+            par = xspec.AllModels(g + 1)(idx["norm"])
+            value = float(par.values[0])
+            sigma = float(par.sigma)
+            if self.ifcFlux:
+                res["Flux [erg cm^-2 s^-1]"] = np.power(10., value)
+                res["Flux_errl [erg cm^-2 s^-1]"] = np.power(10., value) - np.power(10., value - sigma)
+                res["Flux_erru [erg cm^-2 s^-1]"] = np.power(10., value + sigma) - np.power(10., value)
+            else:
+                res["Norm"] = value
+                res["Norm_errl"] = sigma
+                res["Norm_erru"] = sigma
+                iflux = fluxes[g]
+                res["Flux [erg cm^-2 s^-1]"] = iflux[0]
+                res["Flux_errl [erg cm^-2 s^-1]"] = iflux[0] - iflux[1]
+                res["Flux_erru [erg cm^-2 s^-1]"] = iflux[2] - iflux[0]
+
+            modelenergies, model = models[g]
+            rangemask = ( modelenergies >= 0.3 ) & ( modelenergies <= 10.0 )
+            res["modelEnergy [keV]"] = modelenergies[rangemask]
+            res["model_e2dnde [keV cm^-2 s^-1]"] = modelenergies[rangemask]**2 * model[rangemask]
+            with self.timer.stage("deabsorb"):
+                intrinspec = d.deabsorb(res["modelEnergy [keV]"], res["model_e2dnde [keV cm^-2 s^-1]"])
+            res["model_intrinsic_e2dnde [keV cm^-2 s^-1]"] = np.array(intrinspec[0])
+            groups.append(res)
+
+        self.modelDict["Groups"] = groups
+
+
     # Calculate the Confidience interval for the fit
     # Return e, fx and delf
     # Interval defined as fx +/- delfx
-    def getConfidienceInterval(self, parms, Cov):
+    # parms (k) and Cov (k x k) can also be stacked, (N x k) and (N x k x k),
+    # for N fits of the same model; fx and delfx are then (N x E)
+    # Parameter order is norm first, Cov order is that of CoVar (norm last)
+    # energy defaults to 50 points over XRT's range
+    # method = "mc" draws ndraw samples per fit, chunk at a time, and returns
+    # the percentiles of the model instead of delfx, (P x E) or (P x N x E)
+    def getConfidienceInterval(self, parms, Cov, energy = None, method = "linear",
+                               percentiles = (16., 50., 84.), ndraw = 10000, chunk = 500, seed = None):
 
         # Define over XRT's range
-        E = np.logspace(np.log10(0.3), 1)
-
-        # power law case
-        if (self.modelIntrinsic == "pwl"):
-            fx = self.pwl(E, parms[0], parms[1])
-
-            # (df/dn)^2 sigma_nn
-            a = Cov[1][1] / parms[0] / parms[0]
-            # (df/dg)^2 sigma_gg
-            b = (np.log(E)**2)*Cov[0][0]
+        E = np.logspace(np.log10(0.3), 1) if energy is None else np.asarray(energy, dtype = float)
 
-            # df/dn * df/dg * sigma_ng
-            c = -2 * np.log(E) * Cov[0][1] / parms[0]
+        if self.modelIntrinsic not in _bands.NPARAMS:
+            print ("Model not yet implemented")
+            return 0, 0, 0
 
-            fdelx = fx * np.sqrt(a + b + c)
+        if method not in ("linear", "mc"):
+            raise ValueError("Unknown method: %s" %method)
 
-        elif (self.modelIntrinsic == "logpar"):
+        parms, Cov, single = _bands.as_batch(parms, Cov)
+        with self.timer.stage("bands"):
+            fx, fdelx = _bands.linear_bands(self.modelIntrinsic, parms, Cov, E)
+            if method == "mc":
+                fdelx = _bands.mc_bands(self.modelIntrinsic, parms, Cov, E, percentiles = percentiles,
+                                        ndraw = ndraw, chunk = chunk, seed = seed)
 
-            fx = self.logpar(E, parms[0], parms[1], parms[2])
-            # (df/dn)^2 sigma_nn
-            a = Cov[2][2] / parms[0] / parms[0]
-            # (df/da)^2 sigma_aa
-            b = (np.log(E)**2)*Cov[0][0]
-            # (df/db)^2 sigma_bb
-            c = (np.log(E) * np.log10(E))**2 *Cov[1][1]
+        if single:
+            return E, fx[0], (fdelx[:, 0] if method == "mc" else fdelx[0])
 
-            # df/dn * df/da * sigma_na
-            d = -2 * np.log(E) * Cov[2][0] / parms[0]
-            # df/dn * df/db * sigma_nb
-            e = -2 * np.log(E) * np.log10(E) * Cov[2][1] / parms[0]
-            # df/da * df/db * sigma_ab
-            f = 2 * np.log(E) **2 * np.log10(E) * Cov[0][1]
+        return E, fx, fdelx
 
-            fdelx = fx * np.sqrt(a + b + c + d + e + f)
-        else :
-            print ("Model not yet implemented")
-            return 0, 0, 0
+    # Statistic over a grid of nH (10^22 cm^-2) and one shape parameter
+    # (parameter = "Index", or "Alpha"/"Beta" for logpar, defaults to the first),
+    # the normalisation and any other shape parameter refitted at every point
+    # numpy: rows of the grid are evaluated vectorised, nworkers processes
+    # share them; xspec: Fit.steppar, which needs evenly spaced grids
+    # Returns the surfaces (nH x values) with the grid minimum, marginal 1 sigma
+    # intervals and the 68/95/99.7% contours, see __gridscan.summarise
+    def gridScan(self, nH, values, parameter = None, nworkers = 1):
+        if self.ngroups > 1:
+            raise RuntimeError("gridScan is not available for joint fits")
+        keys = SHAPE_KEYS[self.modelIntrinsic]
+        if parameter is None:
+            parameter = keys[0]
+        if parameter not in keys:
+            raise ValueError("Unknown parameter for %s: %s" %(self.modelIntrinsic, parameter))
+        axis = keys.index(parameter)
+        nH = np.asarray(nH, dtype = float)
+        values = np.asarray(values, dtype = float)
+        normKey = "lg10Flux" if self.ifcFlux else "lgNorm"
+
+        with self.timer.stage("scan"):
+            if self.backend == "numpy":
+                stat, lgK, shapes = _gridscan.grid_scan(self.fitter, nH, values, axis, nworkers)
+            else:
+                stat, lgK, shapes = self._stepparScan(nH, values, axis, nworkers)
+
+        self.scanDict = _gridscan.summarise(nH, values, stat, parameter)
+        self.scanDict["Profiled"] = {normKey : lgK}
+        for i, key in enumerate(keys):
+            if i != axis:
+                self.scanDict["Profiled"][key] = shapes[:, :, i]
+        return self.scanDict
+
+
+    # Parametric bootstrap of the current fit
+    # nboot Poisson realisations of the source and background counts are drawn
+    # from the best fit and refitted in batches (nworkers processes share them)
+    # The errors of getFitResults (Index/Alpha/Beta, Norm, Flux) become the
+    # distances from the median of the refits to the percentiles (the refits
+    # can be offset from the best fit, e.g. chi^2 at low counts), and the
+    # percentiles (lower, 50, upper) of every parameter are added as "Bootstrap"
+    # With xspec the best fit is refolded through the responses with numpy
+    def bootstrapErrors(self, nboot = 2000, percentiles = (15.87, 84.13), nworkers = 1,
+                        seed = None, batch = None):
+        if self.ngroups > 1:
+            raise RuntimeError("bootstrapErrors is not available for joint fits")
+        fitter = self._bootstrapFitter()
+        # The flux of writeModel: the cflux flux, or 2-10 keV absorbed without cflux
+        with self.timer.stage("bootstrap"):
+            theta, stat, converged, flux = _bootstrap.bootstrap(fitter, nboot, batch, nworkers, seed)
+        result = _bootstrap.summarise(fitter, theta, stat, converged, flux,
+                                      (percentiles[0], 50., percentiles[1]))
+
+        errors = {key : (result[key], key + "_errl", key + "_erru") for key in SHAPE_KEYS[self.modelIntrinsic]}
+        errors["Flux [erg cm^-2 s^-1]"] = (result["Flux [erg cm^-2 s^-1]"],
+                                           "Flux_errl [erg cm^-2 s^-1]", "Flux_erru [erg cm^-2 s^-1]")
+        if "lgNorm" in result:
+            errors["Norm"] = (np.power(10., result["lgNorm"]), "Norm_errl", "Norm_erru")
+        for key, ((lower, median, upper), errl, erru) in errors.items():
+            if key in self.modelDict:
+                self.modelDict[errl] = median - lower
+                self.modelDict[erru] = upper - median
+        self.modelDict["Bootstrap"] = result
+        return result
+
+
+    # ForwardFold at the current best fit, the numpy fitter itself or one
+    # built from the spectra and xspec parameters
+    def _bootstrapFitter(self):
+        if self.backend == "numpy":
+            return self.fitter
+        fitter = _forwardfold.ForwardFold()
+        for filename in self.spectrumFiles:
+            fitter.addSpectrum(filename)
+        fitter.statMethod = self.statMethod
+        fitter.emin = self.emin
+        fitter.emax = self.emax
+        fitter.setModel(self.modelIntrinsic, self.ifcFlux, self.abs)
+        fitter.setNH(self.nH, self.nH_frozen)
+
+        _, norm, shape = PARAMETERS[(self.modelIntrinsic, self.ifcFlux)]
+        values = self.fitParameters
+        theta = [values[norm - 1] if self.ifcFlux else np.log10(values[norm - 1])]
+        theta += [values[i - 1] for i in shape]
+        if not self.nH_frozen:
+            theta += [values[0]]
+        fitter.params = np.array(theta, dtype = float)
+        return fitter
+
+
+    def _stepparScan(self, nH, values, axis, nworkers):
+        for grid in (nH, values):
+            if len(grid) < 2 or not np.allclose(np.diff(grid), grid[1] - grid[0]):
+                raise ValueError("xspec grid scans need evenly spaced grids")
+
+        _, norm, shape = PARAMETERS[(self.modelIntrinsic, self.ifcFlux)]
+        nH0, frozen0 = self.nH, self.nH_frozen
+        # The refit and the scan move every parameter, the session is put
+        # back to the fit of modelDict afterwards
+        saved = [list(self.m1(i).values) for i in range(1, self.m1.nParameters + 1)]
+        self.setNH(nH0, False)
+        if nworkers is not None and nworkers > 1:
+            xspec.Xset.parallel = {"steppar" : nworkers}
+        xspec.Fit.nIterations = 10000
+        try:
+            xspec.Fit.perform()
+            xspec.Fit.steppar("nolog 1 %g %g %d %d %g %g %d" %(nH[0], nH[-1], len(nH) - 1,
+                                                              shape[axis], values[0], values[-1],
+                                                              len(values) - 1))
+            steps = {"stat" : xspec.Fit.stepparResults("statistic"),
+                     "nH" : xspec.Fit.stepparResults("1"),
+                     "value" : xspec.Fit.stepparResults(str(shape[axis])),
+                     "norm" : xspec.Fit.stepparResults(str(norm))}
+            for i in shape:
+                steps[i] = xspec.Fit.stepparResults(str(i))
+        finally:
+            self.setNH(nH0, frozen0)
+            for i, par in enumerate(saved, start = 1):
+                self.m1(i).values = par
+
+        stat = np.full((len(nH), len(values)), np.nan)
+        lgK = np.full_like(stat, np.nan)
+        shapes = np.full(stat.shape + (len(shape),), np.nan)
+        rows = np.abs(np.asarray(steps["nH"])[:, None] - nH).argmin(axis = 1)
+        cols = np.abs(np.asarray(steps["value"])[:, None] - values).argmin(axis = 1)
+        stat[rows, cols] = steps["stat"]
+        normValues = np.asarray(steps["norm"], dtype = float)
+        lgK[rows, cols] = normValues if self.ifcFlux else np.log10(normValues)
+        for k, i in enumerate(shape):
+            shapes[rows, cols, k] = steps[i]
+        return stat, lgK, shapes
 
-        return E, fx, fdelx
 
     # Return the dict of results
     def getFitResults(self):
         return self.modelDict
 
 
+    # Per data group results of a joint fit (one dict per spectrum, in load order)
+    def getGroupResults(self):
+        return self.modelDict.get("Groups", [self.modelDict])
+
+
     # Return the flux and the error
     def getFlux(self):
         # print self.
@@ -571,28 +1156,46 @@ class XRT_Analysis():
         return fig
 
 
+    # Hit/miss counters of the shared deabsorption cache
+    def getTransmissionCacheInfo(self):
+        return transmission_cache.info()
+
+
     # Get fTest probability of two fits
     def fTest(self, chi2_a,  dof_a, chi2_b, dof_b ):
+        if self.backend == "numpy":
+            from scipy.stats import f as fdist
+            fstat = ((chi2_a - chi2_b) / (dof_a - dof_b)) / (chi2_b / dof_b)
+            return fdist.sf(fstat, dof_a - dof_b, dof_b)
         return xspec.Fit.ftest(chi2_a, dof_a, chi2_b, dof_b)
 
 
 
     def writeSpecTable(self):
-        is_ul = [False for i in range(len(self.modelDict["e2dnde [keV cm^-2 s^-1]"]))]
-
-        cols = [ self.modelDict["Energy [keV]"] * u.keV,
-                self.modelDict["Energy [keV]"] * u.keV - self.modelDict["Energy_err [keV]"]/2 * u.keV,
-                self.modelDict["Energy [keV]"] * u.keV + self.modelDict["Energy_err [keV]"]/2 * u.keV,
-                self.modelDict["e2dnde [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s ,
-                self.modelDict["e2dnde_err [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s,
-                self.modelDict["e2dnde [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s + self.modelDict["e2dnde_err [keV cm^-2 s^-1]"]/2 * u.keV / u.cm / u.cm / u.s ,
-                self.modelDict["e2dnde [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s - self.modelDict["e2dnde_err [keV cm^-2 s^-1]"]/2 * u.keV / u.cm / u.cm / u.s ,
-                is_ul
-                #self.modelDict["e2dnde_deabsorbed [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s,
-                #self.modelDict["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s
-                ]
-
-        colnam = ["e_ref", "e_min", "e_max", "e2dnde", "e2dnde_err", "e2dnde_errp", "e2dnde_errn", "is_ul" ]
-
-        tabl = Table(cols, names = colnam)
+        with self.timer.stage("table"):
+            is_ul = [False for i in range(len(self.modelDict["e2dnde [keV cm^-2 s^-1]"]))]
+
+            # Units are built once, not per column
+            keV = u.keV
+            flux_unit = u.Unit("keV cm-2 s-1")
+            energy = self.modelDict["Energy [keV]"]
+            energy_err = self.modelDict["Energy_err [keV]"]
+            e2dnde = self.modelDict["e2dnde [keV cm^-2 s^-1]"]
+            e2dnde_err = self.modelDict["e2dnde_err [keV cm^-2 s^-1]"]
+
+            cols = [ energy << keV,
+                    (energy - energy_err/2) << keV,
+                    (energy + energy_err/2) << keV,
+                    e2dnde << flux_unit,
+                    e2dnde_err << flux_unit,
+                    (e2dnde + e2dnde_err/2) << flux_unit,
+                    (e2dnde - e2dnde_err/2) << flux_unit,
+                    is_ul
+                    #self.modelDict["e2dnde_deabsorbed [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s,
+                    #self.modelDict["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] * u.keV / u.cm / u.cm / u.s
+                    ]
+
+            colnam = ["e_ref", "e_min", "e_max", "e2dnde", "e2dnde_err", "e2dnde_errp", "e2dnde_errn", "is_ul" ]
+
+            tabl = _table.Table(cols, names = colnam)
         return tabl
@@ -0,0 +1,197 @@
+'''
+    Batch fitting of every grouped spectrum in a Reprocessed/ tree
+
+    Each observation is fitted in a worker process with its own XRT_Analysis
+    (and so its own xspec session), and the results are collected in a table
+'''
+
+import os
+import numpy as np
+
+
+# Read run_selection.dat as written by TestReduction.sh, "OBS_ID MODE" per line
+def read_run_selection(filename):
+    selection = {}
+    with open(filename) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].upper() in ("PC", "WT"):
+                selection[parts[0]] = parts[1].lower()
+    return selection
+
+
+# List (ObsID, mode, directory) for every OBS_ID/{pc,wt}_grp.pha
+# With a run selection only the selected mode of the selected ObsIDs is kept
+def find_spectra(reprocessedDir, runSelection = None):
+    if runSelection is not None and not isinstance(runSelection, dict):
+        runSelection = read_run_selection(runSelection)
+
+    tasks = []
+    for obsid in sorted(os.listdir(reprocessedDir)):
+        obsdir = os.path.join(reprocessedDir, obsid)
+        if not os.path.isdir(obsdir):
+            continue
+        if runSelection is not None:
+            if obsid not in runSelection:
+                continue
+            modes = [runSelection[obsid]]
+        else:
+            modes = ["pc", "wt"]
+
+        for mode in modes:
+            if os.path.isfile(os.path.join(obsdir, "%s_grp.pha" %mode)):
+                tasks.append((obsid, mode, obsdir))
+    return tasks
+
+
+# XRT_Analysis with the options of config (no spectrum loaded yet)
+def _new_analysis(config, **context):
+    from XRTAnalysis import XRT_Analysis
+
+    analysis = XRT_Analysis(backend = config.get("backend", "xspec"))
+    if config.get("timing", None) is not None:
+        analysis.enableTiming(config["timing"], **context)
+    if config.get("responseStore", False):
+        analysis.useResponseStore(config.get("responseStoreDir", None))
+    if config.get("fitCache", False):
+        analysis.useFitCache(config.get("fitCacheDir", None))
+    analysis.setErrorMethod(config.get("errorMethod", "profile"), nboot = config.get("nboot", 2000))
+    return analysis
+
+
+# Statistic, model and nH of config, once the spectra are loaded
+def _set_model(analysis, config):
+    if config.get("cstat", False):
+        analysis.setCStat()
+    analysis.setcfluxMinMax(config.get("emin", 0.3), config.get("emax", 10.))
+    analysis.setModel(config.get("model", "pwl"),
+                      cflux = config.get("cflux", True),
+                      absorb = config.get("absorb", "pha"))
+    analysis.setNH(config["nH"])
+
+
+# TSTART and TSTOP (s, mission time) of a spectrum, NaN when its header has none
+def spectrum_times(filename):
+    from astropy.io import fits
+    header = fits.getheader(filename, "SPECTRUM")
+    return {key : float(header.get(key, np.nan)) for key in ("TSTART", "TSTOP")}
+
+
+# Fit a single observation, run inside the worker process
+def fit_observation(obsid, mode, obsdir, config):
+    result = {"ObsID" : obsid, "Mode" : mode.upper(), "Status" : "OK",
+              "Model" : config.get("model", "pwl"), "nH" : config["nH"]}
+    try:
+        result.update(spectrum_times(os.path.join(obsdir, "%s_grp.pha" %mode)))
+        analysis = _new_analysis(config, ObsID = obsid, Mode = mode.upper())
+        analysis.setGroupedPHA("%s_grp.pha" %mode, obsdir)
+        _set_model(analysis, config)
+        analysis.doFit()
+        result.update(analysis.getFitResults())
+    except Exception as e:
+        result["Status"] = "FAILED: %s" %e
+    return result
+
+
+# Make sure each worker starts with a clean interpreter (and xspec session)
+def _init_worker(path):
+    import sys
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    try:
+        import xspec
+        xspec.Xset.chatter = 0
+        xspec.Xset.logChatter = 0
+    except ImportError:
+        pass
+
+
+# Collect result dicts in one astropy Table
+# Scalars become regular columns, arrays (SEDs, covariance) and dicts (Timing) object columns
+def results_table(results):
+    from astropy.table import Table
+
+    names = []
+    for res in results:
+        for key in res:
+            if key not in names:
+                names.append(key)
+
+    cols = []
+    for name in names:
+        values = [res.get(name, None) for res in results]
+        scalar = all(v is None or (np.ndim(v) == 0 and not isinstance(v, dict)) for v in values)
+        if scalar and all(isinstance(v, str) for v in values if v is not None):
+            cols.append([("" if v is None else v) for v in values])
+        elif scalar:
+            cols.append(np.array([np.nan if v is None else v for v in values], dtype = float))
+        else:
+            col = np.empty(len(values), dtype = object)
+            col[:] = values
+            cols.append(col)
+    return Table(cols, names = names)
+
+
+# Fit every spectrum of a Reprocessed/ tree with nworkers processes
+# config holds the fit options: backend, model, cflux, absorb, nH, emin, emax, cstat,
+# responseStore, fitCache, errorMethod, nboot, timing (JSON lines file of stage timings)
+# With store (a directory) the results are also appended to an XRTResults store
+def batch_fit(reprocessedDir, nH, runSelection = None, nworkers = None,
+              verbose = True, store = None, **config):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing as mp
+
+    config["nH"] = nH
+    tasks = find_spectra(reprocessedDir, runSelection)
+    if nworkers is None:
+        nworkers = os.cpu_count()
+
+    results = []
+    path = os.path.dirname(os.path.abspath(__file__))
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers = nworkers, mp_context = ctx,
+                             initializer = _init_worker, initargs = (path,)) as pool:
+        futures = [pool.submit(fit_observation, obsid, mode, obsdir, config)
+                   for obsid, mode, obsdir in tasks]
+        for i, fut in enumerate(as_completed(futures)):
+            res = fut.result()
+            results.append(res)
+            if verbose:
+                print ("[%d/%d] %s %s: %s" %(i + 1, len(tasks), res["ObsID"], res["Mode"], res["Status"]))
+
+    results.sort(key = lambda r: (r["ObsID"], r["Mode"]))
+    if store is not None:
+        from XRTResults import ResultsStore
+        ResultsStore(store).append(results)
+    return results_table(results)
+
+
+# Joint fit of every spectrum of a Reprocessed/ tree, one data group per
+# observation: the index (or alpha/beta) and nH are shared, each observation
+# keeps its own normalisation or cflux. A single fit, run in this process
+# Returns the shared results (Chi2, DOF, Index...) and a table with one row
+# per observation (Flux, Norm, SED), which can be appended to a store
+def joint_fit(reprocessedDir, nH, runSelection = None, store = None, **config):
+    config["nH"] = nH
+    tasks = find_spectra(reprocessedDir, runSelection)
+    if len(tasks) == 0:
+        raise ValueError("No grouped spectra found in %s" %reprocessedDir)
+
+    analysis = _new_analysis(config, Groups = len(tasks))
+    analysis.setJointPHA([os.path.join(obsdir, "%s_grp.pha" %mode) for _, mode, obsdir in tasks])
+    _set_model(analysis, config)
+    analysis.doFit()
+
+    shared = {key : value for key, value in analysis.getFitResults().items() if key != "Groups"}
+    results = []
+    for (obsid, mode, obsdir), res in zip(tasks, analysis.getGroupResults()):
+        result = {"ObsID" : obsid, "Mode" : mode.upper(), "Status" : "OK",
+                  "Model" : config.get("model", "pwl"), "nH" : nH}
+        result.update(spectrum_times(os.path.join(obsdir, "%s_grp.pha" %mode)))
+        result.update(res)
+        results.append(result)
+
+    if store is not None:
+        from XRTResults import ResultsStore
+        ResultsStore(store).append(results)
+    return shared, results_table(results)
@@ -0,0 +1,203 @@
+'''
+    Helpers for XRT cleaned event files (*_cl.evt)
+
+    Events are read through astropy's memory map, only the requested columns
+    are touched, and sky positions use the TAN projection stored in the
+    X/Y column keywords
+'''
+
+import numpy as np
+from __lazy import LazyModule
+
+fits = LazyModule("astropy.io.fits")
+
+
+# Open an event file and return (EVENTS data, EVENTS header)
+# The data stays memory-mapped, columns are only read when accessed
+def open_events(filename):
+    hdul = fits.open(filename, memmap = True)
+    return hdul, hdul["EVENTS"].data, hdul["EVENTS"].header
+
+
+# Exposure of an event file, EVENTS header first then primary
+def event_exposure(filename):
+    with fits.open(filename, memmap = True) as hdul:
+        if "EXPOSURE" in hdul["EVENTS"].header:
+            return float(hdul["EVENTS"].header["EXPOSURE"])
+        return float(hdul[0].header["EXPOSURE"])
+
+
+# (n x 2) START/STOP of the GTI extension, sorted by start time
+def read_gti(hdul, extname = "GTI"):
+    data = hdul[extname].data
+    gti = np.stack([np.asarray(data["START"], dtype = float),
+                    np.asarray(data["STOP"], dtype = float)], axis = 1)
+    return gti[np.argsort(gti[:, 0], kind = "stable")]
+
+
+# Good time (s) elapsed between the first GTI start and each time t
+# It is piecewise linear (slope 1 inside a GTI, flat in the gaps), so a
+# single np.interp handles any number of times and GTIs
+def good_time(gti, t):
+    cum = np.concatenate([[0.], np.cumsum(gti[:, 1] - gti[:, 0])])
+    return np.interp(t, gti.ravel(), np.repeat(cum, 2)[1:-1])
+
+
+# Inverse of good_time: the time at which c seconds of good time have elapsed
+def good_time_inverse(gti, c):
+    cum = np.concatenate([[0.], np.cumsum(gti[:, 1] - gti[:, 0])])
+    return np.interp(c, np.repeat(cum, 2)[1:-1], gti.ravel())
+
+
+# Good time (s) inside each bin [edges[i], edges[i + 1])
+def gti_exposure(gti, edges):
+    return np.diff(good_time(gti, edges))
+
+
+# GTIs clipped to [tstart, tstop)
+def clip_gti(gti, tstart, tstop):
+    clipped = np.clip(gti, tstart, tstop)
+    return clipped[clipped[:, 1] > clipped[:, 0]]
+
+
+# Sky pixel WCS of the X/Y columns
+# Returns (crval, crpix, cdelt) as arrays ordered (x, y)
+def sky_wcs(header, columns = ("X", "Y")):
+    names = [header["TTYPE%d" %(i + 1)].strip().upper() for i in range(header["TFIELDS"])]
+    crval = []
+    crpix = []
+    cdelt = []
+    for col in columns:
+        n = names.index(col) + 1
+        crval.append(float(header["TCRVL%d" %n]))
+        crpix.append(float(header["TCRPX%d" %n]))
+        cdelt.append(float(header["TCDLT%d" %n]))
+    return np.array(crval), np.array(crpix), np.array(cdelt)
+
+
+# Gnomonic (TAN) projection of RA/Dec (deg) to sky pixels
+def radec_to_sky(header, ra, dec):
+    crval, crpix, cdelt = sky_wcs(header)
+    ra0, dec0 = np.radians(crval)
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+
+    cosc = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+    xi = np.cos(dec) * np.sin(ra - ra0) / cosc
+    eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cosc
+
+    x = crpix[0] + np.degrees(xi) / cdelt[0]
+    y = crpix[1] + np.degrees(eta) / cdelt[1]
+    return x, y
+
+
+# Sky pixel size in arcsec
+def pixel_size(header):
+    _, _, cdelt = sky_wcs(header)
+    return abs(cdelt[1]) * 3600.
+
+
+# Distance (arcsec) of sky pixel positions from RA/Dec
+def sky_distance(x, y, header, ra, dec):
+    x0, y0 = radec_to_sky(header, ra, dec)
+    dx = np.asarray(x, dtype = float) - x0
+    dy = np.asarray(y, dtype = float) - y0
+    return np.hypot(dx, dy) * pixel_size(header)
+
+
+# Distance (arcsec) of every event from RA/Dec
+def radial_distance(data, header, ra, dec):
+    return sky_distance(data["X"], data["Y"], header, ra, dec)
+
+
+# Radius units used in ds9 regions, in arcsec
+_REGION_UNITS = {'"' : 1., "'" : 60., "d" : 3600.}
+
+
+def _region_value(text):
+    text = text.strip()
+    if text[-1] in _REGION_UNITS:
+        return float(text[:-1]) * _REGION_UNITS[text[-1]]
+    return float(text)
+
+
+# Parse the icrs circular/annulus regions written by ReduceXRT.sh
+# Returns a list of (shape, ra, dec, radii in arcsec, include)
+def read_region(filename):
+    regions = []
+    with open(filename) as f:
+        for line in f:
+            for item in line.split(";"):
+                item = item.strip()
+                if "(" not in item:
+                    continue
+                include = not item.startswith("-")
+                shape, args = item.lstrip("+-").split("(", 1)
+                args = args.rstrip(")").split(",")
+                shape = shape.strip().lower()
+                if shape == "circle":
+                    shape = "circular"
+                if shape not in ("circular", "annulus"):
+                    raise ValueError("Unsupported region shape: %s" %shape)
+                radii = [_region_value(a) for a in args[2:]]
+                regions.append((shape, float(args[0]), float(args[1]), radii, include))
+    return regions
+
+
+# Boolean mask of sky pixel positions inside the regions
+# (includes OR'ed, excludes removed)
+# Radial distances are computed once per region centre; pass a dict as
+# cache to share them between several region files
+def pixel_region_mask(x, y, header, regions, cache = None):
+    if cache is None:
+        cache = {}
+    mask = np.zeros(len(x), dtype = bool)
+    exclude = np.zeros(len(x), dtype = bool)
+    for shape, ra, dec, radii, include in regions:
+        if (ra, dec) not in cache:
+            cache[(ra, dec)] = sky_distance(x, y, header, ra, dec)
+        r = cache[(ra, dec)]
+        if shape == "circular":
+            sel = r <= radii[0]
+        else:
+            sel = (r >= radii[0]) & (r <= radii[1])
+        if include:
+            mask |= sel
+        else:
+            exclude |= sel
+    return mask & ~exclude
+
+
+# Same as pixel_region_mask for the events of an EVENTS table
+def region_mask(data, header, regions, cache = None):
+    return pixel_region_mask(data["X"], data["Y"], header, regions, cache)
+
+
+# Geometric area of the regions in sky pixels^2 (overlaps are not removed)
+def region_area(header, regions):
+    pix = pixel_size(header)
+    area = 0.
+    for shape, ra, dec, radii, include in regions:
+        if shape == "circular":
+            a = np.pi * radii[0]**2
+        else:
+            a = np.pi * (radii[1]**2 - radii[0]**2)
+        area += a if include else -a
+    return area / pix**2
+
+
+# WT mode is one dimensional: the region size is the length (in pixels)
+# it covers across the readout window, halfwidth pixels either side of the
+# source. This is the scale of the BACKSCAL values used in ReduceXRT.sh
+# (40 for the source circle, 39 for the background annulus)
+def region_length(header, regions, halfwidth = 100.):
+    pix = pixel_size(header)
+    length = 0.
+    for shape, ra, dec, radii, include in regions:
+        r = [min(rad / pix, halfwidth) for rad in radii]
+        if shape == "circular":
+            l = 2. * r[0]
+        else:
+            l = 2. * (r[1] - r[0])
+        length += l if include else -l
+    return length
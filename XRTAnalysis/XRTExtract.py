@@ -0,0 +1,168 @@
+'''
+    Region spectrum extraction from cleaned event files
+
+    Replaces the per-region xselect sessions of extract_spectrum in
+    ReduceXRT.sh: the events are read once, every region is applied as a
+    vectorised mask and the PI channels are binned with np.bincount
+'''
+
+import numpy as np
+
+from __lazy import LazyModule
+from XRTEvents import open_events, read_region, pixel_region_mask, region_area, region_length
+from XRTEvents import radec_to_sky, sky_wcs, pixel_size
+
+fits = LazyModule("astropy.io.fits")
+
+
+# Keywords copied from the event file to the spectrum, as xselect does
+COPY_KEYS = ["TELESCOP", "INSTRUME", "DATAMODE", "FILTER", "OBS_ID", "OBJECT",
+             "TARG_ID", "SEG_NUM", "DATE-OBS", "DATE-END", "TSTART", "TSTOP",
+             "ONTIME", "LIVETIME", "EXPOSURE", "DEADC", "RA_OBJ", "DEC_OBJ",
+             "RA_PNT", "DEC_PNT", "PA_PNT", "RA_NOM", "DEC_NOM", "MJDREFI",
+             "MJDREFF", "TIMESYS", "TIMEREF", "TIMEUNIT", "EQUINOX", "RADECSYS",
+             "XRTVSUB", "XRTTIMES", "CLOCKAPP"]
+
+
+# Number of PI channels from the column's TLMIN/TLMAX
+def pi_channels(header):
+    names = [header["TTYPE%d" %(i + 1)].strip().upper() for i in range(header["TFIELDS"])]
+    n = names.index("PI") + 1
+    tlmin = int(header.get("TLMIN%d" %n, 0))
+    tlmax = int(header.get("TLMAX%d" %n, 1023))
+    return tlmin, tlmax - tlmin + 1
+
+
+# Sky image size from the X/Y TLMIN/TLMAX, used to normalise BACKSCAL
+def _sky_size(header):
+    names = [header["TTYPE%d" %(i + 1)].strip().upper() for i in range(header["TFIELDS"])]
+    size = 1.
+    for col in ("X", "Y"):
+        n = names.index(col) + 1
+        size *= int(header.get("TLMAX%d" %n, 1000)) - int(header.get("TLMIN%d" %n, 1)) + 1
+    return size
+
+
+# BACKSCAL of a region as xselect writes it: the area as a fraction of the
+# sky image, or in WT mode the length across the readout window
+def region_backscal(header, regions):
+    if str(header.get("DATAMODE", "")).strip().upper() == "WINDOWED":
+        return region_length(header, regions)
+    return region_area(header, regions) / _sky_size(header)
+
+
+# Weighted map (WMAP) of the selected events over the bounding box of the
+# regions, used by xrtmkarf with srcx = srcy = -1
+# Pixels outside the regions are set to -1
+def weighted_map(x, y, header, regions):
+    rpix = max(r[3][-1] for r in regions) / pixel_size(header)
+    xc, yc = radec_to_sky(header, regions[0][1], regions[0][2])
+    xlo, xhi = int(np.floor(xc - rpix)), int(np.ceil(xc + rpix))
+    ylo, yhi = int(np.floor(yc - rpix)), int(np.ceil(yc + rpix))
+
+    gx, gy = np.meshgrid(np.arange(xlo, xhi + 1), np.arange(ylo, yhi + 1))
+    inside = pixel_region_mask(gx.ravel(), gy.ravel(), header, regions).reshape(gx.shape)
+
+    box = (x >= xlo) & (x <= xhi) & (y >= ylo) & (y <= yhi)
+    wmap = np.zeros(gx.shape, dtype = np.float32)
+    np.add.at(wmap, (y[box] - ylo, x[box] - xlo), 1.)
+    wmap[~inside] = -1.
+
+    hdu = fits.PrimaryHDU(wmap)
+    crval, crpix, cdelt = sky_wcs(header)
+    hdu.header["HDUNAME"] = "WMAP"
+    hdu.header["WMREBIN"] = 1
+    hdu.header["CTYPE1"] = "RA---TAN"
+    hdu.header["CTYPE2"] = "DEC--TAN"
+    hdu.header["CRVAL1"] = crval[0]
+    hdu.header["CRVAL2"] = crval[1]
+    hdu.header["CRPIX1"] = crpix[0] - xlo + 1
+    hdu.header["CRPIX2"] = crpix[1] - ylo + 1
+    hdu.header["CDELT1"] = cdelt[0]
+    hdu.header["CDELT2"] = cdelt[1]
+    hdu.header["WCSNAMEP"] = "PHYSICAL"
+    hdu.header["CTYPE1P"] = "X"
+    hdu.header["CTYPE2P"] = "Y"
+    hdu.header["CRPIX1P"] = 1.
+    hdu.header["CRPIX2P"] = 1.
+    hdu.header["CRVAL1P"] = float(xlo)
+    hdu.header["CRVAL2P"] = float(ylo)
+    hdu.header["CDELT1P"] = 1.
+    hdu.header["CDELT2P"] = 1.
+    hdu.header["LTV1"] = 1. - xlo
+    hdu.header["LTV2"] = 1. - ylo
+    hdu.header["LTM1_1"] = 1.
+    hdu.header["LTM2_2"] = 1.
+    return hdu
+
+
+# OGIP type I PHA file
+def write_pha(filename, counts, exposure, backscal, evtheader, tlmin = 0,
+              primary = None, gti = None):
+    channel = np.arange(tlmin, tlmin + len(counts), dtype = np.int32)
+    cols = [fits.Column(name = "CHANNEL", format = "J", array = channel),
+            fits.Column(name = "COUNTS", format = "J", unit = "count",
+                        array = counts.astype(np.int32))]
+    spec = fits.BinTableHDU.from_columns(cols, name = "SPECTRUM")
+    hdr = spec.header
+    for key in COPY_KEYS:
+        if key in evtheader:
+            hdr[key] = evtheader[key]
+    hdr["EXPOSURE"] = exposure
+    hdr["BACKSCAL"] = backscal
+    hdr["AREASCAL"] = 1.
+    hdr["CORRSCAL"] = 0.
+    hdr["BACKFILE"] = "none"
+    hdr["CORRFILE"] = "none"
+    hdr["RESPFILE"] = "none"
+    hdr["ANCRFILE"] = "none"
+    hdr["POISSERR"] = True
+    hdr["SYS_ERR"] = 0
+    hdr["QUALITY"] = 0
+    hdr["GROUPING"] = 0
+    hdr["DETCHANS"] = len(counts)
+    hdr["CHANTYPE"] = "PI"
+    hdr["TLMIN1"] = tlmin
+    hdr["TLMAX1"] = tlmin + len(counts) - 1
+    hdr["HDUCLASS"] = "OGIP"
+    hdr["HDUCLAS1"] = "SPECTRUM"
+    hdr["HDUVERS"] = "1.2.1"
+    hdr["HDUCLAS2"] = "TOTAL"
+    hdr["HDUCLAS3"] = "COUNT"
+
+    if primary is None:
+        primary = fits.PrimaryHDU()
+    hdus = [primary, spec]
+    if gti is not None:
+        hdus.append(gti)
+    fits.HDUList(hdus).writeto(filename, overwrite = True)
+
+
+# Extract one spectrum per (region file, output pha) from a single read
+# mask is an optional boolean array applied to the events first
+# (e.g. a time selection), exposure overrides the EVENTS exposure
+def extract_spectra(evtfile, outputs, mask = None, exposure = None, gti = None):
+    hdul, data, header = open_events(evtfile)
+    with hdul:
+        tlmin, nchan = pi_channels(header)
+        pi = np.asarray(data["PI"], dtype = np.int64) - tlmin
+        x = np.asarray(data["X"], dtype = np.int64)
+        y = np.asarray(data["Y"], dtype = np.int64)
+        if exposure is None:
+            exposure = float(header.get("EXPOSURE", hdul[0].header.get("EXPOSURE", 0.)))
+        if gti is None and "GTI" in hdul:
+            gti = fits.BinTableHDU(hdul["GTI"].data.copy(), hdul["GTI"].header.copy())
+
+        good = (pi >= 0) & (pi < nchan)
+        if mask is not None:
+            good &= mask
+
+        cache = {}
+        for regfile, phafile in outputs:
+            regions = read_region(regfile)
+            sel = good & pixel_region_mask(x, y, header, regions, cache)
+            counts = np.bincount(pi[sel], minlength = nchan)[:nchan]
+            backscal = region_backscal(header, regions)
+            primary = weighted_map(x[sel], y[sel], header, regions)
+
+            write_pha(phafile, counts, exposure, backscal, header, tlmin, primary, gti)
@@ -0,0 +1,246 @@
+'''
+    In-process channel grouping, the grppha step of ReduceXRT.sh
+
+    GROUPING/QUALITY are computed from cumulative sums of the COUNTS column
+    and the grouped PHA (with BACKFILE/RESPFILE/ANCRFILE) is written once.
+    Three strategies:
+        min      at least N counts per group (grppha "group min N")
+        snr      background-subtracted signal to noise of at least N
+        optimal  Kaastra & Bleeker (2016) binning from the RMF resolution
+'''
+
+import os
+import numpy as np
+
+from __lazy import LazyModule
+
+fits = LazyModule("astropy.io.fits")
+
+
+# grppha flags
+QUALITY_GOOD = 0
+QUALITY_BAD = 5
+QUALITY_INCOMPLETE = 2
+
+
+# "0-29" style channel ranges to a boolean mask over channel numbers
+def channel_ranges(ranges, channel):
+    mask = np.zeros(len(channel), dtype = bool)
+    if ranges is None:
+        return mask
+    for item in str(ranges).split(","):
+        lo, _, hi = item.strip().partition("-")
+        hi = hi if hi else lo
+        mask |= (channel >= int(lo)) & (channel <= int(hi))
+    return mask
+
+
+# Turn group end indices (exclusive, over the good channels) into GROUPING/QUALITY
+def _flags(good, ends, complete):
+    nchan = len(good)
+    grouping = np.ones(nchan, dtype = np.int16)
+    quality = np.full(nchan, QUALITY_BAD, dtype = np.int16)
+
+    idx = np.nonzero(good)[0]
+    starts = np.concatenate([[0], ends[:-1]])
+    member = np.full(len(idx), -1, dtype = np.int16)
+    first = np.zeros(len(idx), dtype = bool)
+    first[starts[starts < len(idx)]] = True
+    member[first] = 1
+    grouping[idx] = member
+
+    qual = np.full(len(idx), QUALITY_GOOD, dtype = np.int16)
+    if not complete and len(ends):
+        qual[starts[-1]:] = QUALITY_INCOMPLETE
+    quality[idx] = qual
+    return grouping, quality
+
+
+# Walk the cumulative sum, each group ending at the first channel that satisfies ok
+# ok(start, stop) is vectorised over an array of candidate stops
+def _scan(n, ok):
+    ends = []
+    start = 0
+    while start < n:
+        stops = np.arange(start + 1, n + 1)
+        hit = np.nonzero(ok(start, stops))[0]
+        if len(hit) == 0:
+            ends.append(n)
+            return np.array(ends), False
+        start = stops[hit[0]]
+        ends.append(start)
+    return np.array(ends), True
+
+
+# grppha "group min N": consecutive good channels until N counts
+def group_min_counts(counts, minimum, good):
+    c = np.asarray(counts, dtype = float)[good]
+    cum = np.concatenate([[0.], np.cumsum(c)])
+
+    ends = []
+    start = 0
+    n = len(c)
+    complete = True
+    while start < n:
+        # first stop with cum[stop] - cum[start] >= minimum
+        stop = int(np.searchsorted(cum, cum[start] + minimum, side = "left"))
+        if stop > n:
+            ends.append(n)
+            complete = False
+            break
+        stop = max(stop, start + 1)
+        ends.append(stop)
+        start = stop
+    return _flags(good, np.array(ends, dtype = int), complete)
+
+
+# Minimum background-subtracted signal to noise per group
+# backratio scales background counts to the source (exposure and BACKSCAL)
+def group_min_snr(counts, snr, good, bkg = None, backratio = 0.):
+    S = np.concatenate([[0.], np.cumsum(np.asarray(counts, dtype = float)[good])])
+    if bkg is None:
+        B = np.zeros_like(S)
+    else:
+        B = np.concatenate([[0.], np.cumsum(np.asarray(bkg, dtype = float)[good])])
+
+    def ok(start, stops):
+        s = S[stops] - S[start]
+        b = B[stops] - B[start]
+        var = s + backratio**2 * b
+        return (var > 0) & ((s - backratio * b) >= snr * np.sqrt(np.maximum(var, 1.e-30)))
+
+    ends, complete = _scan(len(S) - 1, ok)
+    return _flags(good, ends, complete)
+
+
+# FWHM (in channels) of the redistribution at every channel, from a
+# read_rmf / ResponseStore dict
+def channel_fwhm(rmf, nchan):
+    matrix = rmf["matrix"].tocsr()
+    rows = np.diff(matrix.indptr)
+    nonempty = rows > 0
+    peak = np.zeros(matrix.shape[0])
+    peak[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+    above = np.concatenate([[0], np.cumsum(matrix.data >= np.repeat(peak, rows) * 0.5)])
+    width = (above[matrix.indptr[1:]] - above[matrix.indptr[:-1]]).astype(float)
+    width[~nonempty] = np.nan
+
+    # Map from model energy to channel energy
+    ecen = 0.5 * (rmf["energ_lo"] + rmf["energ_hi"])
+    cen = 0.5 * (rmf["e_min"] + rmf["e_max"])[:nchan]
+    valid = np.isfinite(width)
+    return np.maximum(np.interp(cen, ecen[valid], width[valid]), 1.)
+
+
+# Kaastra & Bleeker (2016) optimal bin size in units of the FWHM
+# x = ln[Nr (1 + 0.2 ln R)], Nr counts per resolution element, R resolution elements
+def kaastra_bleeker_ratio(nr, nres):
+    x = np.log(np.maximum(nr, 1.e-30) * (1. + 0.2 * np.log(max(nres, 1.))))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        r = (0.08 + 7.0 / x + 1.8 / x**2) / (1. + 5.9 / x)
+    return np.where(x <= 2.119, 1., np.minimum(r, 1.))
+
+
+# Optimal binning; minimum optionally also requires a minimum number of counts
+def group_optimal(counts, fwhm, good, minimum = 0):
+    c = np.asarray(counts, dtype = float)[good]
+    w = np.asarray(fwhm, dtype = float)[good]
+    n = len(c)
+    cum = np.concatenate([[0.], np.cumsum(c)])
+
+    # Counts within one FWHM around each channel
+    idx = np.arange(n)
+    lo = np.clip(idx - np.floor(w / 2).astype(int), 0, n)
+    hi = np.clip(idx + np.ceil(w / 2).astype(int), 0, n)
+    nr = cum[hi] - cum[lo]
+    nres = np.sum(1. / w)
+    size = np.maximum(np.floor(kaastra_bleeker_ratio(nr, nres) * w), 1).astype(int)
+
+    # The last group may be narrower than the optimal size
+    def ok(start, stops):
+        wide = (stops - start >= size[start]) | (stops == n)
+        return wide & (cum[stops] - cum[start] >= minimum)
+
+    ends, complete = _scan(n, ok)
+    return _flags(good, ends, complete)
+
+
+# Group a source PHA and write the result in one go
+# method: "min" (value = counts), "snr" (value = S/N) or "optimal" (value = min counts)
+# backfile/respfile/ancrfile are written as given (grppha writes ./name)
+def group_pha(srcpha, grppha, backfile = None, respfile = None, ancrfile = None,
+              method = "min", value = 20, bad = "0-29", backscal = None):
+    dirname = os.path.dirname(os.path.abspath(srcpha))
+    with fits.open(srcpha) as hdul:
+        spec = hdul["SPECTRUM"]
+        channel = np.array(spec.data["CHANNEL"], dtype = int)
+        counts = np.array(spec.data["COUNTS"], dtype = float)
+        good = ~channel_ranges(bad, channel)
+
+        if method == "min":
+            grouping, quality = group_min_counts(counts, value, good)
+        elif method == "snr":
+            bkg = None
+            backratio = 0.
+            if backfile is not None:
+                with fits.open(os.path.join(dirname, backfile)) as bhdul:
+                    bspec = bhdul["SPECTRUM"]
+                    bkg = np.array(bspec.data["COUNTS"], dtype = float)
+                    backratio = (spec.header["EXPOSURE"] * spec.header.get("BACKSCAL", 1.)) \
+                                / (bspec.header["EXPOSURE"] * bspec.header.get("BACKSCAL", 1.))
+            grouping, quality = group_min_snr(counts, value, good, bkg, backratio)
+        elif method == "optimal":
+            if respfile is None:
+                raise ValueError("Optimal grouping needs the RMF (respfile)")
+            from __forwardfold import read_rmf
+            rmf = read_rmf(os.path.join(dirname, respfile))
+            grouping, quality = group_optimal(counts, channel_fwhm(rmf, len(counts)), good, value)
+        else:
+            raise ValueError("Unknown grouping method: %s" %method)
+
+        # Rebuild the table without any previous grouping
+        cols = [c for c in spec.columns if c.name not in ("QUALITY", "GROUPING")]
+        cols.append(fits.Column(name = "QUALITY", format = "I", array = quality))
+        cols.append(fits.Column(name = "GROUPING", format = "I", array = grouping))
+        newspec = fits.BinTableHDU.from_columns(cols, header = spec.header, name = "SPECTRUM")
+        # QUALITY = 0 / GROUPING = 0 keywords stand for columns, drop them
+        for key in ("QUALITY", "GROUPING"):
+            newspec.header.remove(key, ignore_missing = True)
+
+        for key, name in [("BACKFILE", backfile), ("RESPFILE", respfile), ("ANCRFILE", ancrfile)]:
+            if name is not None:
+                newspec.header[key] = name if name.startswith("./") else "./" + name
+        if backscal is not None:
+            newspec.header["BACKSCAL"] = backscal
+
+        hdus = [h for h in hdul]
+        hdus[hdus.index(spec)] = newspec
+        fits.HDUList(hdus).writeto(grppha, overwrite = True)
+
+
+# chkey BACKSCAL, the change_backscale step for WT backgrounds
+def change_backscale(infile, outfile, backscal):
+    with fits.open(infile) as hdul:
+        hdul["SPECTRUM"].header["BACKSCAL"] = backscal
+        hdul.writeto(outfile, overwrite = True)
+
+
+# Standard file names of ReduceXRT.sh for a mode
+def standard_files(mode):
+    back = "wt_rescale_back.pha" if mode == "wt" else "%s_back.pha" %mode
+    return "%s_src.pha" %mode, back, "%s.rmf" %mode, "%s_src.arf" %mode
+
+
+# Regroup every OBS_ID/{pc,wt}_src.pha of a reduced directory
+def regroup_tree(datadir, output = "%s_grp.pha", method = "min", value = 20, bad = "0-29"):
+    written = []
+    for obsid in sorted(os.listdir(datadir)):
+        obsdir = os.path.join(datadir, obsid)
+        for mode in ("pc", "wt"):
+            src, back, rmf, arf = standard_files(mode)
+            if not os.path.isfile(os.path.join(obsdir, src)):
+                continue
+            out = os.path.join(obsdir, output %mode)
+            group_pha(os.path.join(obsdir, src), out, back, rmf, arf, method, value, bad)
+            written.append(out)
+    return written
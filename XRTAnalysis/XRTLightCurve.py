@@ -0,0 +1,159 @@
+'''
+    Binned light curves from cleaned event files
+
+    The events stay memory-mapped and are read `chunk` rows at a time, so
+    the memory used does not depend on the size of the event list. In each
+    chunk the source and background regions (the {pc,wt}_{src,back}.reg of
+    ReduceXRT.sh) select events whose TIME is histogrammed with np.histogram
+    onto fixed edges. The exposure of every bin is its overlap with the GTI
+    extension (FRACEXP is the good fraction of the bin), scaled by the dead
+    time of the event file, and the rates are background subtracted with the
+    ratio of the region BACKSCALs, as for the spectra.
+'''
+
+import os
+import numpy as np
+
+from __lazy import LazyModule
+from XRTEvents import open_events, read_region, pixel_region_mask, read_gti, gti_exposure
+from XRTExtract import pi_channels, region_backscal
+
+fits = LazyModule("astropy.io.fits")
+
+
+# Rows of the event file read at once
+CHUNK = 1000000
+
+# PI channel width (keV) of the XRT, to select an energy band
+PI_WIDTH = 0.01
+
+
+# Bin edges of binsize seconds, from the first GTI start to the last GTI stop
+def time_edges(gti, binsize):
+    n = max(1, int(np.ceil((gti[-1, 1] - gti[0, 0]) / binsize)))
+    return gti[0, 0] + binsize * np.arange(n + 1)
+
+
+# Source and background counts per time bin of an event file
+# band = (emin, emax) in keV restricts the PI channels
+# Returns the src and back counts, the BACKSCAL of both regions, the GTIs
+# and the EVENTS header
+def bin_events(evtfile, srcreg, backreg, edges = None, binsize = 100., band = None, chunk = CHUNK):
+    hdul, data, header = open_events(evtfile)
+    with hdul:
+        gti = read_gti(hdul)
+        header = header.copy()
+        if edges is None:
+            edges = time_edges(gti, binsize)
+        edges = np.asarray(edges, dtype = float)
+
+        tlmin, nchan = pi_channels(header)
+        pimin, pimax = tlmin, tlmin + nchan - 1
+        if band is not None:
+            pimin = max(pimin, int(np.ceil(band[0] / PI_WIDTH)))
+            pimax = min(pimax, int(np.floor(band[1] / PI_WIDTH)))
+
+        regions = [read_region(srcreg), read_region(backreg)]
+        counts = [np.zeros(len(edges) - 1, dtype = np.int64) for _ in regions]
+        for start in range(0, len(data), chunk):
+            rows = data[start : start + chunk]
+            time = np.asarray(rows["TIME"], dtype = float)
+            pi = np.asarray(rows["PI"], dtype = np.int64)
+            x = np.asarray(rows["X"], dtype = np.int64)
+            y = np.asarray(rows["Y"], dtype = np.int64)
+            good = (pi >= pimin) & (pi <= pimax)
+            cache = {}
+            for n, regs in zip(counts, regions):
+                sel = good & pixel_region_mask(x, y, header, regs, cache)
+                n += np.histogram(time[sel], bins = edges)[0]
+
+    backscal = [region_backscal(header, regs) for regs in regions]
+    return counts[0], counts[1], backscal, gti, header, edges
+
+
+# Background subtracted light curve of one event file
+# Bins whose good fraction is at most minfrac are dropped
+# Returns an astropy Table (TIME is the bin centre, MET s)
+def light_curve(evtfile, srcreg, backreg, binsize = 100., edges = None, band = None,
+                minfrac = 0., mode = None, chunk = CHUNK):
+    from astropy.table import Table
+
+    src, back, backscal, gti, header, edges = bin_events(evtfile, srcreg, backreg, edges,
+                                                         binsize, band, chunk)
+    if mode is None:
+        mode = "wt" if str(header.get("DATAMODE", "")).strip().upper() == "WINDOWED" else "pc"
+    if mode == "wt":
+        # change_backscale of ReduceXRT.sh
+        from XRTReduce import WT_BACKSCAL
+        backscal[1] = WT_BACKSCAL
+
+    ontime = gti_exposure(gti, edges)
+    width = np.diff(edges)
+    total = float(np.sum(gti[:, 1] - gti[:, 0]))
+    livefrac = float(header.get("EXPOSURE", total)) / total if total > 0 else 1.
+    exposure = ontime * livefrac
+    scale = backscal[0] / backscal[1]
+
+    keep = (ontime > 0) & (ontime > minfrac * width)
+    exposure = exposure[keep]
+    src = src[keep]
+    back = back[keep]
+
+    tabl = Table()
+    tabl["TIME"] = 0.5 * (edges[:-1] + edges[1:])[keep]
+    tabl["TIMEDEL"] = width[keep]
+    tabl["EXPOSURE"] = exposure
+    tabl["FRACEXP"] = ontime[keep] / width[keep]
+    tabl["SRC_COUNTS"] = src
+    tabl["BACK_COUNTS"] = back
+    tabl["RATE"] = (src - scale * back) / exposure
+    tabl["ERROR"] = np.sqrt(src + scale**2 * back) / exposure
+    tabl["BACK_RATE"] = scale * back / exposure
+    for name in ("TIME", "TIMEDEL", "EXPOSURE"):
+        tabl[name].unit = "s"
+    for name in ("RATE", "ERROR", "BACK_RATE"):
+        tabl[name].unit = "count / s"
+    tabl.meta["BACKSCAL"] = scale
+    tabl.meta["MODE"] = mode
+    return tabl
+
+
+# Light curves of every OBS_ID/{pc,wt}_cl.evt of a Reprocessed/ tree that has
+# its source and background regions, stacked in time order with ObsID and
+# Mode columns. With a run selection only the selected modes are used
+def source_light_curve(reprocessedDir, binsize = 100., runSelection = None, band = None,
+                       minfrac = 0., chunk = CHUNK):
+    from astropy.table import vstack
+    from XRTBatch import read_run_selection
+
+    if runSelection is not None and not isinstance(runSelection, dict):
+        runSelection = read_run_selection(runSelection)
+
+    curves = []
+    for obsid in sorted(os.listdir(reprocessedDir)):
+        obsdir = os.path.join(reprocessedDir, obsid)
+        if not os.path.isdir(obsdir):
+            continue
+        if runSelection is not None:
+            if obsid not in runSelection:
+                continue
+            modes = [runSelection[obsid]]
+        else:
+            modes = ["pc", "wt"]
+
+        for mode in modes:
+            files = [os.path.join(obsdir, name %mode) for name in ("%s_cl.evt", "%s_src.reg", "%s_back.reg")]
+            if not all(os.path.isfile(f) for f in files):
+                continue
+            tabl = light_curve(*files, binsize = binsize, band = band, minfrac = minfrac,
+                               mode = mode, chunk = chunk)
+            tabl.meta.clear()
+            tabl["ObsID"] = obsid
+            tabl["Mode"] = mode.upper()
+            curves.append(tabl)
+
+    if not curves:
+        raise ValueError("No event files with regions found in %s" %reprocessedDir)
+    tabl = vstack(curves)
+    tabl.sort("TIME")
+    return tabl
@@ -0,0 +1,110 @@
+'''
+    Pile-up exclusion radius for PC mode observations
+
+    Replaces the correct_pileUP loop of ReduceXRT.sh: instead of one xselect
+    extraction per trial radius, the event radii are computed once and the
+    annulus count rate for every ICUT comes from a cumulative radial histogram
+'''
+
+import os
+import numpy as np
+
+from XRTEvents import open_events, event_exposure, radial_distance
+
+
+# Regions as written by write_RegionsPC in ReduceXRT.sh, all radii in arcsec
+PIXEL = 2.36
+SRC_OUTER = 47.
+BACK_INNER = 75.
+BACK_OUTER = 150.
+
+# Count rate (cts/s) below which pile-up is negligible
+CUTOFF = 0.5
+
+# Swift-XRT King PSF parameters (Moretti et al. 2005), rc in arcsec
+KING_RC = 5.8
+KING_BETA = 1.55
+
+
+# Source annulus radii (arcsec) for ICUT excluded pixels
+def source_annulus(icut):
+    return PIXEL * icut, SRC_OUTER + PIXEL * icut
+
+
+# Annulus count rate for every ICUT in 0..maxcut
+# radii must be sorted
+def annulus_rates(radii, exposure, maxcut):
+    icut = np.arange(maxcut + 1)
+    inner, outer = source_annulus(icut)
+    counts = np.searchsorted(radii, outer, side = "right") - np.searchsorted(radii, inner, side = "right")
+    return counts / exposure
+
+
+# Smallest ICUT for which the source annulus rate is at or below the cutoff
+# Returns (icut, rate); icut is None if no radius up to maxcut is enough
+def exclusion_radius(radii, exposure, cutoff = CUTOFF, maxcut = 100):
+    rates = annulus_rates(np.sort(radii), exposure, maxcut)
+    below = np.nonzero(rates <= cutoff)[0]
+    if len(below) == 0:
+        return None, rates[-1]
+    return int(below[0]), rates[below[0]]
+
+
+# King profile plus a flat background, surface brightness vs radius
+def king_profile(r, norm, rc, beta, bkg):
+    return norm * (1. + (r / rc)**2)**(-beta) + bkg
+
+
+# Fit a King profile to the PSF wings (r > rmin) and extrapolate inwards
+# The pile-up radius is the first radius, going outwards, where the observed
+# profile reaches frac of the extrapolated model
+def king_pileup_radius(radii, rmin = 15., rmax = 150., binsize = PIXEL, frac = 0.9):
+    from scipy.optimize import curve_fit
+
+    edges = np.arange(0., rmax + binsize, binsize)
+    counts = np.histogram(radii, edges)[0]
+    area = np.pi * (edges[1:]**2 - edges[:-1]**2)
+    centre = 0.5 * (edges[1:] + edges[:-1])
+    sb = counts / area
+    sb_err = np.sqrt(np.maximum(counts, 1)) / area
+
+    wing = centre > rmin
+    p0 = [sb[wing][0] * (1. + (rmin / KING_RC)**2)**KING_BETA, KING_RC, KING_BETA, sb[-1]]
+    popt, _ = curve_fit(king_profile, centre[wing], sb[wing], p0 = p0, sigma = sb_err[wing],
+                        bounds = ([0., 0.5, 1., 0.], [np.inf, 30., 3., np.inf]))
+
+    ratio = sb / king_profile(centre, *popt)
+    ok = np.nonzero(ratio[~wing] >= frac)[0]
+    radius = edges[ok[0]] if len(ok) else rmin
+    return radius, popt
+
+
+# Same output as write_RegionsPC
+def write_regions(ra, dec, icut, srcfile = "pc_src.reg", backfile = "pc_back.reg"):
+    inner, outer = source_annulus(icut)
+    with open(srcfile, "w") as f:
+        f.write('icrs;annulus(%s,%s,%.2f",%.2f")\n' %(ra, dec, inner, outer))
+    with open(backfile, "w") as f:
+        f.write('icrs;annulus(%s,%s,%g",%.2f")\n' %(ra, dec, BACK_INNER, BACK_OUTER + PIXEL * icut))
+
+
+# Add or replace the OBS_ID,NPIXELS row of a pile-up csv
+def update_pileup_csv(filename, obsid, icut):
+    rows = []
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            rows = [line.strip() for line in f if line.strip()]
+    rows = [r for r in rows if r.split(",")[0] != obsid]
+    rows.append("%s,%d" %(obsid, icut))
+    with open(filename, "w") as f:
+        f.write("\n".join(rows) + "\n")
+
+
+# Read the event file once and solve for the exclusion radius
+def correct_pileup(evtfile, ra, dec, cutoff = CUTOFF, maxcut = 100):
+    hdul, data, header = open_events(evtfile)
+    with hdul:
+        radii = radial_distance(data, header, ra, dec)
+    exposure = event_exposure(evtfile)
+    icut, rate = exclusion_radius(radii, exposure, cutoff, maxcut)
+    return icut, rate, radii
@@ -0,0 +1,174 @@
+'''
+    Bounded-concurrency, resumable runner for xrtpipeline
+
+    Runs up to N xrtpipeline jobs at once, each in its own scratch directory
+    with its own PFILES and log. A manifest of input checksums in
+    Reprocessed/ lets observations that were already reprocessed, and whose
+    level 1 files did not change, be skipped on the next run
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from XRTReduce import FileHasher
+
+
+MANIFEST = ".xrtpipeline_manifest.json"
+
+
+# Checksum of every file under Data/OBS_ID (xrt/ and auxil/)
+def input_checksum(indir, hasher):
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(indir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            h.update(os.path.relpath(path, indir).encode())
+            h.update(hasher(path).encode())
+    return h.hexdigest()
+
+
+class PipelineRunner():
+
+    # srcdir contains Data/OBS_ID/, outputs go to srcdir/Reprocessed/OBS_ID
+    # executable can point at a stub for testing
+    def __init__(self, srcdir, ra, dec, njobs = 4, retries = 2, force = False,
+                 executable = "xrtpipeline", verbose = True):
+        self.srcdir = srcdir
+        self.datadir = os.path.join(srcdir, "Data")
+        self.outdir = os.path.join(srcdir, "Reprocessed")
+        self.ra = ra
+        self.dec = dec
+        self.njobs = njobs
+        self.retries = retries
+        self.force = force
+        self.executable = executable
+        self.verbose = verbose
+
+        # Same parameters as run_xrtpipeline in XRTPipeline.sh
+        self.params = {"srcra" : ra, "srcdec" : dec, "pntra" : ra, "pntdec" : dec,
+                       "exprpcgrade" : "0-12", "exprwtgrade" : "0-2", "exprpdgrade" : "0-2",
+                       "clobber" : "yes", "createexpomap" : "yes"}
+
+        os.makedirs(self.outdir, exist_ok = True)
+        self.manifestFile = os.path.join(self.outdir, MANIFEST)
+        try:
+            with open(self.manifestFile) as f:
+                self.manifest = json.load(f)
+        except (IOError, ValueError):
+            self.manifest = {"files" : {}, "observations" : {}}
+        # The hasher adds checksums to the manifest from the job threads, so
+        # it shares the lock that guards writing the manifest out
+        self.hasher = FileHasher(self.manifest["files"])
+        self.lock = self.hasher.lock
+
+
+    def _saveManifest(self):
+        with self.lock:
+            fd, tmp = tempfile.mkstemp(dir = self.outdir, suffix = ".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.manifest, f, indent = 1)
+            os.replace(tmp, self.manifestFile)
+
+
+    def observations(self):
+        return [d for d in sorted(os.listdir(self.datadir))
+                if os.path.isdir(os.path.join(self.datadir, d))]
+
+
+    def _key(self, obsid):
+        blob = json.dumps({"inputs" : input_checksum(os.path.join(self.datadir, obsid), self.hasher),
+                           "params" : self.params}, sort_keys = True)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+
+    def upToDate(self, obsid, key):
+        prev = self.manifest["observations"].get(obsid)
+        return (prev is not None and prev.get("key") == key and prev.get("status") == "done"
+                and os.path.isdir(os.path.join(self.outdir, obsid)))
+
+
+    # One xrtpipeline call in a scratch directory with a private PFILES
+    def _runOnce(self, obsid, logname):
+        scratch = tempfile.mkdtemp(prefix = "xrtpipeline_%s_" %obsid)
+        try:
+            env = dict(os.environ)
+            pfiles = os.path.join(scratch, "pfiles")
+            os.makedirs(pfiles)
+            env["PFILES"] = "%s;%s" %(pfiles, os.path.join(env.get("HEADAS", ""), "syspfiles"))
+
+            args = [self.executable,
+                    "indir=%s" %os.path.abspath(os.path.join(self.datadir, obsid)),
+                    "outdir=%s" %os.path.abspath(os.path.join(self.outdir, obsid)),
+                    "steminputs=sw%s" %obsid]
+            args += ["%s=%s" %(k, v) for k, v in self.params.items()]
+
+            with open(logname, "w") as log:
+                res = subprocess.run(args, cwd = scratch, env = env, stdin = subprocess.DEVNULL,
+                                     stdout = log, stderr = subprocess.STDOUT)
+            return res.returncode
+        finally:
+            shutil.rmtree(scratch, ignore_errors = True)
+
+
+    # Run (or skip) one observation, retrying on failure
+    def run_observation(self, obsid):
+        key = self._key(obsid)
+        if not self.force and self.upToDate(obsid, key):
+            return "skipped", 0
+
+        outdir = os.path.join(self.outdir, obsid)
+        os.makedirs(outdir, exist_ok = True)
+        # ReduceXRT.sh reads the RMF names from this log
+        logname = os.path.join(outdir, "xrtpipeline_%s.log" %obsid)
+
+        for attempt in range(self.retries + 1):
+            code = self._runOnce(obsid, logname)
+            if code == 0:
+                with self.lock:
+                    self.manifest["observations"][obsid] = {"key" : key, "status" : "done",
+                                                            "attempts" : attempt + 1}
+                self._saveManifest()
+                return "done", attempt + 1
+            if attempt < self.retries:
+                time.sleep(min(2**attempt, 30))
+
+        with self.lock:
+            self.manifest["observations"][obsid] = {"key" : key, "status" : "failed",
+                                                    "attempts" : self.retries + 1}
+        self._saveManifest()
+        return "failed", self.retries + 1
+
+
+    # Returns {OBS_ID: status}
+    def run(self, obsids = None):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        if obsids is None:
+            obsids = self.observations()
+        results = {}
+        start = time.time()
+        processed = 0
+        with ThreadPoolExecutor(max_workers = self.njobs) as pool:
+            futures = {pool.submit(self.run_observation, obsid) : obsid for obsid in obsids}
+            for i, fut in enumerate(as_completed(futures)):
+                obsid = futures[fut]
+                try:
+                    status, attempts = fut.result()
+                except Exception as e:
+                    status, attempts = "failed: %s" %e, 0
+                results[obsid] = status
+                if status == "done":
+                    processed += 1
+
+                if self.verbose:
+                    elapsed = time.time() - start
+                    rate = processed / elapsed * 3600. if elapsed > 0 else 0.
+                    print ("[%d/%d] %s %s (attempts: %d) | %0.0f s elapsed, %0.1f obs/h"
+                           %(i + 1, len(obsids), obsid, status, attempts, elapsed, rate))
+        return results
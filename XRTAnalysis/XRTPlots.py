@@ -0,0 +1,215 @@
+'''
+    Batch spectrum plots from stored fit results
+
+    One Agg figure is built with all of its artists (points, error bars,
+    models, legend, labels) and only their data and the y range change from
+    one fit to the next, so hundreds of pages cost little more than their
+    rasterisation. No pyplot state is involved and nothing needs xspec: the
+    SEDs come from getFitResults() dicts or an XRTResults store. Pages go
+    to a multipage PDF or one PNG per fit, and a store can be split over
+    several worker processes.
+'''
+
+import os
+import numpy as np
+
+from __lazy import LazyModule
+
+_figure = LazyModule("matplotlib.figure")
+_agg = LazyModule("matplotlib.backends.backend_agg")
+_pdf = LazyModule("matplotlib.backends.backend_pdf")
+
+
+ENERGY = "Energy [keV]"
+ENERGY_ERR = "Energy_err [keV]"
+E2DNDE = "e2dnde [keV cm^-2 s^-1]"
+E2DNDE_ERR = "e2dnde_err [keV cm^-2 s^-1]"
+DEABS = "e2dnde_deabsorbed [keV cm^-2 s^-1]"
+DEABS_ERR = "e2dnde_deabsorbed_err [keV cm^-2 s^-1]"
+MODEL_ENERGY = "modelEnergy [keV]"
+MODEL = "model_e2dnde [keV cm^-2 s^-1]"
+MODEL_DEABS = "model_intrinsic_e2dnde [keV cm^-2 s^-1]"
+
+# PNG names, from the ObsID, mode and FIT_ID (or position) of a fit
+PNG_NAME = "%s_%s_%06d.png"
+
+
+# x and y error bars as a single polyline, NaN separated, which renders
+# as one path instead of one per bar
+def _error_path(x, y, xerr, yerr):
+    n = len(x)
+    gap = np.full(n, np.nan)
+    bx = np.stack([x - xerr, x + xerr, gap, x, x, gap], axis = 1).ravel()
+    by = np.stack([y, y, gap, y - yerr, y + yerr, gap], axis = 1).ravel()
+    return bx, by
+
+
+class SpectrumPlotter():
+
+    # Same layout as XRT_Analysis.plotEnergySpectrum
+    # bintrinsic = True also draws the deabsorbed points and model
+    def __init__(self, bintrinsic = True, figsize = (11, 6), dpi = 100):
+        self.bintrinsic = bintrinsic
+        self.dpi = dpi
+        self.fig = _figure.Figure(figsize = figsize, dpi = dpi)
+        _agg.FigureCanvasAgg(self.fig)
+        ax = self.ax = self.fig.add_subplot(1, 1, 1)
+
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlim(0.3, 10.)
+        ax.grid(True, which = "both", ls = "--")
+        ax.set_xlabel(r"Energy [keV]", fontsize = 16)
+        ax.set_ylabel(r"E$^2$ dN/dE [keV cm$^{-2}$ s$^{-1}$]", fontsize = 16)
+        ax.tick_params(axis = "both", which = "major", labelsize = "large")
+        ax.tick_params(axis = "both", which = "major", length = 8)
+        ax.tick_params(axis = "both", which = "minor", length = 6)
+        self.title = ax.set_title("")
+
+        # (points, error bars, model) for the observed and deabsorbed spectra
+        self.layers = [self._layer("C0", "o", "Observed")]
+        if bintrinsic:
+            self.layers.append(self._layer("C2", "s", "Deabsorbed"))
+        ax.legend(fontsize = 16)
+
+
+    def _layer(self, colour, marker, label):
+        points, = self.ax.plot([], [], color = colour, marker = marker, ls = "none", label = label + " Data")
+        bars, = self.ax.plot([], [], color = colour, lw = 1.)
+        model, = self.ax.plot([], [], color = colour, ls = "--", label = label + " Model")
+        return points, bars, model
+
+
+    # Point the artists at the SED and model of one fit
+    # res has the getFitResults() keys
+    def update(self, res, title = ""):
+        energy = np.asarray(res[ENERGY], dtype = float)
+        energy_err = np.asarray(res[ENERGY_ERR], dtype = float)
+        keys = [(E2DNDE, E2DNDE_ERR, MODEL), (DEABS, DEABS_ERR, MODEL_DEABS)]
+
+        for (points, bars, model), (key, errkey, modelkey) in zip(self.layers, keys):
+            y = np.asarray(res[key], dtype = float)
+            yerr = np.asarray(res[errkey], dtype = float)
+            points.set_data(energy, y)
+            bars.set_data(*_error_path(energy, y, energy_err, yerr))
+            model.set_data(np.asarray(res.get(MODEL_ENERGY, [])), np.asarray(res.get(modelkey, [])))
+
+        # y range of the last spectrum drawn, as plotEnergySpectrum does
+        y = np.asarray(res[keys[len(self.layers) - 1][0]], dtype = float)
+        y = y[np.isfinite(y) & (y > 0)]
+        if len(y):
+            self.ax.set_ylim(0.75 * y.min(), 1.75 * y.max())
+        self.title.set_text(title)
+
+
+    # target is a file name or a PdfPages
+    def savefig(self, target):
+        if isinstance(target, str):
+            self.fig.savefig(target, dpi = self.dpi)
+        else:
+            target.savefig(self.fig)
+
+
+# Plot a list of result dicts to a multipage PDF (output ends with .pdf) or
+# to one PNG per fit in the output directory
+# titles default to "ObsID Mode"; returns the files written
+def plot_results(results, output, bintrinsic = True, titles = None, fit_ids = None):
+    results = list(results)
+    if fit_ids is None:
+        fit_ids = range(len(results))
+    if titles is None:
+        titles = ["%s %s" %(res.get("ObsID", ""), res.get("Mode", "")) for res in results]
+
+    plotter = SpectrumPlotter(bintrinsic)
+    if output.lower().endswith(".pdf"):
+        with _pdf.PdfPages(output) as pdf:
+            for res, title in zip(results, titles):
+                plotter.update(res, title)
+                plotter.savefig(pdf)
+        return [output]
+
+    os.makedirs(output, exist_ok = True)
+    written = []
+    for res, title, fit_id in zip(results, titles, fit_ids):
+        plotter.update(res, title)
+        name = os.path.join(output, PNG_NAME %(res.get("ObsID", ""), res.get("Mode", ""), fit_id))
+        plotter.savefig(name)
+        written.append(name)
+    return written
+
+
+# Results of some fits of a store as getFitResults() style dicts
+def store_results(store, fit_ids):
+    from XRTResults import SED, MODEL
+
+    meta = store.read(["ObsID", "Mode"])
+    sed = store.sed(fit_ids)
+    model = store.model(fit_ids)
+    # Points are stored fit by fit, so each fit is one contiguous slice
+    sed_order = np.argsort(sed["FIT_ID"], kind = "stable")
+    model_order = np.argsort(model["FIT_ID"], kind = "stable")
+    sed_ids = sed["FIT_ID"][sed_order]
+    model_ids = model["FIT_ID"][model_order]
+
+    results = []
+    for fit_id in fit_ids:
+        res = {}
+        i = np.searchsorted(meta["FIT_ID"], fit_id)
+        res["ObsID"] = meta["ObsID"][i]
+        res["Mode"] = meta["Mode"][i]
+        lo, hi = np.searchsorted(sed_ids, [fit_id, fit_id + 1])
+        for key, col, _ in SED:
+            res[key] = sed[col][sed_order[lo:hi]]
+        lo, hi = np.searchsorted(model_ids, [fit_id, fit_id + 1])
+        for key, col, _ in MODEL:
+            res[key] = model[col][model_order[lo:hi]]
+        results.append(res)
+    return results
+
+
+def _init_worker(path):
+    import sys
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _plot_chunk(path, fit_ids, output, bintrinsic):
+    from XRTResults import ResultsStore
+    results = store_results(ResultsStore(path), fit_ids)
+    return plot_results(results, output, bintrinsic, fit_ids = fit_ids)
+
+
+# Plot the fits of a results store (all of them or fit_ids)
+# With nworkers > 1 the fits are split into contiguous chunks, one per
+# process; a PDF output then becomes one file per chunk (name_000.pdf, ...)
+def plot_store(path, output, fit_ids = None, nworkers = 1, bintrinsic = True):
+    from XRTResults import ResultsStore
+
+    if fit_ids is None:
+        fit_ids = ResultsStore(path).read([])["FIT_ID"]
+    fit_ids = np.asarray(fit_ids, dtype = np.int64)
+    nworkers = max(1, min(nworkers, len(fit_ids)))
+    if nworkers == 1:
+        return _plot_chunk(path, fit_ids, output, bintrinsic)
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing as mp
+
+    chunks = np.array_split(fit_ids, nworkers)
+    if output.lower().endswith(".pdf"):
+        outputs = ["%s_%03d.pdf" %(output[:-4], i) for i in range(nworkers)]
+    else:
+        outputs = [output] * nworkers
+
+    written = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers = nworkers, mp_context = ctx,
+                             initializer = _init_worker, initargs = (here,)) as pool:
+        futures = [pool.submit(_plot_chunk, path, chunk, out, bintrinsic)
+                   for chunk, out in zip(chunks, outputs)]
+        for fut in futures:
+            written += fut.result()
+    return written
@@ -0,0 +1,409 @@
+'''
+    Dependency-graph reduction engine for the ReduceXRT stages
+
+    Each stage declares the files it reads and writes. A stage is skipped
+    when the content hashes of its inputs, its parameters and its outputs
+    are unchanged since the last run. Independent stages, and different
+    observations, run concurrently; stages that call HEASoft tools run in
+    their own scratch directory with their own PFILES
+'''
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import threading
+import subprocess
+
+from XRTPileup import correct_pileup, write_regions
+from XRTExtract import extract_spectra
+from XRTGroup import group_pha, change_backscale
+
+
+# State file written in every observation directory
+STATEFILE = ".xrtreduce.json"
+SCRATCHDIR = ".xrtreduce"
+
+# Regions as written by write_RegionsWT
+WT_SRC = 47.146
+WT_BACK = (188.585, 282.877)
+WT_BACKSCAL = 39
+
+# Files checked by TestReduction.sh, the rmf must be a link
+PRODUCTS = {"pc" : ["pc_src.pha", "pc_back.pha", "pc.rmf", "pc_src.arf", "pc_grp.pha"],
+            "wt" : ["wt_src.pha", "wt_rescale_back.pha", "wt.rmf", "wt_src.arf", "wt_grp.pha"]}
+
+
+class Stage():
+
+    # action(obsdir, scratch) does the work, scratch is None unless
+    # scratch = True; inputs/outputs are relative to the observation directory
+    def __init__(self, name, action, inputs = (), outputs = (), params = None, scratch = False):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params if params is not None else {}
+        self.scratch = scratch
+
+
+# Content hashes, remembered per (path, size, mtime) so unchanged files are read once
+class FileHasher():
+
+    def __init__(self, known = None):
+        self.known = known if known is not None else {}
+        self.lock = threading.Lock()
+
+
+    def __call__(self, filename):
+        path = os.path.realpath(filename)
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        key = "%s:%d:%d" %(path, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if key in self.known:
+                return self.known[key]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        with self.lock:
+            self.known[key] = h.hexdigest()
+        return self.known[key]
+
+
+# Run a HEASoft tool in cwd with a private PFILES, stdin feeds the prompts
+def run_tool(args, cwd, stdin = None, logname = None):
+    env = dict(os.environ)
+    pfiles = os.path.join(cwd, "pfiles")
+    os.makedirs(pfiles, exist_ok = True)
+    syspfiles = os.path.join(env.get("HEADAS", ""), "syspfiles")
+    env["PFILES"] = "%s;%s" %(pfiles, syspfiles)
+
+    res = subprocess.run(args, cwd = cwd, input = stdin, env = env,
+                         stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                         text = True)
+    if logname is not None:
+        with open(os.path.join(cwd, logname), "w") as f:
+            f.write(res.stdout)
+    if res.returncode != 0:
+        raise RuntimeError("%s failed (%d):\n%s" %(args[0], res.returncode, res.stdout[-2000:]))
+    return res.stdout
+
+
+# Link files of the observation directory into the scratch directory
+def _link_inputs(obsdir, scratch, names):
+    for name in names:
+        src = os.path.join(obsdir, name)
+        dst = os.path.join(scratch, name)
+        if not os.path.lexists(dst):
+            os.symlink(os.path.realpath(src), dst)
+
+
+def _collect_outputs(obsdir, scratch, names):
+    for name in names:
+        os.replace(os.path.join(scratch, name), os.path.join(obsdir, name))
+
+
+def _single(pattern):
+    files = glob.glob(pattern)
+    return files[0] if len(files) == 1 else None
+
+
+# RMFs used by xrtpipeline, as read by extract_image_all in ReduceXRT.sh
+def pipeline_rmfs(logfile):
+    rmfs = {}
+    with open(logfile) as f:
+        for line in f:
+            if "Name of the input RMF file" in line:
+                fields = line.split("Name of the input RMF file", 1)[1].replace("'", " ").replace(":", " ").split()
+                if len(fields) == 0:
+                    continue
+                path = fields[-1]
+                name = os.path.basename(path)
+                if "wt" in name:
+                    rmfs["wt"] = path
+                elif "pc" in name:
+                    rmfs["pc"] = path
+    return rmfs
+
+
+# Build the stages of one observation directory
+# pileup is the number of excluded PC pixels (None: solve from the events)
+def observation_stages(obsdir, ra, dec, pileup = None):
+    stages = []
+    logfile = _single(os.path.join(obsdir, "xrtpipeline_*.log"))
+
+    for mode in ("pc", "wt"):
+        evt = _single(os.path.join(obsdir, "*%s*po_cl.evt" %mode))
+        if evt is None:
+            continue
+        expo = _single(os.path.join(obsdir, "*%s*po_ex.img" %mode))
+        rmf = pipeline_rmfs(logfile).get(mode) if logfile is not None else None
+        # Event file and exposure map are linked relative, the rmf to CALDB
+        # Only what is there is linked and declared, so the stage can be up to date
+        targets = [(os.path.basename(evt), "%s_cl.evt" %mode)]
+        if rmf is not None:
+            targets.append((rmf, "%s.rmf" %mode))
+        if expo is not None:
+            targets.append((os.path.basename(expo), "%s_ex.img" %mode))
+        linked = [name for _, name in targets]
+        inputs = [os.path.basename(evt)]
+        if expo is not None:
+            inputs.append(os.path.basename(expo))
+        if logfile is not None:
+            inputs.append(os.path.basename(logfile))
+
+        def link(obsdir, scratch, targets = targets):
+            for target, name in targets:
+                path = os.path.join(obsdir, name)
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.symlink(target, path)
+        stages.append(Stage("link_%s" %mode, link, inputs, linked))
+
+        def image(obsdir, scratch, mode = mode):
+            _link_inputs(obsdir, scratch, ["%s_cl.evt" %mode])
+            run_tool(["xselect"], scratch, logname = "xselect.log",
+                     stdin = "xrt\n\nread event %s_cl.evt\n./\n\nextract image\nsave image %s.img\n\nexit\n\n" %(mode, mode))
+            _collect_outputs(obsdir, scratch, ["%s.img" %mode])
+        stages.append(Stage("image_%s" %mode, image, ["%s_cl.evt" %mode], ["%s.img" %mode], scratch = True))
+
+        regs = ["%s_src.reg" %mode, "%s_back.reg" %mode]
+        if mode == "pc":
+            def regions(obsdir, scratch, pileup = pileup):
+                icut = pileup
+                if icut is None:
+                    icut, rate, radii = correct_pileup(os.path.join(obsdir, "pc_cl.evt"), ra, dec)
+                    if icut is None:
+                        raise RuntimeError("No pile-up exclusion radius found")
+                write_regions(ra, dec, icut, *[os.path.join(obsdir, r) for r in regs])
+            stages.append(Stage("regions_pc", regions, ["pc_cl.evt"], regs,
+                                {"ra" : ra, "dec" : dec, "pileup" : pileup}))
+        else:
+            def regions(obsdir, scratch):
+                with open(os.path.join(obsdir, "wt_src.reg"), "w") as f:
+                    f.write('icrs;circular(%s,%s,%s")\n' %(ra, dec, WT_SRC))
+                with open(os.path.join(obsdir, "wt_back.reg"), "w") as f:
+                    f.write('icrs;annulus(%s,%s,%s",%s")\n' %(ra, dec, WT_BACK[0], WT_BACK[1]))
+            stages.append(Stage("regions_wt", regions, [], regs, {"ra" : ra, "dec" : dec}))
+
+        phas = ["%s_src.pha" %mode, "%s_back.pha" %mode]
+        def spectrum(obsdir, scratch, mode = mode, regs = regs, phas = phas):
+            extract_spectra(os.path.join(obsdir, "%s_cl.evt" %mode),
+                            [(os.path.join(obsdir, r), os.path.join(obsdir, p)) for r, p in zip(regs, phas)])
+        stages.append(Stage("spectrum_%s" %mode, spectrum, ["%s_cl.evt" %mode] + regs, phas))
+
+        def arf(obsdir, scratch, mode = mode):
+            _link_inputs(obsdir, scratch, ["%s_src.pha" %mode, "%s_ex.img" %mode])
+            run_tool(["xrtmkarf", "phafile=%s_src.pha" %mode, "srcx=-1", "srcy=-1",
+                      "outfile=%s_src.arf" %mode, "psfflag=yes", "expofile=%s_ex.img" %mode,
+                      "clobber=yes"], scratch, logname = "xrtmkarf.log")
+            _collect_outputs(obsdir, scratch, ["%s_src.arf" %mode])
+        stages.append(Stage("arf_%s" %mode, arf, ["%s_src.pha" %mode, "%s_ex.img" %mode],
+                            ["%s_src.arf" %mode], scratch = True))
+
+        back = "%s_back.pha" %mode
+        if mode == "wt":
+            # change_backscale in ReduceXRT.sh
+            def backscale(obsdir, scratch):
+                change_backscale(os.path.join(obsdir, "wt_back.pha"),
+                                 os.path.join(obsdir, "wt_rescale_back.pha"), WT_BACKSCAL)
+            stages.append(Stage("backscale_wt", backscale, ["wt_back.pha"], ["wt_rescale_back.pha"],
+                                {"backscal" : WT_BACKSCAL}))
+            back = "wt_rescale_back.pha"
+
+        grpin = ["%s_src.pha" %mode, back, "%s.rmf" %mode, "%s_src.arf" %mode]
+        def group(obsdir, scratch, mode = mode, back = back):
+            # grppha: bad 0-29, group min 20, chkey BACKFILE/RESPFILE/ANCRFILE
+            group_pha(os.path.join(obsdir, "%s_src.pha" %mode), os.path.join(obsdir, "%s_grp.pha" %mode),
+                      back, "%s.rmf" %mode, "%s_src.arf" %mode, method = "min", value = 20, bad = "0-29")
+        stages.append(Stage("group_%s" %mode, group, grpin, ["%s_grp.pha" %mode],
+                            {"bad" : "0-29", "min" : 20}))
+
+    return stages
+
+
+# Completeness check of TestReduction.sh, per mode present
+def check_products(obsdir):
+    status = {}
+    for mode, products in PRODUCTS.items():
+        if _single(os.path.join(obsdir, "*%s*po_cl.evt" %mode)) is None:
+            continue
+        ok = all(os.path.isfile(os.path.join(obsdir, p)) for p in products)
+        ok &= os.path.islink(os.path.join(obsdir, "%s.rmf" %mode))
+        status[mode] = "SUCCEEDED" if ok else "FAILED"
+    return status
+
+
+# Stages of one observation plus their dependency bookkeeping and cache state
+class Observation():
+
+    def __init__(self, obsdir, stages, hasher):
+        self.obsdir = obsdir
+        self.stages = {s.name : s for s in stages}
+        self.hasher = hasher
+        self.lock = threading.Lock()
+
+        # A stage depends on whichever stage produces one of its inputs
+        producer = {}
+        for s in stages:
+            for out in s.outputs:
+                producer[out] = s.name
+        self.deps = {s.name : set(producer[i] for i in s.inputs if i in producer and producer[i] != s.name)
+                     for s in stages}
+
+        self.statefile = os.path.join(obsdir, STATEFILE)
+        try:
+            with open(self.statefile) as f:
+                self.state = json.load(f)
+        except (IOError, ValueError):
+            self.state = {}
+
+        self.done = set()
+        self.failed = {}
+        self.skipped = set()
+
+
+    def key(self, stage):
+        inputs = {i : self.hasher(os.path.join(self.obsdir, i)) for i in stage.inputs}
+        blob = json.dumps({"name" : stage.name, "params" : stage.params, "inputs" : inputs},
+                          sort_keys = True)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+
+    def upToDate(self, stage, key):
+        prev = self.state.get(stage.name)
+        if prev is None or prev["key"] != key:
+            return False
+        for out in stage.outputs:
+            digest = self.hasher(os.path.join(self.obsdir, out))
+            if digest is None or digest != prev["outputs"].get(out):
+                return False
+        return True
+
+
+    def record(self, stage, key):
+        outputs = {o : self.hasher(os.path.join(self.obsdir, o)) for o in stage.outputs}
+        with self.lock:
+            self.state[stage.name] = {"key" : key, "outputs" : outputs}
+            with open(self.statefile, "w") as f:
+                json.dump(self.state, f, indent = 1)
+
+
+    # Stages whose dependencies are all done and which have not started yet
+    def ready(self, started):
+        blocked = set(self.failed)
+        for name, deps in self.deps.items():
+            if deps & blocked:
+                blocked.add(name)
+        return [name for name, deps in self.deps.items()
+                if name not in started and name not in blocked and deps <= self.done]
+
+
+    # Run one stage; returns "skipped" or "ran"
+    def run(self, name, force = False):
+        stage = self.stages[name]
+        missing = [i for i in stage.inputs if not os.path.exists(os.path.join(self.obsdir, i))]
+        if missing:
+            raise RuntimeError("missing inputs %s" %", ".join(missing))
+
+        key = self.key(stage)
+        if not force and self.upToDate(stage, key):
+            return "skipped"
+
+        scratch = None
+        if stage.scratch:
+            scratch = os.path.join(self.obsdir, SCRATCHDIR, name)
+            shutil.rmtree(scratch, ignore_errors = True)
+            os.makedirs(scratch)
+        stage.action(self.obsdir, scratch)
+        self.record(stage, key)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors = True)
+        return "ran"
+
+
+class ReductionEngine():
+
+    # pileup: dict OBS_ID -> excluded pixels (as in the pileup csv), or None
+    def __init__(self, datadir, ra, dec, pileup = None, nworkers = 4, force = False, verbose = True):
+        self.datadir = datadir
+        self.ra = ra
+        self.dec = dec
+        self.pileup = pileup if pileup is not None else {}
+        self.nworkers = nworkers
+        self.force = force
+        self.verbose = verbose
+        self.hasher = FileHasher()
+
+
+    def observations(self):
+        obs = []
+        for obsid in sorted(os.listdir(self.datadir)):
+            obsdir = os.path.join(self.datadir, obsid)
+            if not os.path.isdir(obsdir):
+                continue
+            stages = observation_stages(obsdir, self.ra, self.dec, self.pileup.get(obsid, None))
+            obs.append((obsid, Observation(obsdir, stages, self.hasher)))
+        return obs
+
+
+    def _log(self, msg):
+        if self.verbose:
+            print (msg)
+
+
+    # Run every stage of every observation, independent stages concurrently
+    # Returns {OBS_ID: {mode: SUCCEEDED/FAILED}} and writes reduction_status.dat
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        obs = self.observations()
+        started = {obsid : set() for obsid, o in obs}
+        running = {}
+
+        def submit(pool):
+            for obsid, o in obs:
+                for name in o.ready(started[obsid]):
+                    started[obsid].add(name)
+                    running[pool.submit(o.run, name, self.force)] = (obsid, o, name)
+
+        with ThreadPoolExecutor(max_workers = self.nworkers) as pool:
+            submit(pool)
+            while running:
+                finished, _ = wait(list(running), return_when = FIRST_COMPLETED)
+                for fut in finished:
+                    obsid, o, name = running.pop(fut)
+                    try:
+                        result = fut.result()
+                        o.done.add(name)
+                        if result == "skipped":
+                            o.skipped.add(name)
+                        self._log("%s: %s %s" %(obsid, name, result))
+                    except Exception as e:
+                        o.failed[name] = str(e)
+                        self._log("%s: %s FAILED %s" %(obsid, name, e))
+                submit(pool)
+
+        status = {}
+        with open(os.path.join(self.datadir, "reduction_status.dat"), "w") as f:
+            for obsid, o in obs:
+                status[obsid] = check_products(o.obsdir)
+                for mode, result in status[obsid].items():
+                    f.write("%s %s %s\n" %(obsid, mode.upper(), result))
+                    self._log("%s: %s REDUCTION %s" %(obsid, mode.upper(), result))
+        return status
+
+
+# Read a pileup csv in the OBS_ID,NPIXELS format
+def read_pileup_csv(filename):
+    pileup = {}
+    with open(filename) as f:
+        for line in f:
+            parts = line.strip().split(",")
+            if len(parts) == 2:
+                pileup[parts[0]] = int(float(parts[1]))
+    return pileup
@@ -0,0 +1,229 @@
+'''
+    Append-only store of fit results
+
+    A store is a directory of FITS segments, one per append, that are never
+    rewritten. Each segment holds
+        RESULTS  one row per fit: metadata and scalar results (units in TUNIT)
+        SED      one row per SED point, FIT_ID points back to RESULTS
+        MODEL    one row per model energy, same FIT_ID
+    Segments are opened memory-mapped and only the requested columns are
+    copied out, so a light curve only needs the flux columns
+'''
+
+import os
+import glob
+import time
+import tempfile
+import numpy as np
+
+from __lazy import LazyModule
+
+fits = LazyModule("astropy.io.fits")
+
+
+# getFitResults keys to column names and units
+SCALARS = [("Chi2", "Chi2", ""),
+           ("DOF", "DOF", ""),
+           ("Index", "Index", ""),
+           ("Index_errl", "Index_errl", ""),
+           ("Index_erru", "Index_erru", ""),
+           ("Alpha", "Alpha", ""),
+           ("Alpha_errl", "Alpha_errl", ""),
+           ("Alpha_erru", "Alpha_erru", ""),
+           ("Beta", "Beta", ""),
+           ("Beta_errl", "Beta_errl", ""),
+           ("Beta_erru", "Beta_erru", ""),
+           ("Norm", "Norm", ""),
+           ("Norm_errl", "Norm_errl", ""),
+           ("Norm_erru", "Norm_erru", ""),
+           ("Flux [erg cm^-2 s^-1]", "Flux", "erg cm^-2 s^-1"),
+           ("Flux_errl [erg cm^-2 s^-1]", "Flux_errl", "erg cm^-2 s^-1"),
+           ("Flux_erru [erg cm^-2 s^-1]", "Flux_erru", "erg cm^-2 s^-1")]
+
+# Metadata columns, strings then floats
+META_STR = ["ObsID", "Mode", "Model", "Status"]
+META_FLOAT = ["nH", "TSTART", "TSTOP"]
+
+SED = [("Energy [keV]", "Energy", "keV"),
+       ("Energy_err [keV]", "Energy_err", "keV"),
+       ("e2dnde [keV cm^-2 s^-1]", "e2dnde", "keV cm^-2 s^-1"),
+       ("e2dnde_err [keV cm^-2 s^-1]", "e2dnde_err", "keV cm^-2 s^-1"),
+       ("e2dnde_deabsorbed [keV cm^-2 s^-1]", "e2dnde_deabsorbed", "keV cm^-2 s^-1"),
+       ("e2dnde_deabsorbed_err [keV cm^-2 s^-1]", "e2dnde_deabsorbed_err", "keV cm^-2 s^-1")]
+
+MODEL = [("modelEnergy [keV]", "modelEnergy", "keV"),
+         ("model_e2dnde [keV cm^-2 s^-1]", "model_e2dnde", "keV cm^-2 s^-1"),
+         ("model_intrinsic_e2dnde [keV cm^-2 s^-1]", "model_intrinsic_e2dnde", "keV cm^-2 s^-1")]
+
+# CoVar is padded to NCOVAR x NCOVAR with NaN (pwl 2, logpar 3)
+NCOVAR = 3
+
+SEGMENT = "results_%06d.fits"
+
+# Held while a segment is numbered and written, so that processes appending
+# to the same store take different names and FIT_IDs
+LOCK = "append.lock"
+LOCK_TIMEOUT = 60.
+
+
+# Ragged per-fit arrays as one table with a FIT_ID column
+def _ragged_hdu(results, columns, first, name):
+    ids = []
+    values = {col : [] for _, col, _ in columns}
+    for i, res in enumerate(results):
+        arrays = [np.atleast_1d(np.asarray(res.get(key, []), dtype = float)).ravel()
+                  for key, _, _ in columns]
+        n = max(len(a) for a in arrays)
+        ids.append(np.full(n, first + i, dtype = np.int64))
+        for (_, col, _), a in zip(columns, arrays):
+            values[col].append(a if len(a) == n else np.full(n, np.nan))
+
+    cols = [fits.Column(name = "FIT_ID", format = "K",
+                        array = np.concatenate(ids) if ids else np.zeros(0, dtype = np.int64))]
+    for _, col, unit in columns:
+        arr = np.concatenate(values[col]) if values[col] else np.zeros(0)
+        cols.append(fits.Column(name = col, format = "D", unit = unit or None, array = arr))
+    return fits.BinTableHDU.from_columns(cols, name = name)
+
+
+def _results_hdu(results, first):
+    n = len(results)
+    cols = [fits.Column(name = "FIT_ID", format = "K", array = np.arange(first, first + n))]
+
+    for key in META_STR:
+        values = [str(res.get(key, "")) for res in results]
+        width = max([len(v) for v in values] + [1])
+        cols.append(fits.Column(name = key, format = "%dA" %width, array = np.array(values)))
+    for key in META_FLOAT:
+        cols.append(fits.Column(name = key, format = "D",
+                                array = np.array([res.get(key, np.nan) for res in results], dtype = float)))
+
+    for key, col, unit in SCALARS:
+        values = []
+        for res in results:
+            v = res.get(key, None)
+            values.append(np.nan if v is None or np.ndim(v) != 0 else float(v))
+        cols.append(fits.Column(name = col, format = "D", unit = unit or None, array = np.array(values)))
+
+    covar = np.full((n, NCOVAR, NCOVAR), np.nan)
+    for i, res in enumerate(results):
+        c = res.get("CoVar", None)
+        if c is not None:
+            c = np.asarray(c, dtype = float)
+            covar[i, :c.shape[0], :c.shape[1]] = c
+    cols.append(fits.Column(name = "CoVar", format = "%dD" %NCOVAR**2,
+                            dim = "(%d,%d)" %(NCOVAR, NCOVAR), array = covar))
+    return fits.BinTableHDU.from_columns(cols, name = "RESULTS")
+
+
+class ResultsStore():
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.path, SEGMENT.replace("%06d", "*"))))
+
+
+    # Number of fits in the store, from the segment headers only
+    def __len__(self):
+        return sum(fits.getheader(seg, "RESULTS")["NAXIS2"] for seg in self.segments())
+
+
+    # Created exclusively, waiting up to LOCK_TIMEOUT for another writer
+    def _lock(self):
+        lock = os.path.join(self.path, LOCK)
+        start = time.monotonic()
+        while True:
+            try:
+                return os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if time.monotonic() - start > LOCK_TIMEOUT:
+                    raise RuntimeError("ResultsStore: %s is held by another writer (remove it if stale)" %lock)
+                time.sleep(0.05)
+
+
+    def _unlock(self, fd):
+        os.close(fd)
+        os.remove(os.path.join(self.path, LOCK))
+
+
+    # Append a list of result dicts (getFitResults() plus ObsID/Mode/Model/nH/Status)
+    # Returns the FIT_IDs given to them
+    def append(self, results):
+        results = list(results)
+        fd = self._lock()
+        try:
+            return self._append(results)
+        finally:
+            self._unlock(fd)
+
+
+    def _append(self, results):
+        segs = self.segments()
+        first = 0
+        if segs:
+            header = fits.getheader(segs[-1], "RESULTS")
+            first = header["FIRSTID"] + header["NAXIS2"]
+
+        primary = fits.PrimaryHDU()
+        table = _results_hdu(results, first)
+        table.header["FIRSTID"] = first
+        hdul = fits.HDUList([primary, table,
+                             _ragged_hdu(results, SED, first, "SED"),
+                             _ragged_hdu(results, MODEL, first, "MODEL")])
+
+        # Written aside and renamed, a reader never sees a partial segment
+        name = os.path.join(self.path, SEGMENT %len(segs))
+        fd, tmp = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+        os.close(fd)
+        hdul.writeto(tmp, overwrite = True)
+        os.replace(tmp, name)
+        return np.arange(first, first + len(results))
+
+
+    # Columns of an extension over all segments as a dict of arrays
+    # Only the requested columns are copied out of the memory map
+    def _read(self, extname, columns = None, fit_ids = None):
+        parts = {}
+        for seg in self.segments():
+            with fits.open(seg, memmap = True) as hdul:
+                data = hdul[extname].data
+                names = data.columns.names if columns is None else ["FIT_ID"] + [c for c in columns if c != "FIT_ID"]
+                sel = slice(None)
+                if fit_ids is not None:
+                    sel = np.isin(data["FIT_ID"], fit_ids)
+                for name in names:
+                    if name not in data.columns.names:
+                        # Column added after this segment was written
+                        col = np.full(len(data["FIT_ID"][sel]), np.nan)
+                        parts.setdefault(name, []).append(col)
+                        continue
+                    col = np.array(data[name][sel])
+                    if col.dtype.kind in ("S", "U"):
+                        col = np.char.strip(col.astype(str))
+                    parts.setdefault(name, []).append(col)
+        return {name : np.concatenate(arrs) for name, arrs in parts.items()}
+
+
+    # Scalar results, e.g. read(["ObsID", "Flux", "Flux_errl", "Flux_erru"])
+    def read(self, columns = None):
+        return self._read("RESULTS", columns)
+
+
+    # SED points of some (or all) fits, FIT_ID tells which fit a point belongs to
+    def sed(self, fit_ids = None, columns = None):
+        return self._read("SED", columns, fit_ids)
+
+
+    def model(self, fit_ids = None, columns = None):
+        return self._read("MODEL", columns, fit_ids)
+
+
+    # RESULTS columns as an astropy Table
+    def table(self, columns = None):
+        from astropy.table import Table
+        data = self.read(columns)
+        return Table([data[name] for name in data], names = list(data))
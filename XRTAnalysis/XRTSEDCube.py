@@ -0,0 +1,268 @@
+'''
+    SEDs of many fits on a common energy grid
+
+    The SED points of every fit are flattened into one set of arrays (fit
+    row, energy, value, error) and put onto shared energy bins in a single
+    vectorised pass, either
+        rebin    inverse-variance weighted mean of the points in each bin
+        interp   log-log interpolation at the bin centres
+    The result is a (time x energy) cube of the observed and deabsorbed
+    E^2 dN/dE with error planes, a mask of empty bins and the number of
+    points per bin, written to a single FITS file. Rows are ordered by the
+    TSTART of each fit (fits without one come last, in input order).
+'''
+
+import numpy as np
+
+from __lazy import LazyModule
+
+fits = LazyModule("astropy.io.fits")
+u = LazyModule("astropy.units")
+
+
+# Cube planes: (SED key of getFitResults, error key, FITS extension)
+PLANES = [("e2dnde [keV cm^-2 s^-1]", "e2dnde_err [keV cm^-2 s^-1]", "E2DNDE"),
+          ("e2dnde_deabsorbed [keV cm^-2 s^-1]", "e2dnde_deabsorbed_err [keV cm^-2 s^-1]", "E2DNDE_DEABS")]
+
+# Same planes in a ResultsStore SED table
+STORE_PLANES = [("e2dnde", "e2dnde_err"),
+                ("e2dnde_deabsorbed", "e2dnde_deabsorbed_err")]
+
+FLUX_UNIT = "keV cm-2 s-1"
+
+# Per-fit metadata kept with the cube when present
+META = ["ObsID", "Mode", "Model"]
+
+# Time of each fit (s, mission time), the first axis of the cube
+TIME = ["TSTART", "TSTOP"]
+
+
+# Logarithmic bin edges (keV)
+def energy_grid(emin = 0.3, emax = 10., nbins = 30):
+    return np.logspace(np.log10(emin), np.log10(emax), nbins + 1)
+
+
+# Inverse-variance weighted mean of the points in each (row, bin)
+# Points with a missing or non-positive error are left out
+# Returns mean, error and number of points, each (nrows x nbins)
+def rebin_points(row, energy, value, error, edges, nrows):
+    nbins = len(edges) - 1
+    b = np.searchsorted(edges, energy, side = "right") - 1
+    ok = (b >= 0) & (b < nbins) & np.isfinite(value) & np.isfinite(error) & (error > 0)
+    idx = row[ok] * nbins + b[ok]
+    w = 1. / error[ok]**2
+
+    size = nrows * nbins
+    sw = np.bincount(idx, w, minlength = size)
+    swv = np.bincount(idx, w * value[ok], minlength = size)
+    n = np.bincount(idx, minlength = size)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        mean = np.where(n > 0, swv / sw, np.nan)
+        err = np.where(n > 0, 1. / np.sqrt(sw), np.nan)
+    shape = (nrows, nbins)
+    return mean.reshape(shape), err.reshape(shape), n.reshape(shape)
+
+
+# Log-log interpolation of each row's SED at the energies centres
+# Only positive values are used and there is no extrapolation beyond a
+# row's first and last point; the relative error is interpolated linearly
+# Returns value, error and 1 where a value was interpolated (else 0)
+def interpolate_points(row, energy, value, error, centres, nrows):
+    ok = np.isfinite(value) & np.isfinite(error) & (value > 0) & (energy > 0)
+    order = np.lexsort((energy[ok], row[ok]))
+    row = row[ok][order]
+    loge = np.log(energy[ok][order])
+    logv = np.log(value[ok][order])
+    rel = (error[ok] / value[ok])[order]
+
+    ncen = len(centres)
+    shape = (nrows, ncen)
+    if len(row) < 2:
+        return np.full(shape, np.nan), np.full(shape, np.nan), np.zeros(shape, dtype = int)
+
+    # Offsetting each row by more than the energy span gives one sorted key,
+    # so a single searchsorted brackets every (row, centre) at once
+    logc = np.log(centres)
+    lo = min(loge.min(), logc.min())
+    span = max(loge.max(), logc.max()) - lo + 1.
+    key = row * span + (loge - lo)
+    qrow = np.repeat(np.arange(nrows), ncen)
+    q = qrow * span + np.tile(logc - lo, nrows)
+
+    starts = np.searchsorted(row, np.arange(nrows), side = "left")
+    ends = np.searchsorted(row, np.arange(nrows), side = "right")
+    j = np.maximum(np.searchsorted(key, q, side = "left"), starts[qrow] + 1)
+    jc = np.minimum(j, len(key) - 1)
+    inside = (j < ends[qrow]) & (key[jc - 1] <= q) & (key[jc] >= q)
+
+    dk = key[jc] - key[jc - 1]
+    t = np.where(inside & (dk > 0), (q - key[jc - 1]) / np.where(dk > 0, dk, 1.), 0.)
+    val = np.exp(logv[jc - 1] + t * (logv[jc] - logv[jc - 1]))
+    err = val * (rel[jc - 1] + t * (rel[jc] - rel[jc - 1]))
+    val = np.where(inside, val, np.nan)
+    err = np.where(inside, err, np.nan)
+    return val.reshape(shape), err.reshape(shape), inside.reshape(shape).astype(int)
+
+
+# Rows sorted by start time, those without one last in their original order
+def _time_order(tstart):
+    tstart = np.asarray(tstart, dtype = float)
+    return np.lexsort((np.arange(len(tstart)), np.where(np.isnan(tstart), np.inf, tstart)))
+
+
+def _project(method, row, energy, value, error, edges, nrows):
+    if method == "rebin":
+        return rebin_points(row, energy, value, error, edges, nrows)
+    if method == "interp":
+        return interpolate_points(row, energy, value, error, np.sqrt(edges[:-1] * edges[1:]), nrows)
+    raise ValueError("Unknown method: %s" %method)
+
+
+class SEDCube():
+
+    # edges (E + 1), planes {name: (N x E)}, npoints (N x E), meta {column: (N)}
+    def __init__(self, edges, planes, npoints, meta = None, method = "rebin"):
+        self.edges = np.asarray(edges, dtype = float)
+        self.planes = planes
+        self.npoints = npoints
+        self.mask = npoints == 0
+        self.meta = meta if meta is not None else {}
+        self.method = method
+        self._unit = None
+
+
+    # From a list of getFitResults() dicts (e.g. the rows of batch_fit)
+    @classmethod
+    def from_results(cls, results, edges = None, method = "rebin"):
+        results = list(results)
+        tstart = np.array([res.get("TSTART", np.nan) for res in results], dtype = float)
+        results = [results[i] for i in _time_order(tstart)]
+        edges = energy_grid() if edges is None else np.asarray(edges, dtype = float)
+        nrows = len(results)
+
+        energy = [np.atleast_1d(np.asarray(res.get("Energy [keV]", []), dtype = float)) for res in results]
+        row = np.repeat(np.arange(nrows), [len(e) for e in energy])
+        energy = np.concatenate(energy) if nrows else np.zeros(0)
+
+        def flat(key):
+            arrays = [np.atleast_1d(np.asarray(res.get(key, []), dtype = float)) for res in results]
+            arrays = [a if len(a) == n else np.full(n, np.nan)
+                      for a, n in zip(arrays, np.bincount(row, minlength = nrows))]
+            return np.concatenate(arrays) if nrows else np.zeros(0)
+
+        planes = {}
+        npoints = np.zeros((nrows, len(edges) - 1), dtype = int)
+        for key, errkey, name in PLANES:
+            value, error, n = _project(method, row, energy, flat(key), flat(errkey), edges, nrows)
+            planes[name] = value
+            planes[name + "_ERR"] = error
+            if name == "E2DNDE":
+                npoints = n
+
+        meta = {}
+        for key in META:
+            if any(key in res for res in results):
+                meta[key] = np.array([str(res.get(key, "")) for res in results])
+        for key in TIME:
+            meta[key] = np.array([res.get(key, np.nan) for res in results], dtype = float)
+        return cls(edges, planes, npoints, meta, method)
+
+
+    # From a XRTResults.ResultsStore, every fit or only fit_ids
+    @classmethod
+    def from_store(cls, store, edges = None, method = "rebin", fit_ids = None):
+        edges = energy_grid() if edges is None else np.asarray(edges, dtype = float)
+        results = store.read(META + TIME)
+        if fit_ids is not None:
+            sel = np.isin(results["FIT_ID"], fit_ids)
+            results = {key : value[sel] for key, value in results.items()}
+        order = _time_order(results["TSTART"])
+        results = {key : value[order] for key, value in results.items()}
+        ids = results["FIT_ID"]
+        nrows = len(ids)
+
+        columns = ["Energy"] + [c for pair in STORE_PLANES for c in pair]
+        sed = store.sed(ids, columns)
+        # Row of each point in the time ordered cube
+        byid = np.argsort(ids)
+        row = byid[np.searchsorted(ids, sed["FIT_ID"], sorter = byid)] if nrows else np.zeros(0, dtype = int)
+
+        planes = {}
+        npoints = np.zeros((nrows, len(edges) - 1), dtype = int)
+        for (key, errkey), (_, _, name) in zip(STORE_PLANES, PLANES):
+            value, error, n = _project(method, row, sed["Energy"], sed[key], sed[errkey], edges, nrows)
+            planes[name] = value
+            planes[name + "_ERR"] = error
+            if name == "E2DNDE":
+                npoints = n
+        return cls(edges, planes, npoints, results, method)
+
+
+    @property
+    def shape(self):
+        return self.npoints.shape
+
+
+    # Geometric bin centres (keV)
+    @property
+    def energy(self):
+        return np.sqrt(self.edges[:-1] * self.edges[1:])
+
+
+    # A plane as an astropy Quantity, the unit is only built once per cube
+    def quantity(self, name):
+        if self._unit is None:
+            self._unit = u.Unit(FLUX_UNIT)
+        return self.planes[name] << self._unit
+
+
+    def write(self, filename, overwrite = True):
+        primary = fits.PrimaryHDU()
+        primary.header["NFITS"] = self.shape[0]
+        primary.header["NENERGY"] = self.shape[1]
+        primary.header["METHOD"] = self.method
+
+        hdus = [primary]
+        for name, plane in self.planes.items():
+            hdu = fits.ImageHDU(plane, name = name)
+            hdu.header["BUNIT"] = FLUX_UNIT
+            hdus.append(hdu)
+        hdus.append(fits.ImageHDU(self.npoints.astype(np.int16), name = "NPOINTS"))
+
+        cols = [fits.Column(name = "E_MIN", format = "D", unit = "keV", array = self.edges[:-1]),
+                fits.Column(name = "E_REF", format = "D", unit = "keV", array = self.energy),
+                fits.Column(name = "E_MAX", format = "D", unit = "keV", array = self.edges[1:])]
+        hdus.append(fits.BinTableHDU.from_columns(cols, name = "ENERGIES"))
+
+        cols = [fits.Column(name = "ROW", format = "K", array = np.arange(self.shape[0]))]
+        for key, values in self.meta.items():
+            values = np.asarray(values)
+            if values.dtype.kind in ("S", "U"):
+                width = max([len(v) for v in values.astype(str)] + [1])
+                cols.append(fits.Column(name = key, format = "%dA" %width, array = values))
+            else:
+                cols.append(fits.Column(name = key, format = "K" if values.dtype.kind in ("i", "u") else "D",
+                                        unit = "s" if key in TIME else None, array = values))
+        hdus.append(fits.BinTableHDU.from_columns(cols, name = "FITS"))
+        fits.HDUList(hdus).writeto(filename, overwrite = overwrite)
+
+
+    @classmethod
+    def read(cls, filename):
+        with fits.open(filename) as hdul:
+            energies = hdul["ENERGIES"].data
+            edges = np.append(np.array(energies["E_MIN"]), energies["E_MAX"][-1])
+            planes = {}
+            for _, _, name in PLANES:
+                for ext in (name, name + "_ERR"):
+                    planes[ext] = np.array(hdul[ext].data)
+            npoints = np.array(hdul["NPOINTS"].data, dtype = int)
+            table = hdul["FITS"].data
+            meta = {}
+            for key in table.columns.names:
+                if key == "ROW":
+                    continue
+                col = np.array(table[key])
+                meta[key] = np.char.strip(col.astype(str)) if col.dtype.kind in ("S", "U") else col
+            method = hdul[0].header.get("METHOD", "rebin")
+        return cls(edges, planes, npoints, meta, method)
@@ -0,0 +1,145 @@
+'''
+    Run selection from the exposures of the cleaned event files
+
+    Only the primary headers are read, in parallel threads, and the values
+    are kept in a header index so a rescan only opens new or changed files.
+    The mode choice is the one of TestExposure.py
+'''
+
+import os
+import json
+import tempfile
+import threading
+
+from __lazy import LazyModule
+from XRTReduce import PRODUCTS
+
+fits = LazyModule("astropy.io.fits")
+
+
+INDEXFILE = ".header_index.json"
+
+# Primary header keywords kept in the index
+KEYWORDS = ["EXPOSURE", "DATAMODE", "OBS_ID", "DATE-OBS", "OBJECT"]
+
+# Cleaned event files looked at, as in TestExposure.py
+EVENTFILES = {"WT" : "sw%sxwtw2po_cl.evt",
+              "PC2" : "sw%sxpcw2po_cl.evt",
+              "PC3" : "sw%sxpcw3po_cl.evt"}
+
+
+# Mode selection of TestExposure.py
+# PC is chosen only if its exposure is more than ratio times the WT one
+def select_mode(exposure_WT, exposure_PC3, exposure_PC2, ratio = 10.):
+    if exposure_WT > 0.:
+        if exposure_PC3 > 0.:
+            return "PC" if exposure_PC3 / exposure_WT > ratio else "WT"
+        elif exposure_PC2 > 0.:
+            return "PC" if exposure_PC2 / exposure_WT > ratio else "WT"
+        return "WT"
+    elif exposure_PC3 > 0. or exposure_PC2 > 0.:
+        return "PC"
+    return None
+
+
+# Persistent index of primary header values, keyed on path
+# An entry is reused while the file size and mtime are unchanged
+class HeaderIndex():
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.hits = 0
+        try:
+            with open(filename) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+
+    def get(self, path):
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                self.hits += 1
+                return entry
+
+        # getheader only reads up to the END card of the primary header
+        header = fits.getheader(path, 0)
+        entry = {"size" : st.st_size, "mtime" : st.st_mtime_ns}
+        for key in KEYWORDS:
+            value = header.get(key, None)
+            entry[key] = value if isinstance(value, (int, float, str, bool)) or value is None else str(value)
+        with self.lock:
+            self.entries[path] = entry
+            self.opened += 1
+        return entry
+
+
+    def save(self):
+        # Forget files that no longer exist
+        self.entries = {p : e for p, e in self.entries.items() if os.path.isfile(p)}
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(self.filename)), suffix = ".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+
+
+# Exposures (WT, PC3, PC2) of one observation, 0 for missing files
+def observation_exposures(repdir, obsid, index):
+    exposures = {}
+    for name, pattern in EVENTFILES.items():
+        path = os.path.join(repdir, obsid, pattern %obsid)
+        if os.path.isfile(path):
+            exposures[name] = float(index.get(path)["EXPOSURE"] or 0.)
+        else:
+            exposures[name] = 0.
+    return exposures["WT"], exposures["PC3"], exposures["PC2"]
+
+
+# Completeness check of TestReduction.sh for the selected mode
+def reduction_complete(obsdir, mode):
+    products = PRODUCTS[mode.lower()]
+    if not all(os.path.isfile(os.path.join(obsdir, p)) for p in products):
+        return False
+    return os.path.islink(os.path.join(obsdir, "%s.rmf" %mode.lower()))
+
+
+# Scan every ObsID of a Reprocessed directory
+# Returns a list of (ObsID, mode, complete) and writes run_selection.dat
+# With check = True only complete reductions are written, as in TestReduction.sh
+def scan(repdir, ratio = 10., nthreads = 16, check = True, output = "run_selection.dat",
+         verbose = True):
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = HeaderIndex(os.path.join(repdir, INDEXFILE))
+    obsids = [d for d in sorted(os.listdir(repdir)) if os.path.isdir(os.path.join(repdir, d))]
+
+    def one(obsid):
+        mode = select_mode(*observation_exposures(repdir, obsid, index), ratio = ratio)
+        complete = mode is not None and reduction_complete(os.path.join(repdir, obsid), mode)
+        return obsid, mode, complete
+
+    with ThreadPoolExecutor(max_workers = nthreads) as pool:
+        results = list(pool.map(one, obsids))
+    index.save()
+
+    lines = []
+    for obsid, mode, complete in results:
+        if mode is None:
+            if verbose:
+                print ("%s: MODE NOT FOUND" %obsid)
+            continue
+        if verbose and check:
+            print ("%s: %s REDUCTION %s" %(obsid, mode, "SUCCEEDED" if complete else "FAILED"))
+        if complete or not check:
+            lines.append("%s %s\n" %(obsid, mode))
+
+    if output is not None:
+        with open(os.path.join(repdir, output), "w") as f:
+            f.writelines(lines)
+    if verbose:
+        print ("%d headers read, %d taken from the index" %(index.opened, index.hits))
+    return results
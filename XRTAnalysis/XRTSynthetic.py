@@ -0,0 +1,241 @@
+'''
+    Synthetic XRT data for benchmarks and checks without real observations
+
+    Writes a toy response (Gaussian redistribution RMF and a smooth ARF),
+    absorbed power law or log parabola source and background spectra drawn
+    from it, grouped as ReduceXRT.sh would, and cleaned event files with a
+    King-profile source, a flat background, a TAN sky WCS and GTIs.
+    Everything is seeded, so the same call always writes the same files.
+'''
+
+import os
+import numpy as np
+
+from __deabsorb import transmission
+from __lazy import LazyModule
+from XRTExtract import write_pha
+from XRTGroup import group_pha
+
+fits = LazyModule("astropy.io.fits")
+
+
+# Keywords written to every synthetic spectrum / event file
+HEADER = {"TELESCOP" : "SWIFT", "INSTRUME" : "XRT"}
+
+# PSF of the XRT, King profile in arcsec
+KING_RC = 5.8
+KING_BETA = 1.55
+PIXEL = 2.36
+
+
+# Model and channel energy grids (keV) of the toy response
+def response_grid(nchan = 1024, chanwidth = 0.01, emax = 12.):
+    energ_lo = np.arange(1, int(round(emax / chanwidth)) + 1) * chanwidth
+    energ_hi = energ_lo + chanwidth
+    ebounds = np.arange(nchan + 1) * chanwidth
+    return energ_lo, energ_hi, ebounds
+
+
+# Redistribution matrix, rows are model energies, columns are channels
+# The resolution is 0.05 + 0.02 sqrt(E) keV (1 sigma)
+def redistribution(energ_lo, energ_hi, ebounds, nsigma = 4.):
+    ecen = 0.5 * (energ_lo + energ_hi)
+    ccen = 0.5 * (ebounds[:-1] + ebounds[1:])
+    sigma = 0.05 + 0.02 * np.sqrt(ecen)
+    z = (ccen[None, :] - ecen[:, None]) / sigma[:, None]
+    matrix = np.where(np.abs(z) <= nsigma, np.exp(-0.5 * z * z), 0.)
+    norm = matrix.sum(axis = 1)
+    return matrix / np.where(norm > 0, norm, 1.)[:, None]
+
+
+# Effective area (cm^2), log-normal in energy with a peak near 1.3 keV
+def effective_area(energ_lo, energ_hi, peak = 100.):
+    ecen = 0.5 * (energ_lo + energ_hi)
+    return peak * np.exp(-0.5 * ((np.log(ecen) - 0.3) / 1.0)**2)
+
+
+def write_rmf(filename, energ_lo, energ_hi, ebounds, matrix):
+    nchan = len(ebounds) - 1
+    # One group per energy, from the first to the last non-zero channel
+    nonzero = matrix > 0
+    first = np.argmax(nonzero, axis = 1)
+    last = nchan - np.argmax(nonzero[:, ::-1], axis = 1)
+    rows = [matrix[i, f:l].astype(np.float32) for i, (f, l) in enumerate(zip(first, last))]
+
+    cols = [fits.Column(name = "ENERG_LO", format = "E", unit = "keV", array = energ_lo),
+            fits.Column(name = "ENERG_HI", format = "E", unit = "keV", array = energ_hi),
+            fits.Column(name = "N_GRP", format = "I", array = np.ones(len(energ_lo))),
+            fits.Column(name = "F_CHAN", format = "PI()", array = [[f] for f in first]),
+            fits.Column(name = "N_CHAN", format = "PI()", array = [[l - f] for f, l in zip(first, last)]),
+            fits.Column(name = "MATRIX", format = "PE()", array = rows)]
+    mat = fits.BinTableHDU.from_columns(cols, name = "MATRIX")
+    mat.header["DETCHANS"] = nchan
+    mat.header["TLMIN4"] = 0
+    mat.header["CHANTYPE"] = "PI"
+
+    ebd = fits.BinTableHDU.from_columns(
+            [fits.Column(name = "CHANNEL", format = "J", array = np.arange(nchan)),
+             fits.Column(name = "E_MIN", format = "E", unit = "keV", array = ebounds[:-1]),
+             fits.Column(name = "E_MAX", format = "E", unit = "keV", array = ebounds[1:])],
+            name = "EBOUNDS")
+    fits.HDUList([fits.PrimaryHDU(), mat, ebd]).writeto(filename, overwrite = True)
+
+
+def write_arf(filename, energ_lo, energ_hi, area):
+    cols = [fits.Column(name = "ENERG_LO", format = "E", unit = "keV", array = energ_lo),
+            fits.Column(name = "ENERG_HI", format = "E", unit = "keV", array = energ_hi),
+            fits.Column(name = "SPECRESP", format = "E", unit = "cm**2", array = area)]
+    hdu = fits.BinTableHDU.from_columns(cols, name = "SPECRESP")
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(filename, overwrite = True)
+
+
+# Absorbed dN/dE (ph cm^-2 s^-1 keV^-1)
+# params are those of XRT_Analysis.pwl / logpar: (norm, index) or (norm, alpha, beta)
+def photon_spectrum(model, energy, params, nH, absorb = "pha"):
+    energy = np.asarray(energy, dtype = float)
+    if model == "pwl":
+        norm, index = params
+        dnde = norm * energy**(-index)
+    elif model == "logpar":
+        norm, alpha, beta = params
+        dnde = norm * energy**-(alpha + beta * np.log10(energy))
+    else:
+        raise ValueError("Unknown model: %s" %model)
+    return dnde * transmission(nH, energy, absorb)
+
+
+# Expected counts per channel of a source seen through the toy response
+def folded_counts(model, params, nH, exposure, absorb = "pha", nchan = 1024):
+    energ_lo, energ_hi, ebounds = response_grid(nchan)
+    ecen = 0.5 * (energ_lo + energ_hi)
+    phi = photon_spectrum(model, ecen, params, nH, absorb) * (energ_hi - energ_lo)
+    area = effective_area(energ_lo, energ_hi)
+    return exposure * (phi * area) @ redistribution(energ_lo, energ_hi, ebounds)
+
+
+# Source, background, RMF, ARF and grouped spectrum of one observation
+# Files are named as in ReduceXRT.sh (pc.rmf, pc_src.arf, pc_src.pha,
+# pc_back.pha, pc_grp.pha) and the paths are returned in a dict
+# bkgrate is in counts s^-1 channel^-1 over the background region,
+# backscal the source to background area ratio
+def write_spectra(directory, model = "pwl", params = None, nH = 0.2, exposure = 2.e4,
+                  mode = "pc", absorb = "pha", backscal = 0.1, bkgrate = 2.e-5,
+                  nchan = 1024, group = 20, seed = None):
+    if params is None:
+        params = (0.05, 2.0) if model == "pwl" else (0.05, 2.3, 0.3)
+    os.makedirs(directory, exist_ok = True)
+    rng = np.random.default_rng(seed)
+
+    energ_lo, energ_hi, ebounds = response_grid(nchan)
+    matrix = redistribution(energ_lo, energ_hi, ebounds)
+    area = effective_area(energ_lo, energ_hi)
+
+    ecen = 0.5 * (energ_lo + energ_hi)
+    phi = photon_spectrum(model, ecen, params, nH, absorb) * (energ_hi - energ_lo)
+    src = exposure * (phi * area) @ matrix + exposure * bkgrate * backscal
+    bkg = np.full(nchan, exposure * bkgrate)
+
+    files = {"rmf" : "%s.rmf" %mode,
+             "arf" : "%s_src.arf" %mode,
+             "src" : "%s_src.pha" %mode,
+             "back" : "%s_back.pha" %mode,
+             "grp" : "%s_grp.pha" %mode}
+    files = {key : os.path.join(directory, name) for key, name in files.items()}
+
+    write_rmf(files["rmf"], energ_lo, energ_hi, ebounds, matrix)
+    write_arf(files["arf"], energ_lo, energ_hi, area)
+    write_pha(files["src"], rng.poisson(src), exposure, backscal, HEADER)
+    write_pha(files["back"], rng.poisson(bkg), exposure, 1., HEADER)
+    group_pha(files["src"], files["grp"], os.path.basename(files["back"]),
+              os.path.basename(files["rmf"]), os.path.basename(files["arf"]),
+              value = group)
+    return files
+
+
+# One observation directory per ObsID under directory, as BatchFit expects
+# Returns the grouped spectra
+def synthetic_tree(directory, obsids, model = "pwl", mode = "pc", seed = 0, **kwargs):
+    grouped = []
+    for i, obsid in enumerate(obsids):
+        files = write_spectra(os.path.join(directory, str(obsid)), model = model, mode = mode,
+                              seed = seed + i, **kwargs)
+        grouped.append(files["grp"])
+    return grouped
+
+
+# Cleaned event file: nsrc King-profile events at (ra, dec), nbkg flat
+# background events and ngti equal GTIs of exposure / ngti seconds
+# Source PI channels follow the absorbed power law seen through the toy
+# response, background PI channels are flat
+# lightcurve, optional, maps event times to a relative source rate in [0, 1]
+def write_events(filename, ra = 356.77015, dec = 51.70497, nsrc = 30000, nbkg = 3000,
+                 exposure = 1.e4, ngti = 2, tstart = 1.e8, index = 2., nH = 0.2,
+                 size = 1000, lightcurve = None, seed = None):
+    rng = np.random.default_rng(seed)
+    centre = 0.5 * (size + 1)
+
+    # GTIs separated by gaps of the same length
+    span = exposure / ngti
+    starts = tstart + 2. * span * np.arange(ngti)
+    gti = np.stack([starts, starts + span], axis = 1)
+
+    def times(n):
+        return starts[rng.integers(0, ngti, n)] + rng.random(n) * span
+
+    # King radii by inverse CDF: P(<r) = 1 - (1 + (r/rc)^2)^(1 - beta)
+    tsrc = times(nsrc)
+    if lightcurve is not None:
+        tsrc = tsrc[rng.random(nsrc) < lightcurve(tsrc)]
+    n = len(tsrc)
+    r = KING_RC * np.sqrt((1. - rng.random(n))**(1. / (1. - KING_BETA)) - 1.) / PIXEL
+    theta = rng.random(n) * 2. * np.pi
+
+    counts = folded_counts("pwl", (1., index), nH, 1.)
+    counts[:30] = 0.
+    pisrc = rng.choice(len(counts), size = n, p = counts / counts.sum())
+
+    x = np.concatenate([centre + r * np.cos(theta), rng.uniform(0.5, size + 0.5, nbkg)])
+    y = np.concatenate([centre + r * np.sin(theta), rng.uniform(0.5, size + 0.5, nbkg)])
+    t = np.concatenate([tsrc, times(nbkg)])
+    pi = np.concatenate([pisrc, rng.integers(30, len(counts), nbkg)])
+
+    x = np.round(x).astype(np.int16)
+    y = np.round(y).astype(np.int16)
+    keep = (x >= 1) & (x <= size) & (y >= 1) & (y <= size)
+    order = np.argsort(t[keep], kind = "stable")
+
+    cols = [fits.Column(name = "TIME", format = "D", unit = "s", array = t[keep][order]),
+            fits.Column(name = "X", format = "I", unit = "pixel", array = x[keep][order]),
+            fits.Column(name = "Y", format = "I", unit = "pixel", array = y[keep][order]),
+            fits.Column(name = "PI", format = "J", unit = "chan", array = pi[keep][order])]
+    events = fits.BinTableHDU.from_columns(cols, name = "EVENTS")
+    hdr = events.header
+    for key, value in HEADER.items():
+        hdr[key] = value
+    hdr["DATAMODE"] = "PHOTON"
+    hdr["TCTYP2"] = "RA---TAN"
+    hdr["TCRVL2"] = ra
+    hdr["TCRPX2"] = centre
+    hdr["TCDLT2"] = -PIXEL / 3600.
+    hdr["TLMIN2"] = 1
+    hdr["TLMAX2"] = size
+    hdr["TCTYP3"] = "DEC--TAN"
+    hdr["TCRVL3"] = dec
+    hdr["TCRPX3"] = centre
+    hdr["TCDLT3"] = PIXEL / 3600.
+    hdr["TLMIN3"] = 1
+    hdr["TLMAX3"] = size
+    hdr["TLMIN4"] = 0
+    hdr["TLMAX4"] = len(counts) - 1
+    hdr["TSTART"] = gti[0, 0]
+    hdr["TSTOP"] = gti[-1, 1]
+    hdr["EXPOSURE"] = exposure
+
+    primary = fits.PrimaryHDU()
+    primary.header["EXPOSURE"] = exposure
+    gtihdu = fits.BinTableHDU.from_columns(
+            [fits.Column(name = "START", format = "D", unit = "s", array = gti[:, 0]),
+             fits.Column(name = "STOP", format = "D", unit = "s", array = gti[:, 1])],
+            name = "GTI")
+    fits.HDUList([primary, events, gtihdu]).writeto(filename, overwrite = True)
+    return gti
@@ -0,0 +1,232 @@
+'''
+    Time-resolved spectra from one pass over a cleaned event file
+
+    The events of {pc,wt}_cl.evt are read once; every event gets a time
+    bin with np.searchsorted and each region's spectra for all bins come
+    from a single np.bincount over (bin, PI). Bins are given by the user
+    or built from the source events:
+        uniform  fixed length bins, empty (no GTI) bins are dropped
+        counts   a constant number of source events per bin
+        blocks   Bayesian blocks (Scargle et al. 2013)
+    The adaptive bins are found in good time (the GTI gaps removed), and the
+    EXPOSURE of each bin is its overlap with the GTIs.
+    Each bin is written as OUTDIR/tNNNN/{mode}_src.pha, background and
+    grouped spectrum, pointing at the observation's RMF and ARF, so OUTDIR
+    can be passed to XRTBatch.batch_fit as it is.
+'''
+
+import os
+import numpy as np
+
+from __lazy import LazyModule
+from XRTEvents import open_events, read_region, pixel_region_mask, read_gti
+from XRTEvents import good_time, good_time_inverse, gti_exposure, clip_gti
+from XRTExtract import pi_channels, region_backscal, write_pha
+from XRTGroup import group_pha, standard_files
+
+fits = LazyModule("astropy.io.fits")
+_stats = LazyModule("astropy.stats")
+
+
+# Label (and sub-directory) of the i-th time bin
+LABEL = "t%04d"
+
+# Table of the bins written next to them
+INDEX = "slices.fits"
+
+
+# Fixed length bins over the GTIs, bins without good time are dropped
+def uniform_edges(gti, binsize):
+    edges = np.arange(gti[0, 0], gti[-1, 1] + binsize, binsize)
+    keep = gti_exposure(gti, edges) > 0
+    return [(lo, hi) for lo, hi, k in zip(edges[:-1], edges[1:], keep) if k]
+
+
+# Bins of `counts` source events; the remainder is added to the last bin
+def count_edges(gti, times, counts):
+    times = np.sort(times)
+    c = good_time(gti, times)
+    n = len(c) // counts
+    if n <= 1:
+        return [(gti[0, 0], gti[-1, 1])]
+    # Cut half way (in good time) between the last event of a bin and the next
+    cut = np.arange(1, n) * counts
+    cuts = good_time_inverse(gti, 0.5 * (c[cut - 1] + c[cut]))
+    edges = np.concatenate([[gti[0, 0]], cuts, [gti[-1, 1]]])
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# Bayesian blocks of the source events, p0 is the false alarm probability
+# of each change point
+def block_edges(gti, times, p0 = 0.05):
+    if len(times) < 2:
+        return [(gti[0, 0], gti[-1, 1])]
+    c = np.sort(good_time(gti, times))
+    blocks = _stats.bayesian_blocks(c, fitness = "events", p0 = p0)
+    edges = np.concatenate([[gti[0, 0]], good_time_inverse(gti, blocks[1:-1]), [gti[-1, 1]]])
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# Columns of an event file used for the spectra, read in one pass: PI (from
+# the first channel tlmin), TIME, X, Y, the GTIs and the EVENTS and primary headers
+def read_events(evtfile):
+    hdul, data, header = open_events(evtfile)
+    with hdul:
+        tlmin, nchan = pi_channels(header)
+        events = {"pi" : np.asarray(data["PI"], dtype = np.int64) - tlmin,
+                  "time" : np.asarray(data["TIME"], dtype = float),
+                  "x" : np.asarray(data["X"], dtype = np.int64),
+                  "y" : np.asarray(data["Y"], dtype = np.int64),
+                  "gti" : read_gti(hdul),
+                  "header" : header.copy(),
+                  "primary" : hdul[0].header.copy(),
+                  "tlmin" : tlmin,
+                  "nchan" : nchan}
+    return events
+
+
+# Event mask and BACKSCAL of each region file, the sky distances are shared
+def region_masks(events, regfiles):
+    masks = []
+    backscal = []
+    cache = {}
+    for regfile in regfiles:
+        regions = read_region(regfile)
+        masks.append(pixel_region_mask(events["x"], events["y"], events["header"], regions, cache))
+        backscal.append(region_backscal(events["header"], regions))
+    return masks, backscal
+
+
+# Spectra (nbins x nchan) of the events of each mask in every bin, one
+# np.bincount over (bin, PI) per mask; bins is a list of (tstart, tstop)
+def bin_counts(events, masks, bins):
+    pi, time, nchan = events["pi"], events["time"], events["nchan"]
+    bins = np.asarray(bins, dtype = float).reshape(-1, 2)
+    nbins = len(bins)
+    # Bins may leave gaps, an event belongs to the bin whose start precedes it
+    b = np.searchsorted(bins[:, 0], time, side = "right") - 1
+    good = (pi >= 0) & (pi < nchan) & (b >= 0)
+    good[good] &= time[good] < bins[b[good], 1]
+
+    counts = []
+    for mask in masks:
+        sel = good & mask
+        flat = np.bincount(b[sel] * nchan + pi[sel], minlength = nbins * nchan)
+        counts.append(flat.reshape(nbins, nchan))
+    return counts
+
+
+def _gti_hdu(gti):
+    cols = [fits.Column(name = "START", format = "D", unit = "s", array = gti[:, 0]),
+            fits.Column(name = "STOP", format = "D", unit = "s", array = gti[:, 1])]
+    return fits.BinTableHDU.from_columns(cols, name = "GTI")
+
+
+# Split one observation of a reduced directory into time-resolved spectra
+# method: "uniform" (value = bin length in s), "counts" (value = source events
+# per bin), "blocks" (value = p0) or "edges" (value = list of (tstart, tstop))
+# The background region, RMF and ARF are those of the whole observation
+# (wt_rescale_back.pha keeps the rescaled WT BACKSCAL); returns the bin table
+def time_resolve(obsdir, mode = "wt", method = "counts", value = 2000, outdir = None,
+                 group = 20, bad = "0-29"):
+    evtfile = os.path.join(obsdir, "%s_cl.evt" %mode)
+    srcreg = os.path.join(obsdir, "%s_src.reg" %mode)
+    backreg = os.path.join(obsdir, "%s_back.reg" %mode)
+    if outdir is None:
+        outdir = os.path.join(obsdir, "TimeResolved_%s" %mode)
+
+    # One read of the events; the source mask gives both the source times of
+    # the adaptive binnings and the source spectra
+    events = read_events(evtfile)
+    (srcmask, backmask), backscal = region_masks(events, (srcreg, backreg))
+    gti = events["gti"]
+    header = events["header"]
+
+    if method == "edges":
+        bins = [tuple(b) for b in value]
+    else:
+        times = events["time"][srcmask]
+        if method == "uniform":
+            bins = uniform_edges(gti, value)
+        elif method == "counts":
+            bins = count_edges(gti, times, int(value))
+        elif method == "blocks":
+            bins = block_edges(gti, times, value)
+        else:
+            raise ValueError("Unknown binning method: %s" %method)
+
+    src, back = bin_counts(events, (srcmask, backmask), bins)
+
+    srcname, backname, rmf, arf = standard_files(mode)
+    if mode == "wt":
+        # change_backscale of ReduceXRT.sh
+        from XRTReduce import WT_BACKSCAL
+        backscal[1] = WT_BACKSCAL
+
+    # Exposure of a bin is its good time, scaled so the bins of the whole
+    # observation add up to the EXPOSURE of the event file (dead time)
+    bins = np.asarray(bins, dtype = float).reshape(-1, 2)
+    ontime = np.diff(good_time(gti, bins), axis = 1)[:, 0]
+    total = float(np.sum(gti[:, 1] - gti[:, 0]))
+    livefrac = float(header.get("EXPOSURE", total)) / total if total > 0 else 1.
+    exposure = ontime * livefrac
+
+    labels = []
+    for i, (tstart, tstop) in enumerate(bins):
+        if exposure[i] <= 0:
+            continue
+        label = LABEL %i
+        bindir = os.path.join(outdir, label)
+        os.makedirs(bindir, exist_ok = True)
+        bingti = _gti_hdu(clip_gti(gti, tstart, tstop))
+        hdr = header.copy()
+        hdr["TSTART"] = tstart
+        hdr["TSTOP"] = tstop
+        hdr["ONTIME"] = ontime[i]
+        hdr["LIVETIME"] = exposure[i]
+        write_pha(os.path.join(bindir, srcname), src[i], exposure[i], backscal[0], hdr, events["tlmin"],
+                  fits.PrimaryHDU(header = events["primary"]), bingti)
+        write_pha(os.path.join(bindir, backname), back[i], exposure[i], backscal[1], hdr, events["tlmin"],
+                  fits.PrimaryHDU(header = events["primary"]), bingti)
+        # RMF and ARF of the whole observation, two levels up
+        group_pha(os.path.join(bindir, srcname), os.path.join(bindir, "%s_grp.pha" %mode),
+                  backname, os.path.relpath(os.path.join(obsdir, rmf), bindir),
+                  os.path.relpath(os.path.join(obsdir, arf), bindir),
+                  value = group, bad = bad)
+        labels.append(i)
+
+    labels = np.array(labels, dtype = int)
+    index = {"LABEL" : np.array([LABEL %i for i in labels]),
+             "TSTART" : bins[labels, 0],
+             "TSTOP" : bins[labels, 1],
+             "EXPOSURE" : exposure[labels],
+             "SRC_COUNTS" : src.sum(axis = 1)[labels],
+             "BACK_COUNTS" : back.sum(axis = 1)[labels]}
+    cols = [fits.Column(name = "LABEL", format = "8A", array = index["LABEL"])]
+    for key, unit in (("TSTART", "s"), ("TSTOP", "s"), ("EXPOSURE", "s")):
+        cols.append(fits.Column(name = key, format = "D", unit = unit, array = index[key]))
+    for key in ("SRC_COUNTS", "BACK_COUNTS"):
+        cols.append(fits.Column(name = key, format = "K", unit = "count", array = index[key]))
+    hdu = fits.BinTableHDU.from_columns(cols, name = "SLICES")
+    hdu.header["MODE"] = mode
+    hdu.header["METHOD"] = method
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(os.path.join(outdir, INDEX), overwrite = True)
+    return index
+
+
+# Fit every bin written by time_resolve with XRTBatch.batch_fit
+# The returned table gains the TSTART, TSTOP and EXPOSURE of each bin
+def fit_slices(outdir, nH, **config):
+    from XRTBatch import batch_fit
+
+    with fits.open(os.path.join(outdir, INDEX)) as hdul:
+        table = hdul["SLICES"].data
+        labels = np.char.strip(np.array(table["LABEL"]).astype(str))
+        columns = {key : np.array(table[key]) for key in ("TSTART", "TSTOP", "EXPOSURE")}
+        mode = hdul["SLICES"].header["MODE"]
+
+    tabl = batch_fit(outdir, nH, runSelection = {label : mode for label in labels}, **config)
+    rows = np.searchsorted(labels, np.array(tabl["ObsID"]).astype(str))
+    for key, values in columns.items():
+        tabl[key] = values[rows]
+    return tabl
@@ -0,0 +1,121 @@
+'''
+    Confidence bands ("butterflies") of the intrinsic spectral models
+
+    Parameters are stacked as (N, k) and covariances as (N, k, k) so many
+    fits are evaluated at once on any energy grid. Parameter order is the
+    one of getConfidienceInterval (norm first), covariance order the one of
+    CoVar (shape parameters first, norm last)
+        pwl     params [norm, index]         cov [index, norm]
+        logpar  params [norm, alpha, beta]   cov [alpha, beta, norm]
+'''
+
+import numpy as np
+
+
+# Number of spectral parameters of each model
+NPARAMS = {"pwl" : 2, "logpar" : 3}
+
+
+# Stack a single fit as a batch of one
+def as_batch(params, cov):
+    params = np.asarray(params, dtype = float)
+    cov = np.asarray(cov, dtype = float)
+    single = params.ndim == 1
+    if single:
+        params = params[np.newaxis]
+        cov = cov[np.newaxis]
+    return params, cov, single
+
+
+# Model dN/dE, (N, E)
+def model_flux(model, params, energy):
+    E = np.asarray(energy, dtype = float)[np.newaxis]
+    norm = params[:, :1]
+    if model == "pwl":
+        return norm * E**(-params[:, 1:2])
+    elif model == "logpar":
+        return norm * E**-(params[:, 1:2] + params[:, 2:3] * np.log10(E))
+    raise ValueError("Model not yet implemented: %s" %model)
+
+
+# d ln f / d(parameter) in covariance order, (N, E, k)
+def log_jacobian(model, params, energy):
+    lnE = np.log(np.asarray(energy, dtype = float))
+    N = len(params)
+    dnorm = (1. / params[:, 0])[:, np.newaxis] * np.ones((1, len(lnE)))
+    dshape = -np.broadcast_to(lnE, (N, len(lnE)))
+    if model == "pwl":
+        cols = [dshape, dnorm]
+    elif model == "logpar":
+        cols = [dshape, dshape * np.log10(np.asarray(energy, dtype = float)), dnorm]
+    else:
+        raise ValueError("Model not yet implemented: %s" %model)
+    return np.stack(cols, axis = -1)
+
+
+# Linear error propagation, returns (f, sigma_f), both (N, E)
+def linear_bands(model, params, cov, energy):
+    fx = model_flux(model, params, energy)
+    J = log_jacobian(model, params, energy)
+    var = np.einsum("nek,nkl,nel->ne", J, cov, J)
+    return fx, fx * np.sqrt(np.maximum(var, 0.))
+
+
+# Square root of each covariance, (N, k, k); tolerates semi-definite matrices
+def _cov_sqrt(cov):
+    w, V = np.linalg.eigh(0.5 * (cov + np.swapaxes(cov, 1, 2)))
+    return V * np.sqrt(np.maximum(w, 0.))[:, np.newaxis, :]
+
+
+# Covariance order back to parameter order (norm first)
+def _to_params(model, draws):
+    k = NPARAMS[model]
+    order = [k - 1] + list(range(k - 1))
+    return draws[..., order]
+
+
+# Monte Carlo bands: percentiles of the model over draws from the
+# multivariate normal of each fit, (P, N, E)
+# Draws are made ndraw / chunk at a time and only a histogram of the model
+# per (fit, energy) is kept, so memory does not grow with ndraw. The
+# histogram spans +-span linear sigmas around the best fit with nbins bins
+# (draws outside fall in the edge bins)
+def mc_bands(model, params, cov, energy, percentiles = (16., 50., 84.), ndraw = 10000,
+             chunk = 500, nbins = 512, span = 8., seed = None):
+    rng = np.random.default_rng(seed)
+    k = NPARAMS[model]
+    N = len(params)
+    nE = len(energy)
+
+    fx, sigma = linear_bands(model, params, cov, energy)
+    sigma = np.where(sigma > 0, sigma, np.abs(fx) * 1.e-6 + 1.e-300)
+    lo = fx - span * sigma
+    width = 2. * span * sigma / nbins
+
+    centre = np.concatenate([params[:, 1:], params[:, :1]], axis = 1)
+    A = _cov_sqrt(cov)
+    offset = (np.arange(N * nE) * nbins).reshape(N, nE)
+    hist = np.zeros(N * nE * nbins, dtype = np.int64)
+
+    done = 0
+    while done < ndraw:
+        n = min(chunk, ndraw - done)
+        z = rng.standard_normal((n, N, k))
+        draws = centre + np.einsum("cnl,nkl->cnk", z, A)
+        f = model_flux(model, _to_params(model, draws).reshape(n * N, k),
+                       energy).reshape(n, N, nE)
+        idx = np.clip(np.floor((f - lo) / width), 0, nbins - 1).astype(np.int64)
+        hist += np.bincount((idx + offset).ravel(), minlength = len(hist))
+        done += n
+
+    # Percentiles from the cumulative histogram, linear within a bin
+    cdf = np.cumsum(hist.reshape(N, nE, nbins), axis = -1) / float(ndraw)
+    out = np.empty((len(percentiles), N, nE))
+    for i, p in enumerate(percentiles):
+        q = p / 100.
+        j = np.minimum((cdf < q).sum(axis = -1), nbins - 1)
+        prev = np.where(j > 0, np.take_along_axis(cdf, np.maximum(j - 1, 0)[..., np.newaxis], -1)[..., 0], 0.)
+        cur = np.take_along_axis(cdf, j[..., np.newaxis], -1)[..., 0]
+        frac = np.where(cur > prev, (q - prev) / np.where(cur > prev, cur - prev, 1.), 0.5)
+        out[i] = lo + (j + frac) * width
+    return out
@@ -0,0 +1,249 @@
+'''
+    Parametric bootstrap of a ForwardFold fit
+
+    K Poisson realisations of the source and background counts of every
+    spectrum are drawn from the best fit at once, as (K x groups) arrays,
+    and refitted together: the models of the K parameter sets are folded
+    with one sparse product per spectrum and damped Gauss-Newton steps move
+    every fit that has not converged yet. Batches of realisations can be
+    shared by worker processes. Percentiles of the refitted parameters and
+    flux give intervals that do not depend on the fit being good.
+'''
+
+import os
+import numpy as np
+
+from __forwardfold import STATISTICS, KEV2ERG, NCFLUXGRID, _trapz, FoldedSpectrum
+
+
+# Realisations refitted together, and the limit on the damped steps
+BATCH = 256
+ITERATIONS = 200
+
+# Energy range (keV) of the absorbed flux when there is no cflux, as writeModel
+FLUX_BAND = (2., 10.)
+
+
+# Counts of K realisations of one spectrum, (K x groups), in place of the
+# FoldedSpectrum data for STATISTICS
+class Realisations():
+
+    def __init__(self, spec, counts, bkg):
+        self.counts = counts
+        self.bkg = bkg
+        self.backratio = spec.backratio
+        self.hasBackground = spec.hasBackground
+
+
+    def take(self, rows):
+        return Realisations(self, self.counts[rows], self.bkg[rows])
+
+
+    netCounts = FoldedSpectrum.netCounts
+
+
+# Draw K realisations of every spectrum of the fitter around its best fit
+# The background expectation is the observed background spectrum
+def draw(fitter, K, rng):
+    data = []
+    for spec in fitter.spectra:
+        mu = spec.fold @ fitter.photonFlux(fitter.params, spec)[0]
+        bkg = np.zeros((K, spec.ngroups))
+        if spec.hasBackground:
+            bkg = rng.poisson(spec.bkg, size = (K, spec.ngroups)).astype(float)
+        counts = rng.poisson(mu + spec.backratio * spec.bkg, size = (K, spec.ngroups)).astype(float)
+        data.append(Realisations(spec, counts, bkg))
+    return data
+
+
+# d(ln dN/dE)/d(shape) at energies e, (E x nshape)
+def _dlnShape(model, e):
+    loge = np.log(e)
+    if model == "pwl":
+        return -loge[:, None]
+    return np.stack([-loge, -loge * loge / np.log(10.)], axis = 1)
+
+
+# Absorbed photon flux per model bin of K parameter sets (K x E) and
+# d(ln flux)/d(theta) split into the parts that depend on theta, (K x p),
+# and on energy, (E x p): dlnphi = a[k, p] + b[e, p]
+def photon_flux(fitter, theta, spec):
+    nshape = 1 if fitter.modelIntrinsic == "pwl" else 2
+    shape = theta[:, 1:1 + nshape]
+    nH = np.full(len(theta), fitter.nH) if fitter.nH_frozen else theta[:, -1]
+
+    lgK = theta[:, 0].copy()
+    a = np.zeros(theta.shape)
+    a[:, 0] = np.log(10.)
+    if fitter.ifcFlux:
+        # K = 10^lg10Flux / int E shape(E) dE over [emin, emax]
+        e = np.logspace(np.log10(fitter.emin), np.log10(fitter.emax), NCFLUXGRID)
+        dlnf = _dlnShape(fitter.modelIntrinsic, e)
+        integrand = (e * KEV2ERG) * np.exp(shape @ dlnf.T)
+        integral = _trapz(integrand.T, e)
+        dintegral = np.stack([_trapz((integrand * d).T, e) for d in dlnf.T], axis = 1)
+        lgK -= np.log10(integral)
+        a[:, 1:1 + nshape] = -dintegral / integral[:, None]
+
+    dlnf = _dlnShape(fitter.modelIntrinsic, spec.ecen)
+    b = np.zeros((len(spec.ecen), theta.shape[1]))
+    b[:, 1:1 + nshape] = dlnf
+    sigma = spec.sigma(fitter.abs)
+    if not fitter.nH_frozen:
+        b[:, -1] = -1.e22 * sigma
+
+    lnphi = np.log(10.) * lgK[:, None] + shape @ dlnf.T - 1.e22 * nH[:, None] * sigma
+    phi = np.exp(lnphi) * spec.de
+    return phi, a, b
+
+
+# Statistic (K), gradient (K x p) and Gauss-Newton curvature (K x p x p)
+# of K parameter sets against K realisations
+def stat_grad_hess(fitter, theta, data):
+    stat_fn = STATISTICS[fitter.statMethod]
+    K, p = theta.shape
+    stat = np.zeros(K)
+    grad = np.zeros((K, p))
+    hess = np.zeros((K, p, p))
+    for spec, d in zip(fitter.spectra, data):
+        phi, a, b = photon_flux(fitter, theta, spec)
+        mu = (spec.fold @ phi.T).T
+        jac = a[:, None, :] * mu[:, :, None]
+        jac += np.stack([(spec.fold @ (phi * b[:, j]).T).T for j in range(p)], axis = 2)
+
+        s, dmu = stat_fn(mu, d)
+        # d2(stat)/d(mu)2 of each group, from its slope
+        mu = np.maximum(mu, 1.e-30)
+        _, dmu_h = stat_fn(mu * (1. + 1.e-6), d)
+        w = np.maximum((dmu_h - dmu) / (1.e-6 * mu), 0.)
+
+        stat += s
+        grad += np.einsum("kg,kgp->kp", dmu, jac)
+        hess += np.einsum("kg,kgp,kgq->kpq", w, jac, jac)
+    return stat, grad, hess
+
+
+# Refit K realisations from the best fit with Levenberg-Marquardt steps
+# Returns the parameters (K x p), statistics (K) and a converged flag (K)
+def refit(fitter, data, iterations = ITERATIONS, tol = 1.e-6):
+    K = len(data[0].counts)
+    bounds = np.array(fitter._bounds())
+    theta = np.tile(fitter.params, (K, 1))
+    stat, grad, hess = stat_grad_hess(fitter, theta, data)
+    lam = np.full(K, 1.e-3)
+    converged = np.zeros(K, dtype = bool)
+    active = np.arange(K)
+
+    for _ in range(iterations):
+        if len(active) == 0:
+            break
+        h = hess[active]
+        diag = np.einsum("kpp->kp", h)
+        A = h + (lam[active, None] * diag + 1.e-12 * (1. + diag))[:, :, None] * np.eye(h.shape[1])
+        step = -np.linalg.solve(A, grad[active][:, :, None])[:, :, 0]
+        trial = np.clip(theta[active] + step, bounds[:, 0], bounds[:, 1])
+
+        sub = [d.take(active) for d in data]
+        s, g, H = stat_grad_hess(fitter, trial, sub)
+        better = s <= stat[active]
+        done = better & (stat[active] - s < tol) & (np.max(np.abs(trial - theta[active]), axis = 1) < 1.e-4)
+        rows = active[better]
+        theta[rows] = trial[better]
+        stat[rows] = s[better]
+        grad[rows] = g[better]
+        hess[rows] = H[better]
+        lam[rows] = np.maximum(lam[rows] / 10., 1.e-9)
+        lam[active[~better]] *= 10.
+
+        converged[active[done]] = True
+        # Steps that no longer change anything are at the minimum as well
+        stuck = ~better & (lam[active] > 1.e8)
+        converged[active[stuck]] = True
+        active = active[~(done | stuck)]
+
+    return theta, stat, converged
+
+
+# Energy flux (erg cm^-2 s^-1) of K parameter sets: the cflux flux, or without
+# cflux or with a band (keV) given, the absorbed flux in band (FLUX_BAND)
+def energy_flux(fitter, theta, band = None):
+    if band is None and fitter.ifcFlux:
+        return np.power(10., theta[:, 0])
+    if band is None:
+        band = FLUX_BAND
+    spec = fitter.spectra[0]
+    sel = (spec.ecen >= band[0]) & (spec.ecen <= band[1])
+    phi, _, _ = photon_flux(fitter, theta, spec)
+    return phi[:, sel] @ (spec.ecen[sel] * KEV2ERG)
+
+
+# One batch: draw K realisations with its own seed and refit them
+def run_batch(fitter, K, seed, band = None):
+    rng = np.random.default_rng(seed)
+    data = draw(fitter, K, rng)
+    theta, stat, converged = refit(fitter, data)
+    return theta, stat, converged, energy_flux(fitter, theta, band)
+
+
+_FITTER = None
+
+
+def _init_worker(path, fitter):
+    import sys
+    global _FITTER
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    _FITTER = fitter
+
+
+def _run_batch(i, K, seed, band):
+    return i, run_batch(_FITTER, K, seed, band)
+
+
+# nboot realisations in batches of batch, shared by nworkers processes
+# Every batch has its own child of seed, so the draws do not depend on nworkers
+# Returns the parameters (nboot x p), statistics, converged flags and fluxes
+# (see energy_flux for band)
+def bootstrap(fitter, nboot, batch = None, nworkers = 1, seed = None, band = None):
+    if batch is None:
+        batch = BATCH
+    sizes = [min(batch, nboot - start) for start in range(0, nboot, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    results = [None] * len(sizes)
+
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    nworkers = max(1, min(nworkers, len(sizes)))
+    if nworkers == 1:
+        for i, (K, s) in enumerate(zip(sizes, seeds)):
+            results[i] = run_batch(fitter, K, s, band)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing as mp
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers = nworkers, mp_context = ctx,
+                                 initializer = _init_worker, initargs = (here, fitter)) as pool:
+            futures = [pool.submit(_run_batch, i, K, s, band) for i, (K, s) in enumerate(zip(sizes, seeds))]
+            for fut in futures:
+                i, res = fut.result()
+                results[i] = res
+
+    return tuple(np.concatenate(part) for part in zip(*results))
+
+
+# Percentile intervals of the converged realisations
+# Returns {key: percentiles} for the fitted parameters (names as in
+# getFitResults) and the flux
+def summarise(fitter, theta, stat, converged, flux, percentiles):
+    keys = {"lg10Flux" : "lg10Flux", "lgNorm" : "lgNorm", "PhoIndex" : "Index",
+            "alpha" : "Alpha", "beta" : "Beta", "nH" : "nH"}
+    good = converged & np.isfinite(stat)
+    result = {"Realisations" : len(stat),
+              "Converged" : int(np.sum(good)),
+              "Percentiles" : np.asarray(percentiles, dtype = float)}
+    for i, name in enumerate(fitter.parameterNames()):
+        result[keys[name]] = np.percentile(theta[good, i], percentiles)
+    result["Flux [erg cm^-2 s^-1]"] = np.percentile(flux[good], percentiles)
+    return result
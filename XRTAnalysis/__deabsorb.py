@@ -3,128 +3,188 @@
 	Original c++ code provided by Amy
 	Shamelessly copyied...
 	Translated to python with no secondary checks... use at own risk
+
+	The cross-sections are evaluated from sorted edge tables, so whole
+	energy arrays (and vectors of nH) are handled in a single call
 '''
 
 import numpy as np
+import hashlib
+from collections import OrderedDict
+
+
+# Morrison & McCammon coefficients used by the "pha" method
+# Segment i covers (edge[i-1], edge[i]], the first segment is open below
+# Energies above the last edge fall in the all-zero row
+_PHA_EDGES = np.array([0.4, 0.532, 0.707, 0.867, 1.303, 1.840,
+					   2.471, 3.210, 4.038, 7.111, 8.331, 10.0])
+_PHA_COEFFS = np.array([
+	[78.1, 18.8, 4.3],
+	[71.4, 66.8, -51.4],
+	[95.5, 145.8, -61.1],
+	[308.9, -380.6, 294.0],
+	[120.6, 169.3, -47.7],
+	[141.3, 146.8, -31.5],
+	[202.7, 104.7, -17.0],
+	[342.7, 18.7, 0.0],
+	[352.2, 18.7, 0.0],
+	[433.9, -2.4, 0.75],
+	[629.0, 30.9, 0.0],
+	[701.2, 25.2, 0.0],
+	[0.0, 0.0, 0.0]])
+
+# Wisconsin coefficients used by the "wabs" method
+# Segment i covers [edge[i-1], edge[i]), zero below 0.03 keV and above 10 keV
+_WABS_EDGES = np.array([0.03, 0.1, 0.284, 0.4, 0.532, 0.707, 0.867,
+						1.303, 1.84, 2.471, 3.21, 4.038, 7.111, 8.331])
+_WABS_EMAX = 10.0
+_WABS_COEFFS = np.array([
+	[0.0, 0.0, 0.0],
+	[17.3, 608.1, -2150.0],
+	[34.6, 267.9, -476.1],
+	[78.1, 18.8, 4.3],
+	[71.4, 66.8, -51.4],
+	[95.5, 145.8, -61.1],
+	[308.9, -380.6, 294.0],
+	[120.6, 169.3, -47.7],
+	[141.3, 146.8, -31.5],
+	[202.7, 104.7, -17.0],
+	[342.7, 18.7, 0.0],
+	[352.2, 18.7, 0.0],
+	[433.9, -2.4, 0.75],
+	[629.0, 30.9, 0.0],
+	[701.2, 25.2, 0.0]])
+
+
+# Photo-electric cross section (cm^2) for an array of energies (keV)
+def cross_section(energy, method = "pha"):
+	energy = np.asarray(energy, dtype = float)
+
+	if method == "pha":
+		seg = np.searchsorted(_PHA_EDGES, energy, side = "left")
+		coeffs = _PHA_COEFFS[seg]
+	elif method == "wabs":
+		seg = np.searchsorted(_WABS_EDGES, energy, side = "right")
+		seg = np.where(energy > _WABS_EMAX, 0, seg)
+		coeffs = _WABS_COEFFS[seg]
+	else:
+		raise ValueError("Unknown absorption method: %s" %method)
+
+	c0 = coeffs[..., 0]
+	c1 = coeffs[..., 1]
+	c2 = coeffs[..., 2]
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		sig = (c0 + c1*energy + c2*energy*energy) / (energy*energy*energy)
+	return sig * 1.e-24
+
+
+# Transmission exp(-nH sigma(E)), nH in units of 1e22 cm^-2
+# A vector of nH returns a (nH x energy) matrix
+def transmission(nH, energy, method = "pha"):
+	sig = cross_section(energy, method)
+	nH = np.asarray(nH, dtype = float)
+	return np.exp(-np.multiply.outer(nH, sig) * 1.e22)
+
+
+
+# Bounded LRU store of transmission curves
+# Keyed on (method, nH, hash of the energy grid), so repeated fits of the
+# same source, or of spectra sharing a response, skip the cross-sections
+class TransmissionCache():
+
+	def __init__(self, maxsize = 128):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._store = OrderedDict()
+
+
+	def _key(self, nH, energy, method):
+		nH = np.ascontiguousarray(nH, dtype = float)
+		energy = np.ascontiguousarray(energy, dtype = float)
+		grid = hashlib.sha1(energy.tobytes())
+		grid.update(str(energy.shape).encode())
+		return (method, nH.shape, nH.tobytes(), grid.hexdigest())
+
+
+	# Cached equivalent of transmission()
+	# The returned array is shared, so it is flagged read-only
+	def get(self, nH, energy, method = "pha"):
+		key = self._key(nH, energy, method)
+		if key in self._store:
+			self.hits += 1
+			self._store.move_to_end(key)
+			return self._store[key]
+
+		self.misses += 1
+		trans = transmission(nH, energy, method)
+		trans.setflags(write = False)
+		self._store[key] = trans
+		if len(self._store) > self.maxsize:
+			self._store.popitem(last = False)
+		return trans
+
+
+	def info(self):
+		return {"hits" : self.hits,
+				"misses" : self.misses,
+				"size" : len(self._store),
+				"maxsize" : self.maxsize}
+
+
+	def clear(self):
+		self._store.clear()
+		self.hits = 0
+		self.misses = 0
+
+
+# Shared by every deabsorb instance unless one is passed explicitly
+transmission_cache = TransmissionCache()
 
 
 
 class deabsorb():
 
-	def __init__(self, nH, method = "pha"):
+	def __init__(self, nH, method = "pha", cache = None):
 		self.nH = nH
 		self.method = method
+		if cache is None:
+			cache = transmission_cache
+		self.cache = cache
 
 
+	# Returns the unabsorbed flux and error
+	# If nH is a vector the outputs are (nH x energy)
 	def deabsorb(self, en, flux, flux_err = None):
-		n = len(flux)
 		if flux_err is None:
-			flux_err = np.zeros(n)
+			flux_err = np.zeros(np.shape(flux))
 
-		unabs_flux = np.zeros(n)
-		unabs_flux_err = np.zeros(n)
-		if self.method == "pha":
-			cross = self.sigma
-		elif self.method == "wabs":
-			cross = self.get_w_crossec
+		trans = self.cache.get(self.nH, en, self.method)
 
-		for i in range(n):
-			unabs_flux[i] = flux[i]*np.exp(self.nH*(1.e22)*cross(en[i]))
-			unabs_flux_err[i] = flux_err[i]*np.exp(self.nH*(1.e22)**cross(en[i]))
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			unabs_flux = np.asarray(flux) / trans
+			unabs_flux_err = np.asarray(flux_err) / trans
 
 		return unabs_flux, unabs_flux_err
 
 
 	def sigma(self, energy):
-		c0 = 0
-		c1 = 0
-		c2 = 0
-
-		if(energy<=0.4):
-			c0 = 78.1
-			c1 = 18.8
-			c2 = 4.3
-
-		elif(0.4<energy<=0.532):
-			c0 = 71.4
-			c1 = 66.8
-			c2 = -51.4
-
-		elif(0.532<energy<=0.707):
-			c0 = 95.5
-			c1 = 145.8
-			c2 = -61.1
-
-		elif(0.707<energy<=0.867):
-			c0 = 308.9
-			c1 = -380.6
-			c2 = 294.0
-
-		elif(0.867<energy<=1.303):
-			c0 = 120.6
-			c1 = 169.3
-			c2 = -47.7
-
-		elif(1.303<energy<=1.840):
-			c0 = 141.3
-			c1 = 146.8
-			c2 = -31.5
-
-		elif(1.840<energy<=2.471):
-			c0 = 202.7
-			c1 = 104.7
-			c2 = -17.0
-
-		elif(2.471<energy<=3.210):
-			c0 = 342.7
-			c1 = 18.7
-			c2 = 0.0
-
-		elif(3.210<energy<=4.038):
-			c0 = 352.2
-			c1 = 18.7
-			c2 = 0.0
-
-		elif(4.038<energy<=7.111):
-			c0 = 433.9
-			c1 = -2.4
-			c2 = 0.75
-
-		elif(7.111<energy<=8.331):
-			c0 = 629.0
-			c1 = 30.9
-			c2 = 0.0
-
-		elif(8.331<energy<=10.0000):
-			c0 = 701.2
-			c1 = 25.2
-			c2 = 0.0
-
-		# For model fit this just generates a load of junk output
-		# else:
-		#	print("Out of Range!")
-
-		sig = (c0+c1*energy+c2*energy*energy)
-		sig /= (energy*energy*energy)
-		sig *= 1.e-24
-
-		return sig
-		# return ((c0+c1*energy+c2*energy*energy)/(energy*energy*energy))*TMath::Power(10,-24)
+		return cross_section(energy, "pha")
 
 
 	def pl_abs(self, E, K, alpha, nH, E_norm=1):
 		#E has to be in keV
-		return np.exp(-nH*self.get_w_crossecs(E)) * K*(E/E_norm)**(-alpha)
+		return np.exp(-nH*self.get_w_crossec(E)) * K*(E/E_norm)**(-alpha)
 
 	def pl_abs_SED(self, E, K, alpha, nH, E_norm=1):
 		#E has to be in keV
-		return (np.exp(-nH*self.get_w_crossecs(E)) * K*(E/E_norm)**(-alpha))*E*E*1.6022e-9
+		return (np.exp(-nH*self.get_w_crossec(E)) * K*(E/E_norm)**(-alpha))*E*E*1.6022e-9
 
 
 	def pl_deabs(self, E, F, dF, nH):
 		#E has to be in keV; deabsorption
-		return np.exp(nH*self.get_w_crossecs(E)) * F,
-		np.exp(nH*get_w_crossecs(E)) * dF
+		return np.exp(nH*self.get_w_crossec(E)) * F, \
+			np.exp(nH*self.get_w_crossec(E)) * dF
 
 
 
@@ -136,34 +196,4 @@ class deabsorb():
 
 	def get_w_crossec(self, e):
 		#E has to be in keV
-		if (e >= 0.03) and (e < 0.1):
-			crosssetion = self.crossec(17.3, 608.1, -2150.0, e)
-		elif (e >= 0.1) and (e < 0.284):
-			crosssetion = self.crossec(34.6, 267.9, -476.1, e)
-		elif (e >= 0.284) and (e < 0.4):
-			crosssetion = self.crossec(78.1, 18.8, 4.3, e)
-		elif (e >= 0.4) and (e < 0.532):
-			crosssetion = self.crossec(71.4, 66.8, -51.4, e)
-		elif (e >= 0.532) and (e < 0.707):
-			crosssetion = self.crossec(95.5, 145.8, -61.1, e)
-		elif (e >= 0.707) and (e < 0.867):
-			crosssetion = self.crossec(308.9, -380.6, 294.0, e)
-		elif (e >= 0.867) and (e < 1.303):
-			crosssetion = self.crossec(120.6, 169.3, -47.7, e)
-		elif (e >= 1.303) and (e < 1.84):
-			crosssetion = self.crossec(141.3, 146.8, -31.5, e)
-		elif (e >= 1.84) and (e < 2.471):
-			crosssetion = self.crossec(202.7, 104.7, -17.0, e)
-		elif (e >= 2.471) and (e < 3.21):
-			crosssetion = self.crossec(342.7, 18.7, 0.0, e)
-		elif (e >= 3.21) and (e < 4.038):
-			crosssetion = self.crossec(352.2, 18.7, 0.0, e)
-		elif (e >= 4.038) and (e < 7.111):
-			crosssetion = self.crossec(433.9, -2.4, 0.75, e)
-		elif (e >= 7.111) and (e < 8.331):
-			crosssetion = self.crossec(629.0, 30.9, 0.0, e)
-		elif (e >= 8.331) and (e <= 10.0):
-			crosssetion = self.crossec(701.2, 25.2, 0.0, e)
-		else:
-			crosssetion = 0
-		return crosssetion
\ No newline at end of file
+		return cross_section(e, "wabs")
@@ -0,0 +1,462 @@
+'''
+    Stand-in for PyXspec on machines without HEASoft
+
+    Implements the part of the xspec module that XRT_Analysis and
+    __profile use: Spectrum, Model, AllData, AllModels, Fit, Plot and Xset.
+    Spectra are loaded and fitted with __forwardfold, so Plot, Fit and
+    calcFlux hand back arrays and numbers of the size and kind a real
+    session would. Every data group ("g:g file") gets a copy of the model
+    linked to group 1, untied parameters are fitted per group as in
+    JointForwardFold. Fit.error and the flux errors come from the
+    covariance, there is no profile scan; Fit.steppar is done by __gridscan.
+    install() registers it as "xspec".
+'''
+
+import os
+import re
+import sys
+import numpy as np
+
+from __forwardfold import ForwardFold, JointForwardFold, FoldedSpectrum, KEV2ERG, _trapz
+from __gridscan import scan_row
+
+
+# Parameters of each component: (name, default value, frozen)
+COMPONENTS = {"phabs" : [("nH", 1., False)],
+              "wabs" : [("nH", 1., False)],
+              "cflux" : [("Emin", 0.5, True), ("Emax", 10., True), ("lg10Flux", -12., False)],
+              "powerlaw" : [("PhoIndex", 1., False), ("norm", 1., False)],
+              "logpar" : [("alpha", 1.5, False), ("beta", 0.2, False),
+                          ("pivotE", 1., True), ("norm", 1., False)]}
+
+ALIASES = {"pha" : "phabs", "wa" : "wabs", "po" : "powerlaw", "pow" : "powerlaw"}
+
+
+def install():
+    module = sys.modules[__name__]
+    sys.modules["xspec"] = module
+    return module
+
+
+# A parameter of a data group copy starts linked to the one of group 1
+# (source, numbered index) and follows it until untie
+class Parameter():
+
+    def __init__(self, name, value, frozen, source = None, index = None):
+        self.name = name
+        self._value = float(value)
+        self._frozen = frozen
+        self._source = source
+        self.link = "" if source is None else "= p%d" %index
+        self.sigma = 0.
+        self.error = (0., 0., "FFFFFFFFF")
+
+    @property
+    def values(self):
+        v = float(self)
+        return [v, 0.01 * abs(v) if v else 0.01, -1.e22, -1.e22, 1.e22, 1.e22]
+
+    @values.setter
+    def values(self, value):
+        self._value = float(value[0] if np.ndim(value) else value)
+
+    @property
+    def frozen(self):
+        return self._source.frozen if self._source is not None else self._frozen
+
+    @frozen.setter
+    def frozen(self, value):
+        self._frozen = bool(value)
+
+    def untie(self):
+        if self._source is not None:
+            self._value = float(self._source)
+            self._frozen = self._source.frozen
+            self._source = None
+            self.link = ""
+
+    def __float__(self):
+        return self._source._value if self._source is not None else self._value
+
+
+class Component():
+
+    def __init__(self, name, parameters):
+        self.__dict__["name"] = name
+        self.__dict__["_parameters"] = {p.name : p for p in parameters}
+
+    def __getattr__(self, attr):
+        try:
+            return self.__dict__["_parameters"][attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+    # m1.phabs.nH = 0.2 sets the value
+    def __setattr__(self, attr, value):
+        if attr in self._parameters and not isinstance(value, Parameter):
+            self._parameters[attr].values = value
+        else:
+            self.__dict__[attr] = value
+
+
+class Model():
+
+    # source: the group 1 model a data group copy is linked to
+    def __init__(self, expression, source = None):
+        self.expression = expression
+        self.componentNames = []
+        self._parameters = []
+        for name in expression.replace("(", "*").replace(")", "*").split("*"):
+            name = ALIASES.get(name.strip(), name.strip())
+            if not name:
+                continue
+            if name not in COMPONENTS:
+                raise ValueError("Fake xspec: unsupported component %s" %name)
+            params = []
+            for p in COMPONENTS[name]:
+                n = len(self._parameters) + len(params)
+                if source is None:
+                    params.append(Parameter(*p))
+                else:
+                    params.append(Parameter(*p, source = source._parameters[n], index = n + 1))
+            self.__dict__[name] = Component(name, params)
+            self.componentNames.append(name)
+            self._parameters += params
+        self.nParameters = len(self._parameters)
+        self._copies = []
+        if source is None:
+            self._copies = [Model(expression, self) for _ in AllData._groups()[1:]]
+            AllModels._model = self
+
+    # 1-based, as in xspec
+    def __call__(self, index):
+        return self._parameters[index - 1]
+
+    def _index(self, name):
+        for i, p in enumerate(self._parameters):
+            if p.name == name:
+                return i + 1
+        return None
+
+    # ForwardFold (or cls) with the same model, and its parameter vector for
+    # the current values
+    def _fitter(self, cls = ForwardFold):
+        fitter = cls()
+        fitter.statMethod = Fit.statMethod
+        names = self.componentNames
+        absorb = "wabs" if "wabs" in names else "pha"
+        component = getattr(self, "wabs" if absorb == "wabs" else "phabs")
+        fitter.setModel("logpar" if "logpar" in names else "pwl", "cflux" in names, absorb)
+        fitter.setNH(float(component.nH), component.nH.frozen)
+        if fitter.ifcFlux:
+            fitter.emin = float(self.cflux.Emin)
+            fitter.emax = float(self.cflux.Emax)
+        return fitter
+
+    def _theta(self, fitter):
+        theta = []
+        for name in fitter.parameterNames():
+            if name == "lgNorm":
+                theta.append(np.log10(max(float(self(self._index("norm"))), 1.e-300)))
+            else:
+                theta.append(float(self(self._index(name))))
+        return np.array(theta)
+
+    # Absorbed energy and photon flux in emin-emax for the current values
+    def _flux(self, emin, emax, npoints = 512):
+        fitter = self._fitter()
+        fitter.params = self._theta(fitter)
+        e = np.logspace(np.log10(emin), np.log10(emax), npoints)
+        dnde = fitter.dnde(e)
+        return _trapz(e * dnde, e) * KEV2ERG, _trapz(dnde, e)
+
+
+class Spectrum():
+
+    # Spectra loaded on their own go to data group 1
+    def __init__(self, filename, group = 1):
+        self.fileName = os.path.abspath(filename)
+        self.group = group
+        self.flux = (0., 0., 0., 0., 0., 0.)
+        AllData._spectra.append(self)
+
+
+class _DataManager():
+
+    def __init__(self):
+        self._spectra = []
+        self._folded = {}
+        self.elow = 0.
+        self.ehigh = np.inf
+
+    # AllData(1) is the first spectrum, AllData("2:2 file.pha") loads one
+    # into data group 2
+    def __call__(self, item):
+        if isinstance(item, str):
+            tokens = item.split()
+            group = int(tokens[0].split(":")[0]) if len(tokens) > 1 else 1
+            return Spectrum(tokens[-1], group)
+        return self._spectra[item - 1]
+
+    def _groups(self):
+        return sorted(set(spec.group for spec in self._spectra)) or [1]
+
+    def clear(self):
+        self._spectra = []
+        self.elow = 0.
+        self.ehigh = np.inf
+
+    def show(self):
+        pass
+
+    # Only "**-a b-**" ranges change anything, bad channels are never noticed
+    def ignore(self, item):
+        match = re.match(r"\*\*-\s*([0-9.eE+-]+)\s+([0-9.eE+-]+)\s*-\*\*", item.strip())
+        if match:
+            self.elow = float(match.group(1))
+            self.ehigh = float(match.group(2))
+
+    # Folded responses are kept between fits of the same files
+    # With group, only the spectra of that data group
+    def _load(self, group = None):
+        spectra = []
+        for spec in self._spectra:
+            if group is not None and spec.group != group:
+                continue
+            key = (spec.fileName, self.elow, self.ehigh)
+            if key not in self._folded:
+                self._folded[key] = FoldedSpectrum(spec.fileName, self.elow, self.ehigh)
+            spectra.append(self._folded[key])
+        return spectra
+
+
+class _ModelManager():
+
+    def __init__(self):
+        self._model = None
+
+    # Model copy of a data group
+    def __call__(self, group = 1):
+        if group == 1:
+            return self._model
+        return self._model._copies[group - 2]
+
+    def clear(self):
+        self._model = None
+
+    # Parameter by its number over all data groups, as in Fit.error
+    def _parameter(self, index):
+        npar = self._model.nParameters
+        return self((index - 1) // npar + 1)((index - 1) % npar + 1)
+
+    # "emin emax [err]", sets the flux of the first spectrum of every data group
+    def calcFlux(self, command):
+        tokens = command.split()
+        emin, emax = float(tokens[0]), float(tokens[1])
+        for g in AllData._groups():
+            model = self(g)
+            flux, photons = model._flux(emin, emax)
+            lo, hi = flux, flux
+            if "err" in tokens[2:] and Fit._free:
+                # Linear propagation of the fit covariance
+                grad = np.zeros(len(Fit._free))
+                for j, i in enumerate(Fit._free):
+                    par = self._parameter(i)
+                    value = float(par)
+                    h = 1.e-4 * max(abs(value), 1.)
+                    par.values = value + h
+                    grad[j] = (model._flux(emin, emax)[0] - flux) / h
+                    par.values = value
+                sigma = np.sqrt(max(grad @ Fit._covar @ grad, 0.))
+                lo, hi = flux - sigma, flux + sigma
+            spec = next(s for s in AllData._spectra if s.group == g)
+            spec.flux = (flux, lo, hi, photons, photons, photons)
+
+
+class _FitManager():
+
+    def __init__(self):
+        self.statMethod = "chi"
+        self.nIterations = 10
+        self.statistic = 0.
+        self.dof = 0
+        self.covariance = []
+        self._free = []
+        self._covar = np.zeros((0, 0))
+        self._fitter = None
+        self._steps = {}
+
+    def show(self):
+        pass
+
+    # One data group: a ForwardFold fit of its spectra. Several: a
+    # JointForwardFold fit, one spectrum per group, the untied normalisation
+    # (or lg10Flux) of each group free
+    def perform(self):
+        model = AllModels._model
+        groups = AllData._groups()
+        if len(groups) == 1:
+            fitter = model._fitter()
+            fitter.spectra = AllData._load()
+        else:
+            fitter = model._fitter(JointForwardFold)
+            fitter.spectra = [AllData._load(g)[0] for g in groups]
+        fitter.fit()
+
+        # Internal parameters back to xspec ones (numbered over all data
+        # groups); log10(norm) needs a Jacobian
+        names = fitter.parameterNames()
+        npar = model.nParameters
+        indices = []
+        for name in names:
+            base, _, group = name.partition("_")
+            group = int(group) if group else 1
+            indices.append((group - 1) * npar + model._index("norm" if base == "lgNorm" else base))
+        scale = np.ones(len(names))
+        for j, (name, i) in enumerate(zip(names, indices)):
+            par = AllModels._parameter(i)
+            if name.startswith("lgNorm"):
+                par.values = 10**fitter.params[j]
+                scale[j] = float(par) * np.log(10.)
+            else:
+                par.values = fitter.params[j]
+
+        order = np.argsort(indices)
+        self._free = [indices[j] for j in order]
+        covar = fitter.covar_internal * np.outer(scale, scale)
+        self._covar = covar[np.ix_(order, order)]
+        for i, var in zip(self._free, np.diag(self._covar)):
+            AllModels._parameter(i).sigma = float(np.sqrt(max(var, 0.)))
+
+        self.covariance = list(self._covar[np.tril_indices(len(order))])
+        self.statistic = float(fitter.statistic)
+        self.dof = int(fitter.dof)
+        self._fitter = fitter
+
+    # "delta i j ...", 1 sigma bounds from the covariance scaled by sqrt(delta)
+    def error(self, command):
+        tokens = command.split()
+        delta = float(tokens[0])
+        for token in tokens[1:]:
+            par = AllModels._parameter(int(token))
+            value = float(par)
+            width = par.sigma * np.sqrt(delta)
+            par.error = (value - width, value + width, "FFFFFFFFF")
+
+    # "[nolog] i lo hi n j lo hi n" with i the nH and j a shape parameter, as
+    # XRT_Analysis uses it; the normalisation and any other shape parameter
+    # are refitted at every point and left at the last one, as xspec does
+    def steppar(self, command):
+        tokens = [t for t in command.split() if t not in ("log", "nolog")]
+        (i, ilo, ihi, n), (j, jlo, jhi, m) = [(int(tokens[k]), float(tokens[k + 1]), float(tokens[k + 2]),
+                                              int(tokens[k + 3])) for k in (0, 4)]
+        model = AllModels._model
+        if model(i).name != "nH":
+            raise ValueError("Fake xspec: steppar needs nH as its first parameter")
+        fitter = model._fitter()
+        fitter.spectra = AllData._load()
+        shapeNames = [name for name in fitter.parameterNames() if name not in ("lgNorm", "lg10Flux", "nH")]
+        axis = shapeNames.index(model(j).name)
+        values = np.linspace(jlo, jhi, m + 1)
+
+        steps = {"statistic" : [], str(i) : []}
+        norm = model._index("lg10Flux" if fitter.ifcFlux else "norm")
+        shapes = [model._index(name) for name in shapeNames]
+        for k in [norm] + shapes:
+            steps[str(k)] = []
+        for nH in np.linspace(ilo, ihi, n + 1):
+            stat, lgK, shape = scan_row(fitter, nH, values, axis)
+            steps["statistic"] += list(stat)
+            steps[str(i)] += [nH] * len(values)
+            steps[str(norm)] += list(lgK if fitter.ifcFlux else 10**lgK)
+            for c, k in enumerate(shapes):
+                steps[str(k)] += list(shape[:, c])
+
+        self._steps = steps
+        for k, vals in steps.items():
+            if k != "statistic":
+                model(int(k)).values = vals[-1]
+        self.statistic = float(steps["statistic"][-1])
+
+    # Values of a parameter ("i") or "statistic" at every steppar point
+    def stepparResults(self, name):
+        return list(self._steps[name])
+
+    def ftest(self, chi2_a, dof_a, chi2_b, dof_b):
+        from scipy.stats import f as fdist
+        fstat = ((chi2_a - chi2_b) / (dof_a - dof_b)) / (chi2_b / dof_b)
+        return float(fdist.sf(fstat, dof_a - dof_b, dof_b))
+
+
+class _PlotManager():
+
+    def __init__(self):
+        self.xAxis = "keV"
+        self._x = []
+        self._y = []
+        self._xErr = []
+        self._yErr = []
+        self._model = []
+
+    def setRebin(self, *args):
+        pass
+
+    # "data eeufspec model" fills x/y/xErr/yErr, "model" fills x/model, one
+    # plot group per data group (its first spectrum and model copy)
+    # Values are lists, as PyXspec returns them
+    def __call__(self, command):
+        plots = [self._plot(command, g) for g in AllData._groups()]
+        if command.split()[0] == "model":
+            self._x, self._model = [list(p) for p in zip(*plots)]
+        else:
+            self._x, self._y, self._xErr, self._yErr = [list(p) for p in zip(*plots)]
+
+    def _plot(self, command, group):
+        model = AllModels(group)
+        fitter = model._fitter()
+        fitter.params = model._theta(fitter)
+        spec = AllData._load(group)[0]
+
+        if command.split()[0] == "model":
+            return spec.ecen.tolist(), fitter.dnde(spec.ecen).tolist()
+
+        # Unfolded spectrum: data/model ratio times the model at the group centre
+        mu = spec.fold @ fitter.photonFlux(fitter.params, spec)[0]
+        net, var = spec.netCounts()
+        energy = 0.5 * (spec.grp_elo + spec.grp_ehi)
+        e2dnde = energy * energy * fitter.dnde(energy)
+        ratio = np.where(mu > 0, 1. / np.where(mu > 0, mu, 1.), 0.)
+        return (energy.tolist(), (net * ratio * e2dnde).tolist(),
+                (0.5 * (spec.grp_ehi - spec.grp_elo)).tolist(), (np.sqrt(var) * ratio * e2dnde).tolist())
+
+    def x(self, plotGroup = 1, plotWindow = 1):
+        return self._x[plotGroup - 1]
+
+    def y(self, plotGroup = 1, plotWindow = 1):
+        return self._y[plotGroup - 1]
+
+    def xErr(self, plotGroup = 1, plotWindow = 1):
+        return self._xErr[plotGroup - 1]
+
+    def yErr(self, plotGroup = 1, plotWindow = 1):
+        return self._yErr[plotGroup - 1]
+
+    def model(self, plotGroup = 1, plotWindow = 1):
+        return self._model[plotGroup - 1]
+
+
+class _XsetManager():
+
+    def __init__(self):
+        self.chatter = 10
+        self.logChatter = 10
+        self.abund = "angr"
+        self.xsect = "bcmc"
+        self.parallel = {}
+
+
+AllData = _DataManager()
+AllModels = _ModelManager()
+Fit = _FitManager()
+Plot = _PlotManager()
+Xset = _XsetManager()
@@ -0,0 +1,130 @@
+'''
+    On-disk memoisation of fit results
+
+    An entry is keyed on the checksums of the spectra (and of the BACKFILE,
+    RESPFILE and ANCRFILE they point to) together with the fit configuration,
+    and holds whatever XRT_Analysis needs to restore after doFit. The oldest
+    entries are removed once the cache grows beyond maxsize bytes.
+'''
+
+import os
+import json
+import glob
+import pickle
+import hashlib
+import tempfile
+
+
+# Default location, can be overridden with XRTTOOLS_FIT_CACHE
+def default_cache_dir():
+    return os.environ.get("XRTTOOLS_FIT_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "xrttools", "fits"))
+
+
+class FitCache():
+
+    def __init__(self, directory = None, maxsize = 256 * 1024 * 1024):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(self.directory, exist_ok = True)
+
+        # (path, size, mtime) -> checksum, so unchanged files are not re-hashed
+        self._indexFile = os.path.join(self.directory, "index.json")
+        try:
+            with open(self._indexFile) as f:
+                self._index = json.load(f)
+        except (IOError, ValueError):
+            self._index = {}
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def checksum(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        key = "%s:%d:%d" %(path, st.st_size, st.st_mtime_ns)
+        if key not in self._index:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            self._index[key] = h.hexdigest()
+            fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = ".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._index, f)
+            os.replace(tmp, self._indexFile)
+        return self._index[key]
+
+
+    # Key of a list of files and a json-serialisable configuration
+    def key(self, files, config):
+        blob = json.dumps({"files" : [self.checksum(f) for f in files], "config" : config},
+                          sort_keys = True)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        # mtime orders the entries for eviction
+        os.utime(self._path(key))
+        self.hits += 1
+        return entry
+
+
+    def put(self, key, entry):
+        fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+
+    # Remove least recently used entries until the cache fits in maxsize
+    def _evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.pkl")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+    # Drop one entry, or every entry with key = None
+    def invalidate(self, key = None):
+        paths = [self._path(key)] if key is not None else glob.glob(os.path.join(self.directory, "*.pkl"))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+    def info(self):
+        paths = glob.glob(os.path.join(self.directory, "*.pkl"))
+        return {"entries" : len(paths),
+                "bytes" : sum(os.path.getsize(p) for p in paths),
+                "maxsize" : self.maxsize,
+                "hits" : self.hits,
+                "misses" : self.misses}
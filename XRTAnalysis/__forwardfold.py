@@ -0,0 +1,795 @@
+'''
+    Forward-folding fit of XRT spectra without PyXspec
+
+    Reads the grouped PHA, its background, RMF and ARF with astropy, folds
+    phabs/wabs * (cflux) * po/logpar through the response as a sparse matrix
+    and minimises chi^2 or C-stat with analytic gradients.
+    Nothing here touches global state, so fits can run in threads or processes.
+'''
+
+import os
+import numpy as np
+from scipy import sparse
+
+from __deabsorb import deabsorb as deab
+from __deabsorb import cross_section, transmission_cache
+from __lazy import LazyModule
+
+fits = LazyModule("astropy.io.fits")
+_optimize = LazyModule("scipy.optimize")
+
+
+# keV to erg
+KEV2ERG = 1.60217663e-9
+
+# Grid used for the cflux energy integral
+NCFLUXGRID = 256
+
+
+# Trapezoid rule along the first axis
+def _trapz(y, x):
+    dx = np.diff(x)
+    if y.ndim > 1:
+        dx = dx[:, None]
+    return np.sum(0.5 * (y[1:] + y[:-1]) * dx, axis = 0)
+
+
+# Resolve a BACKFILE/RESPFILE/ANCRFILE keyword relative to the PHA file
+def _header_file(header, key, dirname):
+    name = header.get(key, "none")
+    if name is None or str(name).strip().lower() in ("", "none"):
+        return None
+    return os.path.normpath(os.path.join(dirname, str(name).strip()))
+
+
+# Column if present, otherwise header keyword, otherwise default
+def _column_or_key(data, header, name, default):
+    if name in data.columns.names:
+        return np.array(data[name])
+    return header.get(name, default)
+
+
+# Read an OGIP PHA file
+def read_pha(filename):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    with fits.open(filename) as hdul:
+        hdu = hdul["SPECTRUM"]
+        data = hdu.data
+        header = hdu.header
+
+        exposure = float(header["EXPOSURE"])
+        channel = np.array(data["CHANNEL"], dtype = int)
+        nchan = len(channel)
+        if "COUNTS" in data.columns.names:
+            counts = np.array(data["COUNTS"], dtype = float)
+        else:
+            counts = np.array(data["RATE"], dtype = float) * exposure
+
+        quality = np.broadcast_to(_column_or_key(data, header, "QUALITY", 0), nchan)
+        grouping = np.broadcast_to(_column_or_key(data, header, "GROUPING", 1), nchan)
+        backscal = np.mean(_column_or_key(data, header, "BACKSCAL", 1.))
+
+        return {"channel" : channel,
+                "counts" : counts,
+                "quality" : np.array(quality, dtype = int),
+                "grouping" : np.array(grouping, dtype = int),
+                "exposure" : exposure,
+                "backscal" : float(backscal),
+                "backfile" : _header_file(header, "BACKFILE", dirname),
+                "respfile" : _header_file(header, "RESPFILE", dirname),
+                "ancrfile" : _header_file(header, "ANCRFILE", dirname)}
+
+
+# Read an OGIP RMF file
+# Returns the (energy x channel) matrix as CSR plus the energy/channel bounds
+def read_rmf(filename):
+    with fits.open(filename) as hdul:
+        if "MATRIX" in hdul:
+            ext = hdul["MATRIX"]
+        else:
+            ext = hdul["SPECRESP MATRIX"]
+        data = ext.data
+        ebounds = hdul["EBOUNDS"].data
+
+        fcol = ext.columns.names.index("F_CHAN") + 1
+        offset = int(ext.header.get("TLMIN%d" %fcol, 1))
+        nchannels = int(ext.header.get("DETCHANS", len(ebounds)))
+
+        energ_lo = np.array(data["ENERG_LO"], dtype = float)
+        energ_hi = np.array(data["ENERG_HI"], dtype = float)
+
+        indptr = np.zeros(len(energ_lo) + 1, dtype = np.int64)
+        indices = []
+        values = []
+        for i, row in enumerate(data):
+            ngrp = int(row["N_GRP"])
+            fchan = np.atleast_1d(row["F_CHAN"])[:ngrp]
+            nchan = np.atleast_1d(row["N_CHAN"])[:ngrp]
+            cols = [np.arange(f, f + n) for f, n in zip(fchan, nchan)]
+            cols = np.concatenate(cols) - offset if ngrp > 0 else np.zeros(0, dtype = int)
+            indices.append(cols)
+            values.append(np.ravel(row["MATRIX"])[:len(cols)])
+            indptr[i + 1] = indptr[i] + len(cols)
+
+        matrix = sparse.csr_matrix((np.concatenate(values).astype(float),
+                                    np.concatenate(indices).astype(np.int64),
+                                    indptr),
+                                   shape = (len(energ_lo), nchannels))
+
+        return {"matrix" : matrix,
+                "energ_lo" : energ_lo,
+                "energ_hi" : energ_hi,
+                "e_min" : np.array(ebounds["E_MIN"], dtype = float),
+                "e_max" : np.array(ebounds["E_MAX"], dtype = float)}
+
+
+# Read an OGIP ARF file
+def read_arf(filename):
+    with fits.open(filename) as hdul:
+        return np.array(hdul["SPECRESP"].data["SPECRESP"], dtype = float)
+
+
+# One source spectrum folded through its response
+# fold maps photon flux per model energy bin (ph cm^-2 s^-1) to source counts per group
+# responses is an optional __responsestore.ResponseStore used instead of read_rmf
+class FoldedSpectrum():
+
+    def __init__(self, filename, elow = 0.3, ehigh = 10.0, responses = None):
+        self.fileName = filename
+        pha = read_pha(filename)
+        if responses is not None:
+            rmf = responses.load(pha["respfile"])
+        else:
+            rmf = read_rmf(pha["respfile"])
+        if pha["ancrfile"] is not None:
+            arf = read_arf(pha["ancrfile"])
+        else:
+            arf = np.ones(len(rmf["energ_lo"]))
+
+        self.exposure = pha["exposure"]
+
+        # Model energy grid
+        self.elo = rmf["energ_lo"]
+        self.ehi = rmf["energ_hi"]
+        self.ecen = 0.5 * (self.elo + self.ehi)
+        self.de = self.ehi - self.elo
+
+        # Noticed channels: good quality and inside the energy range
+        chan = pha["channel"] - pha["channel"][0]
+        cmin = rmf["e_min"][chan]
+        cmax = rmf["e_max"][chan]
+        notice = (pha["quality"] == 0) & (cmin >= elow) & (cmax <= ehigh)
+
+        # Group id per channel, then renumber the groups that survive
+        grp = np.maximum(np.cumsum(pha["grouping"] == 1) - 1, 0)
+        kept, grp_id = np.unique(grp[notice], return_inverse = True)
+        self.ngroups = len(kept)
+        group = sparse.csr_matrix((np.ones(notice.sum()), (grp_id, chan[notice])),
+                                  shape = (self.ngroups, rmf["matrix"].shape[1]))
+
+        self.fold = (group @ rmf["matrix"].T @ sparse.diags(arf * self.exposure)).tocsr()
+
+        # Group energy bounds
+        self.grp_elo = np.full(self.ngroups, np.inf)
+        self.grp_ehi = np.zeros(self.ngroups)
+        np.minimum.at(self.grp_elo, grp_id, cmin[notice])
+        np.maximum.at(self.grp_ehi, grp_id, cmax[notice])
+
+        self.counts = group @ pha["counts"]
+        self.bkg = np.zeros(self.ngroups)
+        self.backratio = 0.
+        self.hasBackground = pha["backfile"] is not None
+        if self.hasBackground:
+            back = read_pha(pha["backfile"])
+            self.bkg = group @ back["counts"]
+            self.backratio = (self.exposure * pha["backscal"]) / (back["exposure"] * back["backscal"])
+
+        # Cross-sections are fixed for a given grid, cache them per method
+        self._sigma = {}
+
+
+    def sigma(self, method):
+        if method not in self._sigma:
+            self._sigma[method] = cross_section(self.ecen, method)
+        return self._sigma[method]
+
+
+    # Background subtracted counts and their variance
+    def netCounts(self):
+        net = self.counts - self.backratio * self.bkg
+        var = self.counts + self.backratio**2 * self.bkg
+        return net, np.maximum(var, 1.)
+
+
+# Chi^2 with the data variance, returns the statistic and d(stat)/d(mu)
+# mu can be (..., ngroups), e.g. many models at once, with one statistic each
+def chi_stat(mu, spec):
+    net, var = spec.netCounts()
+    res = net - mu
+    return np.sum(res**2 / var, axis = -1), -2. * res / var
+
+
+# Cash statistic, W-stat when there is a background spectrum
+# The background rate is profiled out; by the envelope theorem the gradient
+# is the partial derivative at the profiled value
+def c_stat(mu, spec):
+    S = spec.counts
+    mu = np.maximum(mu, 1.e-30)
+    if not spec.hasBackground:
+        logS = np.log(np.where(S > 0, S, 1.))
+        stat = 2. * np.sum(mu - S + S * (logS - np.log(mu)), axis = -1)
+        return stat, 2. * (1. - S / mu)
+
+    # W-stat in counts; bkg counts scaled to the source exposure and area
+    B = spec.bkg
+    r = 1. / spec.backratio
+    d = np.sqrt(((1. + r) * mu - S - B)**2 + 4. * (1. + r) * B * mu)
+    f = np.maximum((S + B - (1. + r) * mu + d) / (2. * (1. + r)), 0.)
+
+    src = np.maximum(mu + f, 1.e-30)
+    bkg = np.maximum(r * f, 1.e-30)
+    logS = np.log(np.where(S > 0, S, 1.))
+    logB = np.log(np.where(B > 0, B, 1.))
+    stat = 2. * np.sum(mu + (1. + r) * f
+                       - S * np.log(src) - B * np.log(bkg)
+                       - S * (1. - logS) - B * (1. - logB), axis = -1)
+    return stat, 2. * (1. - S / src)
+
+
+STATISTICS = {"chi" : chi_stat, "cstat" : c_stat}
+
+
+class ForwardFold():
+
+    def __init__(self, responses = None):
+        self.spectra = []
+        self.responses = responses
+
+        self.statMethod = "chi"
+        self.modelIntrinsic = "pwl"
+        self.abs = "pha"
+        self.ifcFlux = True
+
+        # cflux range
+        self.emin = 0.3
+        self.emax = 10.0
+
+        self.nH = 2.56
+        self.nH_frozen = True
+
+        self.params = None
+        self.covar_internal = None
+        self.statistic = 0
+        self.dof = 0
+
+
+    def clear(self):
+        self.spectra = []
+
+
+    # Load a grouped PHA; background, RMF and ARF are taken from its header
+    def addSpectrum(self, filename, elow = 0.3, ehigh = 10.0):
+        spec = FoldedSpectrum(filename, elow, ehigh, self.responses)
+        self.spectra.append(spec)
+        return spec
+
+
+    def setModel(self, imodel = "pwl", cflux = True, absorb = "pha"):
+        self.modelIntrinsic = imodel.lower()
+        self.ifcFlux = cflux
+        self.abs = absorb
+        self.params = None
+
+
+    # Freeing or freezing nH changes the parameter vector, so the next fit
+    # starts again from _initialParameters
+    def setNH(self, i_nH, i_fixed = True):
+        if i_fixed != self.nH_frozen:
+            self.params = None
+        self.nH = i_nH
+        self.nH_frozen = i_fixed
+
+
+    # Names of the free parameters, in internal order
+    # The normalisation is fitted as lg10Flux (cflux) or log10(norm)
+    def parameterNames(self):
+        names = ["lg10Flux" if self.ifcFlux else "lgNorm"]
+        if self.modelIntrinsic == "pwl":
+            names += ["PhoIndex"]
+        elif self.modelIntrinsic == "logpar":
+            names += ["alpha", "beta"]
+        if not self.nH_frozen:
+            names += ["nH"]
+        return names
+
+
+    def _shape(self, e, shape):
+        loge = np.log(e)
+        if self.modelIntrinsic == "pwl":
+            f = np.exp(-shape[0] * loge)
+            dlnf = -loge[:, None]
+        else:
+            log10e = loge / np.log(10.)
+            f = np.exp(-(shape[0] + shape[1] * log10e) * loge)
+            dlnf = np.stack([-loge, -loge * log10e], axis = 1)
+        return f, dlnf
+
+
+    # log10 of the cflux integral, int E shape(E) dE over [emin, emax] (erg),
+    # and its derivative w.r.t. the shape parameters
+    def _lgIntegral(self, shape):
+        e = np.logspace(np.log10(self.emin), np.log10(self.emax), NCFLUXGRID)
+        f, dlnf = self._shape(e, shape)
+        integrand = e * f * KEV2ERG
+        integral = _trapz(integrand, e)
+        dintegral = _trapz(integrand[:, None] * dlnf, e)
+        return np.log10(integral), dintegral / integral / np.log(10.)
+
+
+    # log10 of the normalisation and its derivative w.r.t. the shape parameters
+    def _lgNorm(self, theta, shape):
+        if not self.ifcFlux:
+            return theta[0], np.zeros(len(shape))
+
+        # K = 10^lg10Flux / int E shape(E) dE over [emin, emax]
+        lgI, dlgI = self._lgIntegral(shape)
+        return theta[0] - lgI, -dlgI
+
+
+    def _split(self, theta):
+        nshape = 1 if self.modelIntrinsic == "pwl" else 2
+        shape = theta[1:1 + nshape]
+        nH = self.nH if self.nH_frozen else theta[1 + nshape]
+        return shape, nH
+
+
+    # Absorbed photon flux per model bin and d(ln flux)/d(theta)
+    def photonFlux(self, theta, spec):
+        shape, nH = self._split(theta)
+        lgK, dlgK = self._lgNorm(theta, shape)
+        f, dlnf = self._shape(spec.ecen, shape)
+
+        if self.nH_frozen:
+            trans = transmission_cache.get(nH, spec.ecen, self.abs)
+        else:
+            trans = np.exp(-nH * 1.e22 * spec.sigma(self.abs))
+
+        phi = trans * 10**lgK * f * spec.de
+
+        dlnphi = np.empty((len(phi), len(theta)))
+        dlnphi[:, 0] = np.log(10.)
+        dlnphi[:, 1:1 + len(shape)] = dlnf + np.log(10.) * dlgK
+        if not self.nH_frozen:
+            dlnphi[:, -1] = -1.e22 * spec.sigma(self.abs)
+        return phi, dlnphi
+
+
+    # Total statistic and its analytic gradient
+    def statGrad(self, theta):
+        stat_fn = STATISTICS[self.statMethod]
+        stat = 0.
+        grad = np.zeros(len(theta))
+        for spec in self.spectra:
+            phi, dlnphi = self.photonFlux(theta, spec)
+            mu = spec.fold @ phi
+            jac = spec.fold @ (phi[:, None] * dlnphi)
+            s, dmu = stat_fn(mu, spec)
+            stat += s
+            grad += jac.T @ dmu
+        return stat, grad
+
+
+    def _bounds(self):
+        bounds = [(-20., -5.) if self.ifcFlux else (-12., 6.)]
+        if self.modelIntrinsic == "pwl":
+            bounds += [(-3., 10.)]
+        else:
+            bounds += [(-3., 10.), (-5., 5.)]
+        if not self.nH_frozen:
+            bounds += [(0., 100.)]
+        return bounds
+
+
+    def _initialParameters(self):
+        if self.modelIntrinsic == "pwl":
+            theta = [0., 2.]
+        else:
+            theta = [0., 2., 0.1]
+        if not self.nH_frozen:
+            theta += [self.nH]
+        theta = np.array(theta, dtype = float)
+
+        # Scale the normalisation to the observed net counts
+        shape, nH = self._split(theta)
+        lgK, _ = self._lgNorm(theta, shape)
+        net = sum(np.sum(s.netCounts()[0]) for s in self.spectra)
+        pred = sum(np.sum(s.fold @ self.photonFlux(theta, s)[0]) for s in self.spectra)
+        if net > 0 and pred > 0:
+            theta[0] += np.log10(net / pred)
+        lo, hi = self._bounds()[0]
+        theta[0] = np.clip(theta[0], lo, hi)
+        return theta
+
+
+    # Hessian from central differences of the analytic gradient
+    def _hessian(self, theta):
+        k = len(theta)
+        hess = np.zeros((k, k))
+        for j in range(k):
+            h = 1.e-4 * max(1., abs(theta[j]))
+            tp = theta.copy()
+            tm = theta.copy()
+            tp[j] += h
+            tm[j] -= h
+            hess[:, j] = (self.statGrad(tp)[1] - self.statGrad(tm)[1]) / (2. * h)
+        return 0.5 * (hess + hess.T)
+
+
+    def fit(self):
+        if len(self.spectra) == 0:
+            raise RuntimeError("ForwardFold::fit No spectra loaded")
+
+        theta0 = self.params if self.params is not None else self._initialParameters()
+        res = _optimize.minimize(self.statGrad, theta0, jac = True, method = "L-BFGS-B",
+                       bounds = self._bounds(), options = {"maxiter" : 10000})
+        self.params = res.x
+        self.statistic = res.fun
+        self.dof = sum(s.ngroups for s in self.spectra) - len(self.params)
+
+        # 1 sigma covariance for a delta-stat of 1
+        try:
+            self.covar_internal = 2. * np.linalg.inv(self._hessian(self.params))
+        except np.linalg.LinAlgError:
+            self.covar_internal = np.zeros((len(self.params), len(self.params)))
+        return res
+
+
+    def _sigmaOf(self, i):
+        return np.sqrt(max(self.covar_internal[i][i], 0.))
+
+
+    # Absorbed and intrinsic dN/dE (ph cm^-2 s^-1 keV^-1) at energies e
+    def dnde(self, e, absorbed = True):
+        shape, nH = self._split(self.params)
+        lgK, _ = self._lgNorm(self.params, shape)
+        f, _ = self._shape(e, shape)
+        model = 10**lgK * f
+        if absorbed:
+            model = model * transmission_cache.get(nH, e, self.abs)
+        return model
+
+
+    # Absorbed energy flux (erg cm^-2 s^-1) and its 1 sigma error
+    def energyFlux(self, elow, ehigh):
+        spec = self.spectra[0]
+        sel = (spec.ecen >= elow) & (spec.ecen <= ehigh)
+        phi, dlnphi = self.photonFlux(self.params, spec)
+        w = spec.ecen[sel] * KEV2ERG
+        flux = np.sum(w * phi[sel])
+        grad = (w * phi[sel]) @ dlnphi[sel]
+        return flux, np.sqrt(max(grad @ self.covar_internal @ grad, 0.))
+
+
+    # Fill a dict with the same keys as XRT_Analysis.writeModel
+    def writeModel(self):
+        modelDict = {}
+        modelDict["Chi2"] = self.statistic
+        modelDict["DOF"] = self.dof
+
+        spec = self.spectra[0]
+        phi, _ = self.photonFlux(self.params, spec)
+        mu = spec.fold @ phi
+        net, var = spec.netCounts()
+
+        # Unfolded spectrum: data/model ratio times the model at the group centre
+        energy = 0.5 * (spec.grp_elo + spec.grp_ehi)
+        e2dnde = energy * energy * self.dnde(energy)
+        ratio = np.where(mu > 0, 1. / np.where(mu > 0, mu, 1.), 0.)
+        modelDict["Energy [keV]"] = energy
+        modelDict["e2dnde [keV cm^-2 s^-1]"] = net * ratio * e2dnde
+        modelDict["Energy_err [keV]"] = 0.5 * (spec.grp_ehi - spec.grp_elo)
+        modelDict["e2dnde_err [keV cm^-2 s^-1]"] = np.sqrt(var) * ratio * e2dnde
+
+        d = deab(self.nH if self.nH_frozen else self.params[-1], method = self.abs)
+        modelDict["e2dnde_deabsorbed [keV cm^-2 s^-1]"], \
+        modelDict["e2dnde_deabsorbed_err [keV cm^-2 s^-1]"] = \
+                    d.deabsorb(modelDict["Energy [keV]"],
+                               modelDict["e2dnde [keV cm^-2 s^-1]"],
+                               modelDict["e2dnde_err [keV cm^-2 s^-1]"])
+
+        names = self.parameterNames()
+        for name, key in [("PhoIndex", "Index"), ("alpha", "Alpha"), ("beta", "Beta")]:
+            if name in names:
+                i = names.index(name)
+                modelDict[key] = self.params[i]
+                modelDict[key + "_errl"] = self._sigmaOf(i)
+                modelDict[key + "_erru"] = self._sigmaOf(i)
+
+        if self.ifcFlux:
+            lgflux = self.params[0]
+            sigma = self._sigmaOf(0)
+            modelDict["Flux [erg cm^-2 s^-1]"] = np.power(10., lgflux)
+            modelDict["Flux_errl [erg cm^-2 s^-1]"] = np.power(10., lgflux) - np.power(10., lgflux - sigma)
+            modelDict["Flux_erru [erg cm^-2 s^-1]"] = np.power(10., lgflux + sigma) - np.power(10., lgflux)
+        else:
+            norm = np.power(10., self.params[0])
+            norm_err = norm * np.log(10.) * self._sigmaOf(0)
+
+            # Covariance in the order used by XRT_Analysis: shape parameters then norm
+            nshape = 1 if self.modelIntrinsic == "pwl" else 2
+            order = list(range(1, 1 + nshape)) + [0]
+            scale = np.ones(len(order))
+            scale[-1] = norm * np.log(10.)
+            covar = self.covar_internal[np.ix_(order, order)] * np.outer(scale, scale)
+            if self.modelIntrinsic == "pwl":
+                labels = [["didi", "didn"], ["dndi", "dndn"]]
+            else:
+                labels = [["dada", "dadb", "dadn"],
+                          ["dbda", "dbdb", "dbdn"],
+                          ["dnda", "dndb", "dndn"]]
+
+            modelDict["Norm"] = norm
+            modelDict["Norm_errl"] = norm_err
+            modelDict["Norm_erru"] = norm_err
+            modelDict["CoVar"] = covar
+            modelDict["CoVar_labels"] = np.array(labels, dtype = "str")
+
+            flux, flux_err = self.energyFlux(2., 10.)
+            modelDict["Flux [erg cm^-2 s^-1]"] = flux
+            modelDict["Flux_errl [erg cm^-2 s^-1]"] = flux_err
+            modelDict["Flux_erru [erg cm^-2 s^-1]"] = flux_err
+
+        modelenergies = spec.ecen
+        rangemask = ( modelenergies >= 0.3 ) & ( modelenergies <= 10.0 )
+        modelDict["modelEnergy [keV]"] = modelenergies[rangemask]
+        modelDict["model_e2dnde [keV cm^-2 s^-1]"] = modelenergies[rangemask] \
+                                                      * modelenergies[rangemask] \
+                                                      * self.dnde(modelenergies[rangemask])
+        intrinspec = d.deabsorb(modelDict["modelEnergy [keV]"],
+                                modelDict["model_e2dnde [keV cm^-2 s^-1]"])
+        modelDict["model_intrinsic_e2dnde [keV cm^-2 s^-1]"] = np.array(intrinspec[0])
+
+        return modelDict
+
+
+# Responses shared by the spectra of one fitter: every observation of a mode
+# links to the same RMF, so each file is read (or mapped) once
+class _SharedResponses():
+
+    def __init__(self, store = None):
+        self.store = store
+        self._loaded = {}
+
+
+    def load(self, filename):
+        key = os.path.realpath(filename)
+        if key not in self._loaded:
+            self._loaded[key] = self.store.load(filename) if self.store is not None else read_rmf(filename)
+        return self._loaded[key]
+
+
+# Spectra on the same model energy grid stacked into one folding matrix
+# Rows are the groups of every spectrum in turn, owner gives the spectrum of
+# each row; the statistics only need counts, bkg, backratio and netCounts
+class StackedSpectra():
+
+    netCounts = FoldedSpectrum.netCounts
+    sigma = FoldedSpectrum.sigma
+
+    def __init__(self, spectra, indices):
+        first = spectra[0]
+        self.ecen = first.ecen
+        self.de = first.de
+        self.indices = np.asarray(indices)
+        self.fold = sparse.vstack([s.fold for s in spectra]).tocsr()
+        self.owner = np.repeat(self.indices, [s.ngroups for s in spectra])
+        self.counts = np.concatenate([s.counts for s in spectra])
+        self.bkg = np.concatenate([s.bkg for s in spectra])
+        self.backratio = np.repeat([s.backratio for s in spectra], [s.ngroups for s in spectra])
+        self.hasBackground = all(s.hasBackground for s in spectra)
+        if self.hasBackground != any(s.hasBackground for s in spectra):
+            raise ValueError("JointForwardFold: either all or none of the spectra need a background")
+        self._sigma = {}
+
+
+# Joint fit of N spectra, each its own data group: the shape parameters
+# (PhoIndex or alpha/beta) and nH are shared, every spectrum has its own
+# lg10Flux (or log10 norm); theta = [lg_1 .. lg_N, shape, (nH)]
+# Spectra on the same energy grid are folded with one stacked sparse matrix,
+# so a statistic evaluation costs two sparse products per grid, not per spectrum
+class JointForwardFold(ForwardFold):
+
+    def __init__(self, responses = None):
+        ForwardFold.__init__(self, responses)
+        self._shared = _SharedResponses(responses)
+        self._blocks = None
+
+
+    def clear(self):
+        self.spectra = []
+        self._blocks = None
+
+
+    def addSpectrum(self, filename, elow = 0.3, ehigh = 10.0):
+        if self._shared.store is not self.responses:
+            self._shared = _SharedResponses(self.responses)
+        spec = FoldedSpectrum(filename, elow, ehigh, self._shared)
+        self.spectra.append(spec)
+        self._blocks = None
+        self.params = None
+        return spec
+
+
+    # Stacked spectra, one per model energy grid, built once per set of spectra
+    def blocks(self):
+        if self._blocks is None:
+            grids = {}
+            for i, spec in enumerate(self.spectra):
+                grids.setdefault(spec.ecen.tobytes(), []).append(i)
+            self._blocks = [StackedSpectra([self.spectra[i] for i in idx], idx)
+                            for idx in grids.values()]
+        return self._blocks
+
+
+    def parameterNames(self):
+        norm = "lg10Flux" if self.ifcFlux else "lgNorm"
+        names = ["%s_%d" %(norm, i + 1) for i in range(len(self.spectra))]
+        return names + ForwardFold.parameterNames(self)[1:]
+
+
+    def _split(self, theta):
+        n = len(self.spectra)
+        nshape = 1 if self.modelIntrinsic == "pwl" else 2
+        shape = theta[n:n + nshape]
+        nH = self.nH if self.nH_frozen else theta[n + nshape]
+        return shape, nH
+
+
+    # log10 of the normalisation of every spectrum and its derivative
+    # w.r.t. the shape parameters (the same for all of them)
+    def _lgNorms(self, theta, shape):
+        lg = theta[:len(self.spectra)]
+        if not self.ifcFlux:
+            return lg, np.zeros(len(shape))
+        lgI, dlgI = self._lgIntegral(shape)
+        return lg - lgI, -dlgI
+
+
+    # Unnormalised absorbed photon flux per model bin of a grid and
+    # d(ln flux)/d(shape, nH)
+    def _base(self, shape, nH, dlgK, block):
+        f, dlnf = self._shape(block.ecen, shape)
+        if self.nH_frozen:
+            trans = transmission_cache.get(nH, block.ecen, self.abs)
+        else:
+            trans = np.exp(-nH * 1.e22 * block.sigma(self.abs))
+        base = trans * f * block.de
+
+        dlnbase = dlnf + np.log(10.) * dlgK
+        if not self.nH_frozen:
+            dlnbase = np.column_stack([dlnbase, -1.e22 * block.sigma(self.abs)])
+        return base, dlnbase
+
+
+    # Predicted counts of every row of a block and their Jacobian w.r.t. the
+    # shared parameters
+    def _predict(self, theta, block):
+        shape, nH = self._split(theta)
+        lgK, dlgK = self._lgNorms(theta, shape)
+        base, dlnbase = self._base(shape, nH, dlgK, block)
+        K = 10**lgK[block.owner]
+        mu = K * (block.fold @ base)
+        jac = K[:, None] * (block.fold @ (base[:, None] * dlnbase))
+        return mu, jac
+
+
+    def statGrad(self, theta):
+        stat_fn = STATISTICS[self.statMethod]
+        n = len(self.spectra)
+        stat = 0.
+        grad = np.zeros(len(theta))
+        for block in self.blocks():
+            mu, jac = self._predict(theta, block)
+            s, dmu = stat_fn(mu, block)
+            stat += s
+            grad[:n] += np.log(10.) * np.bincount(block.owner, dmu * mu, minlength = n)
+            grad[n:] += jac.T @ dmu
+        return stat, grad
+
+
+    # A normalisation only acts on its own spectrum, so the norm-norm block of
+    # the Hessian is diagonal: one step of every norm at once gives that
+    # diagonal and the shared parameters give the other columns, which is
+    # 2 (k + 1) gradient calls instead of 2 (N + k)
+    def _hessian(self, theta):
+        n = len(self.spectra)
+        k = len(theta)
+        hess = np.zeros((k, k))
+        for cols in [np.arange(n)] + [np.array([j]) for j in range(n, k)]:
+            h = 1.e-4 * np.maximum(1., np.abs(theta[cols]))
+            tp = theta.copy()
+            tm = theta.copy()
+            tp[cols] += h
+            tm[cols] -= h
+            dgrad = self.statGrad(tp)[1] - self.statGrad(tm)[1]
+            if cols[0] < n:
+                hess[cols, cols] = dgrad[cols] / (2. * h)
+            else:
+                hess[:, cols[0]] = dgrad / (2. * h[0])
+        hess[n:, :n] = hess[:n, n:].T
+        return 0.5 * (hess + hess.T)
+
+
+    def _bounds(self):
+        bounds = ForwardFold._bounds(self)
+        return bounds[:1] * len(self.spectra) + bounds[1:]
+
+
+    def _initialParameters(self):
+        n = len(self.spectra)
+        if self.modelIntrinsic == "pwl":
+            shape = [2.]
+        else:
+            shape = [2., 0.1]
+        theta = np.array([0.] * n + shape + ([] if self.nH_frozen else [self.nH]), dtype = float)
+
+        # Scale each normalisation to the observed net counts of its spectrum
+        net = np.zeros(n)
+        pred = np.zeros(n)
+        for block in self.blocks():
+            mu, _ = self._predict(theta, block)
+            net += np.bincount(block.owner, block.netCounts()[0], minlength = n)
+            pred += np.bincount(block.owner, mu, minlength = n)
+        ok = (net > 0) & (pred > 0)
+        theta[:n][ok] += np.log10(net[ok] / pred[ok])
+        lo, hi = self._bounds()[0]
+        theta[:n] = np.clip(theta[:n], lo, hi)
+        return theta
+
+
+    # Single spectrum fitter for group i at the joint parameters, with the
+    # matching block of the joint covariance
+    def group(self, i):
+        n = len(self.spectra)
+        keep = [i] + list(range(n, len(self.params)))
+        single = ForwardFold(self.responses)
+        for name in ("statMethod", "modelIntrinsic", "abs", "ifcFlux", "emin", "emax", "nH", "nH_frozen"):
+            setattr(single, name, getattr(self, name))
+        single.spectra = [self.spectra[i]]
+        single.params = self.params[keep]
+        single.covar_internal = self.covar_internal[np.ix_(keep, keep)]
+        single.statistic = self.statistic
+        single.dof = self.dof
+        return single
+
+
+    # Shared parameters of the joint fit and, under "Groups", one dict per
+    # spectrum with the keys of ForwardFold.writeModel (SED, model, Flux, Norm)
+    def writeModel(self):
+        n = len(self.spectra)
+        modelDict = {}
+        modelDict["Chi2"] = self.statistic
+        modelDict["DOF"] = self.dof
+        modelDict["nGroups"] = n
+
+        names = self.parameterNames()
+        for name, key in [("PhoIndex", "Index"), ("alpha", "Alpha"), ("beta", "Beta"), ("nH", "nH")]:
+            if name in names:
+                i = names.index(name)
+                modelDict[key] = self.params[i]
+                modelDict[key + "_errl"] = self._sigmaOf(i)
+                modelDict[key + "_erru"] = self._sigmaOf(i)
+
+        groups = []
+        for i in range(n):
+            single = self.group(i)
+            res = single.writeModel()
+            res["File"] = self.spectra[i].fileName
+            # Chi2 and DOF of the view are those of the joint fit, they stay
+            # with the shared parameters
+            del res["Chi2"], res["DOF"]
+            # Contribution of this spectrum to the joint statistic
+            res["Chi2_group"] = single.statGrad(single.params)[0]
+            groups.append(res)
+        modelDict["Groups"] = groups
+        return modelDict
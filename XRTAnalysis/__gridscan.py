@@ -0,0 +1,248 @@
+'''
+    nH x spectral shape grid scans for the numpy backend
+
+    The statistic is evaluated over a grid of nH and one shape parameter
+    (PhoIndex, alpha or beta), the normalisation (and for logpar the other
+    shape parameter) being refitted at every point. A row of the grid (one
+    nH) is done at once: the transmission uses the cross-sections cached in
+    each FoldedSpectrum, the models of every column are folded with a single
+    sparse product and their normalisations are profiled together (closed
+    form for chi^2, Newton steps for C-stat). Rows are independent and can
+    be spread over worker processes.
+'''
+
+import os
+import numpy as np
+
+from __forwardfold import STATISTICS, KEV2ERG, NCFLUXGRID, _trapz
+from __lazy import LazyModule
+
+_contourpy = LazyModule("contourpy")
+
+
+# Delta statistic of the joint confidence regions of two parameters (%)
+LEVELS = {68.27 : 2.30, 95.45 : 6.18, 99.73 : 11.83}
+
+# Delta statistic of the 1 sigma interval of a single parameter
+MARGINAL = 1.
+
+# Profiling the other logpar shape parameter: coarse trials over its
+# bounds, then NZOOM rounds of 9 trials, each 4 times finer
+NCOARSE = 21
+NZOOM = 5
+
+
+# dN/dE shape of S shape vectors (S x nshape) at energies e, (S x E)
+def _shapes(model, shapes, e):
+    loge = np.log(e)
+    if model == "pwl":
+        return np.exp(-shapes[:, :1] * loge)
+    return np.exp(-(shapes[:, :1] + shapes[:, 1:2] * (loge / np.log(10.))) * loge)
+
+
+# Folded counts of every spectrum for a unit normalisation (lg10Flux = 0
+# with cflux, norm = 1 otherwise), one (S x ngroups) array per spectrum
+def unit_counts(fitter, nH, shapes):
+    scale = np.ones(len(shapes))
+    if fitter.ifcFlux:
+        e = np.logspace(np.log10(fitter.emin), np.log10(fitter.emax), NCFLUXGRID)
+        scale = 1. / _trapz((e * _shapes(fitter.modelIntrinsic, shapes, e) * KEV2ERG).T, e)
+
+    counts = []
+    for spec in fitter.spectra:
+        trans = np.exp(-nH * 1.e22 * spec.sigma(fitter.abs))
+        base = _shapes(fitter.modelIntrinsic, shapes, spec.ecen) * (trans * spec.de)
+        counts.append(scale[:, None] * (spec.fold @ base.T).T)
+    return counts
+
+
+# Statistic of S models with normalisations 10^lgK, and its slope in lgK
+def _norm_stat(fitter, counts, lgK):
+    stat_fn = STATISTICS[fitter.statMethod]
+    K = 10**lgK
+    stat = 0.
+    slope = 0.
+    for m, spec in zip(counts, fitter.spectra):
+        mu = K[:, None] * m
+        s, dmu = stat_fn(mu, spec)
+        stat = stat + s
+        slope = slope + np.log(10.) * np.sum(dmu * mu, axis = 1)
+    return stat, slope
+
+
+# Best lg normalisation of each of S models and the statistic there
+def profile_norm(fitter, counts, iterations = 30, tol = 1.e-6):
+    # Minimum of chi^2 with the data variance, in closed form; for C-stat
+    # the start is where the model matches the net counts (exact for Cash)
+    num = 0.
+    den = 0.
+    for m, spec in zip(counts, fitter.spectra):
+        net, var = spec.netCounts()
+        if fitter.statMethod == "chi":
+            num = num + m @ (net / var)
+            den = den + (m * m) @ (1. / var)
+        else:
+            num = num + np.sum(net)
+            den = den + np.sum(m, axis = 1)
+    lo, hi = fitter._bounds()[0]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        lgK = np.log10(np.where((num > 0) & (den > 0), num / den, 10**lo))
+    lgK = np.clip(lgK, lo, hi)
+
+    # C-stat: Newton steps from there, the curvature from the change of the
+    # slope over the last step (a finite difference for the first one); only
+    # the models that have not converged yet are carried along
+    stat, slope = _norm_stat(fitter, counts, lgK)
+    if fitter.statMethod != "chi":
+        active = np.arange(len(lgK))
+        x, g = lgK, slope
+        prev = x + 1.e-5
+        _, prevSlope = _norm_stat(fitter, counts, prev)
+        for _ in range(iterations):
+            dx = x - prev
+            curv = (g - prevSlope) / np.where(dx == 0, 1., dx)
+            step = np.where(curv > 0, -g / np.where(curv > 0, curv, 1.), -0.5 * np.sign(g))
+            step = np.clip(x + np.clip(step, -1., 1.), lo, hi) - x
+            moving = np.abs(step) >= tol
+            if not np.any(moving):
+                break
+            active = active[moving]
+            counts = [m[moving] for m in counts]
+            prev, prevSlope = x[moving], g[moving]
+            x = prev + step[moving]
+            s, g = _norm_stat(fitter, counts, x)
+            lgK[active] = x
+            stat[active] = s
+
+    return lgK, stat
+
+
+# One row of the scan: nH fixed, the gridded shape parameter (number axis
+# in the shape vector) set to each of values
+# Returns the statistic, lg normalisation and shape vectors (P x nshape)
+def scan_row(fitter, nH, values, axis = 0):
+    values = np.asarray(values, dtype = float)
+    if fitter.modelIntrinsic == "pwl":
+        shapes = values[:, None]
+        lgK, stat = profile_norm(fitter, unit_counts(fitter, nH, shapes))
+        return stat, lgK, shapes
+
+    # logpar: the other shape parameter is profiled for all columns together,
+    # zooming in on the best trial of each column
+    other = 1 - axis
+    lo, hi = fitter._bounds()[1 + other]
+    ncol = len(values)
+    cols = np.arange(ncol)
+    trials = np.tile(np.linspace(lo, hi, NCOARSE), (ncol, 1))
+    step = (hi - lo) / (NCOARSE - 1)
+
+    for r in range(NZOOM + 1):
+        ntrial = trials.shape[1]
+        shapes = np.empty((ncol * ntrial, 2))
+        shapes[:, axis] = np.repeat(values, ntrial)
+        shapes[:, other] = trials.ravel()
+        lgK, stat = profile_norm(fitter, unit_counts(fitter, nH, shapes))
+        stat = stat.reshape(ncol, ntrial)
+        best = np.argmin(stat, axis = 1)
+        centre = trials[cols, best]
+        if r < NZOOM:
+            step /= 4.
+            trials = np.clip(centre[:, None] + step * np.arange(-4, 5), lo, hi)
+
+    shapes = np.empty((ncol, 2))
+    shapes[:, axis] = values
+    shapes[:, other] = centre
+    return stat[cols, best], lgK.reshape(ncol, -1)[cols, best], shapes
+
+
+_FITTER = None
+
+
+def _init_worker(path, fitter):
+    import sys
+    global _FITTER
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    _FITTER = fitter
+
+
+def _scan_row(i, nH, values, axis):
+    return i, scan_row(_FITTER, nH, values, axis)
+
+
+# Statistic over the (nH x values) grid, rows shared by nworkers processes
+# The fitter (spectra, folded responses and cached cross-sections) is sent
+# once to every worker
+# Returns the statistic and lg normalisation (nH x values) and the shape
+# vectors (nH x values x nshape)
+def grid_scan(fitter, nH, values, axis = 0, nworkers = 1):
+    nH = np.asarray(nH, dtype = float)
+    values = np.asarray(values, dtype = float)
+    nshape = 1 if fitter.modelIntrinsic == "pwl" else 2
+    stat = np.empty((len(nH), len(values)))
+    lgK = np.empty((len(nH), len(values)))
+    shapes = np.empty((len(nH), len(values), nshape))
+
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    nworkers = max(1, min(nworkers, len(nH)))
+    if nworkers == 1:
+        rows = (scan_row(fitter, n, values, axis) for n in nH)
+        for i, row in enumerate(rows):
+            stat[i], lgK[i], shapes[i] = row
+        return stat, lgK, shapes
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing as mp
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers = nworkers, mp_context = ctx,
+                             initializer = _init_worker, initargs = (here, fitter)) as pool:
+        futures = [pool.submit(_scan_row, i, n, values, axis) for i, n in enumerate(nH)]
+        for fut in futures:
+            i, row = fut.result()
+            stat[i], lgK[i], shapes[i] = row
+    return stat, lgK, shapes
+
+
+# Interval where the profile (delta statistic along x) stays below MARGINAL
+# around its minimum k, linearly interpolated; nan where the grid ends first
+def _interval(x, profile, k):
+    lo = hi = np.nan
+    below = np.nonzero(profile[:k] >= MARGINAL)[0]
+    if len(below):
+        a = below[-1]
+        lo = x[a] + (MARGINAL - profile[a]) * (x[a + 1] - x[a]) / (profile[a + 1] - profile[a])
+    above = np.nonzero(profile[k + 1:] >= MARGINAL)[0]
+    if len(above):
+        b = k + 1 + above[0]
+        hi = x[b - 1] + (MARGINAL - profile[b - 1]) * (x[b] - x[b - 1]) / (profile[b] - profile[b - 1])
+    return lo, hi
+
+
+# Minimum, marginal 1 sigma intervals (the statistic minimised over the
+# other axis) and joint confidence contours of a (nH x values) surface
+# Contours are lists of (n x 2) arrays of (value, nH) points, one list per level
+def summarise(nH, values, stat, name, levels = LEVELS):
+    nH = np.asarray(nH, dtype = float)
+    values = np.asarray(values, dtype = float)
+    delta = stat - np.nanmin(stat)
+    i, j = np.unravel_index(np.nanargmin(stat), stat.shape)
+
+    result = {"nH" : nH,
+              name : values,
+              "Statistic" : stat,
+              "Delta" : delta,
+              "Best" : {"nH" : nH[i], name : values[j], "Statistic" : stat[i, j]},
+              "nH_interval" : _interval(nH, np.nanmin(delta, axis = 1), i),
+              name + "_interval" : _interval(values, np.nanmin(delta, axis = 0), j),
+              "Levels" : dict(levels)}
+
+    contours = {}
+    if len(nH) > 1 and len(values) > 1:
+        generator = _contourpy.contour_generator(values, nH, delta)
+        for cl, level in levels.items():
+            contours[cl] = generator.lines(level)
+    result["Contours"] = contours
+    return result
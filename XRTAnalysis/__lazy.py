@@ -0,0 +1,32 @@
+'''
+	Deferred imports
+	The module is only imported when one of its attributes is first used,
+	so heavy or optional dependencies (xspec, pyplot, astropy.units) do not
+	slow down start-up for code paths that never touch them
+'''
+
+import importlib
+
+
+class LazyModule():
+
+	def __init__(self, name, hint = None):
+		self._name = name
+		self._hint = hint
+		self._module = None
+
+
+	def _load(self):
+		if self._module is None:
+			try:
+				self._module = importlib.import_module(self._name)
+			except ImportError as e:
+				msg = "%s could not be imported: %s" %(self._name, e)
+				if self._hint is not None:
+					msg += "\n%s" %self._hint
+				raise ImportError(msg) from e
+		return self._module
+
+
+	def __getattr__(self, attr):
+		return getattr(self._load(), attr)
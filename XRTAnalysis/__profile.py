@@ -0,0 +1,64 @@
+'''
+    Profile-likelihood error scans in worker processes
+
+    Each worker rebuilds the fit in its own xspec session (same spectra,
+    ignored channels, statistic, model and best-fit parameter values) and
+    runs Fit.error on a single parameter, so the scans of different
+    parameters run at the same time.
+'''
+
+import os
+
+
+# One "error <delta> <index>" scan, run in the worker process
+# For a joint fit, norm is the normalisation parameter within each data
+# group's model and norms the values of groups 2.., untied from group 1
+def profile_error(spectra, ignore, statMethod, modelType, values, frozen, index, delta = 1.,
+                  norm = None, norms = ()):
+    import xspec
+    xspec.Xset.chatter = 0
+    xspec.Xset.logChatter = 0
+
+    cwd = os.getcwd()
+    xspec.AllData.clear()
+    xspec.AllModels.clear()
+    # BACKFILE/RESPFILE/ANCRFILE are relative to the spectrum
+    for i, spec in enumerate(spectra):
+        os.chdir(os.path.dirname(spec))
+        xspec.AllData("%d:%d %s" %(i + 1, i + 1, os.path.basename(spec)))
+    os.chdir(cwd)
+    for item in ignore:
+        xspec.AllData.ignore(item)
+
+    xspec.Fit.statMethod = statMethod
+    model = xspec.Model(modelType)
+    for i, (vals, froz) in enumerate(zip(values, frozen)):
+        model(i + 1).values = vals
+        model(i + 1).frozen = froz
+    for g, vals in enumerate(norms, start = 2):
+        par = xspec.AllModels(g)(norm)
+        par.untie()
+        par.values = vals
+        par.frozen = False
+
+    xspec.Fit.nIterations = 10000
+    xspec.Fit.perform()
+    xspec.Fit.error("%g %d" %(delta, index))
+    err = model(index).error
+    return index, (float(err[0]), float(err[1]))
+
+
+# Scan the given parameter indices in up to nworkers processes
+# Returns {index: (lower, upper)}
+def parallel_errors(spectra, ignore, statMethod, modelType, values, frozen, indices,
+                    nworkers = None, delta = 1., norm = None, norms = ()):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing as mp
+
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers = min(nworkers, len(indices)), mp_context = ctx) as pool:
+        futures = [pool.submit(profile_error, spectra, ignore, statMethod, modelType,
+                               values, frozen, index, delta, norm, norms) for index in indices]
+        return dict(fut.result() for fut in futures)
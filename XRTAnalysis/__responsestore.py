@@ -0,0 +1,131 @@
+'''
+    On-disk store of RMFs converted to CSR
+
+    Every observation of a mode links to the same CALDB RMF, so each RMF is
+    parsed once, written as .npy arrays under its checksum and memory-mapped
+    on every later load. The pages are shared between worker processes.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from scipy import sparse
+
+from __forwardfold import read_rmf
+
+
+# Arrays written for each response
+_ARRAYS = ["data", "indices", "indptr", "energ_lo", "energ_hi", "e_min", "e_max"]
+
+
+# Default location, can be overridden with XRTTOOLS_RESPONSE_CACHE
+def default_store_dir():
+    return os.environ.get("XRTTOOLS_RESPONSE_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "xrttools", "responses"))
+
+
+def file_checksum(filename, blocksize = 1 << 20):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResponseStore():
+
+    def __init__(self, directory = None):
+        if directory is None:
+            directory = default_store_dir()
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok = True)
+
+        # (path, size, mtime) -> checksum, so unchanged files are not re-hashed
+        self._indexFile = os.path.join(self.directory, "index.json")
+        self._index = self._readIndex()
+
+        # Responses already mapped in this process
+        self._loaded = {}
+
+
+    def _readIndex(self):
+        try:
+            with open(self._indexFile) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+
+    def _writeIndex(self):
+        fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = ".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._indexFile)
+
+
+    # Checksum of the file behind a (possibly symlinked) RMF
+    def checksum(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        key = "%s:%d:%d" %(path, st.st_size, st.st_mtime_ns)
+        if key not in self._index:
+            self._index[key] = file_checksum(path)
+            self._writeIndex()
+        return self._index[key]
+
+
+    def _convert(self, filename, target):
+        rmf = read_rmf(filename)
+        matrix = rmf["matrix"]
+        arrays = {"data" : matrix.data.astype(float),
+                  "indices" : matrix.indices.astype(np.int32),
+                  "indptr" : matrix.indptr.astype(np.int32),
+                  "shape" : np.array(matrix.shape, dtype = np.int64)}
+        for name in ["energ_lo", "energ_hi", "e_min", "e_max"]:
+            arrays[name] = rmf[name]
+
+        # Write to a scratch dir and rename, so concurrent workers never see half a response
+        tmp = tempfile.mkdtemp(dir = self.directory)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), arr)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another process got there first
+            for name in arrays:
+                os.remove(os.path.join(tmp, name + ".npy"))
+            os.rmdir(tmp)
+
+
+    # Same dict as read_rmf, with arrays memory-mapped from the store
+    def load(self, filename):
+        key = self.checksum(filename)
+        if key in self._loaded:
+            return self._loaded[key]
+
+        target = os.path.join(self.directory, key)
+        if not os.path.isdir(target):
+            self._convert(filename, target)
+
+        arrays = {name : np.load(os.path.join(target, name + ".npy"), mmap_mode = "r")
+                  for name in _ARRAYS}
+        shape = tuple(np.load(os.path.join(target, "shape.npy")))
+
+        matrix = sparse.csr_matrix(shape)
+        matrix.data = arrays["data"]
+        matrix.indices = arrays["indices"]
+        matrix.indptr = arrays["indptr"]
+
+        rmf = {"matrix" : matrix,
+               "energ_lo" : arrays["energ_lo"],
+               "energ_hi" : arrays["energ_hi"],
+               "e_min" : arrays["e_min"],
+               "e_max" : arrays["e_max"]}
+        self._loaded[key] = rmf
+        return rmf
+
+
+    def clear(self):
+        self._loaded = {}
@@ -0,0 +1,110 @@
+'''
+    Stage timing and counters for XRT_Analysis
+
+    A disabled timer hands out one shared do-nothing context manager, so the
+    instrumentation can stay in place. When enabled, each stage records its
+    call count, wall and CPU time, and every call can be sent to a callback
+    and/or appended to a JSON lines file.
+'''
+
+import os
+import time
+
+
+class _NullStage():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage():
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer._record(self.name, time.perf_counter() - self.wall,
+                           time.process_time() - self.cpu, exc[0] is not None)
+        return False
+
+
+class StageTimer():
+
+    # jsonl: file each call is appended to, callback: called with each record
+    # context: fixed fields added to every record (e.g. the spectrum)
+    def __init__(self, enabled = False, jsonl = None, callback = None, context = None):
+        self.enabled = enabled
+        self.jsonl = jsonl
+        self.callback = callback
+        self.context = dict(context) if context else {}
+        self.reset()
+
+
+    def reset(self):
+        self.records = {}
+        self.counters = {}
+
+
+    # with timer.stage("fit"): ...
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+
+    def count(self, name, n = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def _record(self, name, wall, cpu, failed):
+        rec = self.records.get(name)
+        if rec is None:
+            rec = self.records[name] = {"calls" : 0, "wall" : 0., "cpu" : 0.}
+        rec["calls"] += 1
+        rec["wall"] += wall
+        rec["cpu"] += cpu
+
+        if self.jsonl is None and self.callback is None:
+            return
+        event = dict(self.context)
+        event.update({"stage" : name, "wall" : wall, "cpu" : cpu, "failed" : failed,
+                      "time" : time.time(), "pid" : os.getpid()})
+        if self.callback is not None:
+            self.callback(event)
+        if self.jsonl is not None:
+            import json
+            # One write per line, so processes can share the file
+            with open(self.jsonl, "a") as f:
+                f.write(json.dumps(event) + "\n")
+
+
+    # {"stages": {name: {calls, wall, cpu}}, "counters": {name: n}}
+    # since: an earlier summary, only what was recorded after it is returned
+    def summary(self, since = None):
+        stages = {name : dict(rec) for name, rec in self.records.items()}
+        counters = dict(self.counters)
+        if since is not None:
+            for name, old in since["stages"].items():
+                rec = stages[name]
+                for field in rec:
+                    rec[field] -= old[field]
+                if rec["calls"] == 0:
+                    del stages[name]
+            for name, n in since["counters"].items():
+                counters[name] -= n
+                if counters[name] == 0:
+                    del counters[name]
+        return {"stages" : stages, "counters" : counters}
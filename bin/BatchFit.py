@@ -0,0 +1,54 @@
+''' Fit every grouped spectrum in a Reprocessed directory in parallel '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTBatch import batch_fit, joint_fit
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("ReprocessedDir", type=str, help="Reprocessed data directory")
+	parser.add_argument("nH", type=float, help="Column density in units of 1e22 cm^-2")
+	parser.add_argument("--output", "-o", type=str, help="Output table, format taken from the extension (e.g. .ecsv, .fits)", default="fit_results.ecsv")
+	parser.add_argument("--selection", "-s", type=str, help="run_selection.dat from TestReduction.sh", default=None)
+	parser.add_argument("--nworkers", "-j", type=int, help="Number of worker processes", default=None)
+	parser.add_argument("--model", "-m", type=str, help="pwl or logpar", default="pwl")
+	parser.add_argument("--absorb", type=str, help="pha or wabs", default="pha")
+	parser.add_argument("--backend", type=str, help="xspec or numpy", default="xspec")
+	parser.add_argument("--cstat", action="store_true", help="Use C-Statistics")
+	parser.add_argument("--errors", type=str, help="Parameter errors: profile, parallel or covariance (xspec backend), or bootstrap", default="profile")
+	parser.add_argument("--nboot", type=int, help="Realisations per spectrum with --errors bootstrap", default=2000)
+	parser.add_argument("--timing", type=str, help="Append per-stage timings of every fit to this JSON lines file", default=None)
+	parser.add_argument("--store", type=str, help="Also append the results (with SEDs) to this results store directory", default=None)
+	parser.add_argument("--joint", action="store_true", help="One joint fit of all spectra: shared index (alpha/beta), a normalisation per observation")
+
+	args = parser.parse_args()
+
+	config = dict(model = args.model,
+				  absorb = args.absorb,
+				  backend = args.backend,
+				  cstat = args.cstat,
+				  errorMethod = args.errors,
+				  nboot = args.nboot,
+				  timing = args.timing,
+				  store = args.store)
+
+	if args.joint:
+		shared, tabl = joint_fit(args.ReprocessedDir, args.nH, runSelection = args.selection, **config)
+		print ("Joint fit of %d spectra: Chi2 / DOF = %0.1f / %d" %(shared.get("nGroups", 1), shared["Chi2"], shared["DOF"]))
+		for key in ("Index", "Alpha", "Beta"):
+			if key in shared:
+				print ("\t%s = %0.4f -%0.4f +%0.4f" %(key, shared[key], shared[key + "_errl"], shared[key + "_erru"]))
+	else:
+		tabl = batch_fit(args.ReprocessedDir, args.nH,
+						 runSelection = args.selection,
+						 nworkers = args.nworkers,
+						 **config)
+
+	# SED arrays do not fit in a flat table
+	scalars = [name for name in tabl.colnames if tabl[name].dtype.kind != "O"]
+	tabl[scalars].write(args.output, overwrite=True)
+	print("%d fits written to %s" %(len(tabl), args.output))
@@ -0,0 +1,180 @@
+''' Time the hot paths of XRTAnalysis on synthetic data, no HEASoft needed '''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+# xspec is replaced by the forward-folding stand-in before XRTAnalysis uses it
+import __fakexspec
+__fakexspec.install()
+
+import XRTSynthetic
+from XRTAnalysis import XRT_Analysis
+from __deabsorb import deabsorb, TransmissionCache
+
+
+# A fitted XRT_Analysis (xspec stand-in) for the post-processing cases
+def fitted(grpfile, model, cflux, errors = "profile"):
+	analysis = XRT_Analysis(grpfile)
+	analysis.setModel(model, cflux=cflux)
+	analysis.setNH(0.2)
+	analysis.setErrorMethod(errors)
+	analysis.doFit()
+	return analysis
+
+
+# Setup for a callable that needs no preparation
+def ready(func):
+	return lambda: func
+
+
+# [(name, setup)], setup() prepares the state (e.g. a fit in the xspec
+# session) and returns the callable to time
+# The synthetic files are written to workdir first
+def benchmarks(workdir):
+	pwl = XRTSynthetic.write_spectra(os.path.join(workdir, "pwl"), model="pwl", seed=1)
+	logpar = XRTSynthetic.write_spectra(os.path.join(workdir, "logpar"), model="logpar", seed=2)
+	evtfile = os.path.join(workdir, "pwl", "pc_cl.evt")
+	XRTSynthetic.write_events(evtfile, seed=3)
+	cases = []
+
+	# deabsorb: SED points, a response grid and a fine grid; cold computes the
+	# cross-sections, warm hits the transmission cache
+	rng = np.random.default_rng(0)
+	for n in (100, 1200, 10000):
+		energy = np.logspace(np.log10(0.3), 1, n)
+		flux = rng.random(n)
+		cases.append(("deabsorb cold %d" %n,
+					  ready(lambda e=energy, f=flux: deabsorb(0.2, cache=TransmissionCache()).deabsorb(e, f, f))))
+		cases.append(("deabsorb warm %d" %n,
+					  ready(lambda e=energy, f=flux: deabsorb(0.2).deabsorb(e, f, f))))
+	energy = np.logspace(np.log10(0.3), 1, 1200)
+	grid = np.linspace(0.01, 1., 100)
+	cases.append(("deabsorb nH grid 100x1200",
+				  ready(lambda: deabsorb(grid, cache=TransmissionCache()).deabsorb(energy, energy))))
+
+	# writeModel post-processing, the fit is redone in setup (one xspec session)
+	for name, files, model in (("pwl", pwl, "pwl"), ("logpar", logpar, "logpar")):
+		for cflux in (True, False):
+			for errors in ("profile", "covariance"):
+				cases.append(("writeModel %s%s %s" %(name, " cflux" if cflux else "", errors),
+							  lambda f=files["grp"], m=model, c=cflux, e=errors: fitted(f, m, c, e).writeModel))
+
+	# Confidence bands: one fit, a batch of 1000 fits, Monte Carlo
+	analysis = fitted(logpar["grp"], "logpar", False)
+	res = analysis.getFitResults()
+	parms = np.array([res["Norm"], res["Alpha"], res["Beta"]])
+	cov = np.asarray(res["CoVar"])
+	cases.append(("getConfidienceInterval linear",
+				  ready(lambda: analysis.getConfidienceInterval(parms, cov))))
+	cases.append(("getConfidienceInterval linear 1000 fits",
+				  ready(lambda: analysis.getConfidienceInterval(np.tile(parms, (1000, 1)), np.tile(cov, (1000, 1, 1))))))
+	cases.append(("getConfidienceInterval mc 10000",
+				  ready(lambda: analysis.getConfidienceInterval(parms, cov, method="mc", seed=1))))
+
+	cases.append(("writeSpecTable", ready(analysis.writeSpecTable)))
+
+	# The pile-up count-rate check, as ReduceXRT.sh runs it
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TestCountRate.py")
+	cases.append(("TestCountRate.py", ready(lambda: subprocess.run([sys.executable, script, pwl["src"]],
+																	stdout=subprocess.DEVNULL))))
+
+	# Fitting and data preparation without xspec
+	def numpy_fit():
+		analysis = XRT_Analysis(pwl["grp"], backend="numpy")
+		analysis.setModel("pwl")
+		analysis.setNH(0.2)
+		analysis.doFit()
+	cases.append(("doFit numpy pwl", ready(numpy_fit)))
+
+	from XRTGroup import group_pha
+	cases.append(("group_pha min 20",
+				  ready(lambda: group_pha(pwl["src"], os.path.join(workdir, "grp.pha"), "pc_back.pha", "pc.rmf", "pc_src.arf"))))
+
+	from XRTExtract import extract_spectra
+	regfile = os.path.join(workdir, "src.reg")
+	with open(regfile, "w") as f:
+		f.write("fk5\ncircle(356.77015,51.70497,47.146\")\n")
+	cases.append(("extract_spectra", ready(lambda: extract_spectra(evtfile, [(regfile, os.path.join(workdir, "src.pha"))]))))
+
+	return cases
+
+
+# Best and median time per call (s), timeit style
+def measure(func, repeat):
+	timer = timeit.Timer(func)
+	number, _ = timer.autorange()
+	times = np.array(timer.repeat(repeat=repeat, number=number)) / number
+	return {"best" : float(times.min()), "median" : float(np.median(times)), "number" : number}
+
+
+def fmt(seconds):
+	for unit, scale in (("s", 1.), ("ms", 1.e-3), ("us", 1.e-6)):
+		if seconds >= scale:
+			return "%8.2f %s" %(seconds / scale, unit)
+	return "%8.2f ns" %(seconds * 1.e9)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--repeat", "-n", type=int, help="Number of timing rounds, the fastest one is kept", default=5)
+	parser.add_argument("--filter", "-k", type=str, help="Only run benchmarks whose name contains this", default=None)
+	parser.add_argument("--output", "-o", type=str, help="Write the results to this json file", default=None)
+	parser.add_argument("--baseline", "-b", type=str, help="Compare against a json file written with --output", default=None)
+	parser.add_argument("--tolerance", "-t", type=float, help="Allowed slow down with respect to the baseline", default=1.3)
+	parser.add_argument("--workdir", "-w", type=str, help="Directory for the synthetic data (default: temporary)", default=None)
+
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		workdir = args.workdir if args.workdir is not None else tmpdir
+		os.makedirs(workdir, exist_ok=True)
+
+		cwd = os.getcwd()
+		stdout = sys.stdout
+		# XRT_Analysis prints while it works
+		sys.stdout = open(os.devnull, "w")
+		try:
+			cases = benchmarks(workdir)
+			if args.filter is not None:
+				cases = [(name, setup) for name, setup in cases if args.filter in name]
+			results = {}
+			for name, setup in cases:
+				results[name] = measure(setup(), args.repeat)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+			os.chdir(cwd)
+
+	baseline = {}
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+
+	slower = []
+	print ("\n%-42s %11s %11s %8s" %("Benchmark", "best", "median", "ratio"))
+	for name, res in results.items():
+		line = "%-42s %s %s" %(name, fmt(res["best"]), fmt(res["median"]))
+		if name in baseline:
+			ratio = res["best"] / baseline[name]["best"]
+			line += " %8.2f" %ratio
+			if ratio > args.tolerance:
+				slower.append(name)
+				line += "  SLOWER"
+		print (line)
+
+	if args.output is not None:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent=2)
+
+	if slower:
+		print ("\n%d benchmark(s) slower than %0.2f x the baseline" %(len(slower), args.tolerance))
+		sys.exit(1)
+	sys.exit(0)
@@ -0,0 +1,27 @@
+''' Stack the SEDs of a results store onto one energy grid '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTResults import ResultsStore
+from XRTSEDCube import SEDCube, energy_grid
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("Store", type=str, help="Results store directory (BatchFit --store)")
+	parser.add_argument("Output", type=str, help="Output FITS file")
+	parser.add_argument("--emin", type=float, help="Lower edge of the grid in keV", default=0.3)
+	parser.add_argument("--emax", type=float, help="Upper edge of the grid in keV", default=10.)
+	parser.add_argument("--nbins", "-n", type=int, help="Number of logarithmic energy bins", default=30)
+	parser.add_argument("--method", "-m", type=str, help="rebin (weighted mean per bin) or interp (log-log at the bin centres)", default="rebin")
+
+	args = parser.parse_args()
+
+	cube = SEDCube.from_store(ResultsStore(args.Store),
+							  edges=energy_grid(args.emin, args.emax, args.nbins),
+							  method=args.method)
+	cube.write(args.Output)
+	print("%d x %d cube written to %s" %(cube.shape[0], cube.shape[1], args.Output))
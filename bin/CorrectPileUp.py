@@ -0,0 +1,41 @@
+''' Find the pile-up exclusion radius of a PC event file in a single pass '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTPileup import correct_pileup, write_regions, update_pileup_csv, king_pileup_radius, CUTOFF, PIXEL
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("EventFile", type=str, help="Cleaned PC event file, e.g. pc_cl.evt")
+	parser.add_argument("RA", type=float, help="Source RA in degrees")
+	parser.add_argument("Dec", type=float, help="Source Dec in degrees")
+	parser.add_argument("--cutoff", "-c", type=float, help="Count rate threshold in cts/s", default=CUTOFF)
+	parser.add_argument("--maxcut", type=int, help="Largest number of excluded pixels to try", default=100)
+	parser.add_argument("--csv", "-p", type=str, help="Pile-up csv (OBS_ID,NPIXELS) to update", default=None)
+	parser.add_argument("--obsid", type=str, help="Observation ID written to the csv (default: current directory name)", default=None)
+	parser.add_argument("--king", action="store_true", help="Also fit a King PSF to the wings and report its pile-up radius")
+
+	args = parser.parse_args()
+
+	icut, rate, radii = correct_pileup(args.EventFile, args.RA, args.Dec, args.cutoff, args.maxcut)
+	if icut is None:
+		print("No exclusion radius up to %d pixels brings the rate below %0.2f cts/s" %(args.maxcut, args.cutoff))
+		sys.exit(1)
+
+	print ("\n\n########################\n\n")
+	print ("\t\tExcluded pixels: %d (%0.2f arcsec)" %(icut, icut * PIXEL))
+	print ("\t\tCount Rate: %0.2f cts/s" %(rate))
+	if args.king:
+		kradius, kpars = king_pileup_radius(radii)
+		print ("\t\tKing PSF pile-up radius: %0.2f arcsec (rc = %0.2f, beta = %0.2f)" %(kradius, kpars[1], kpars[2]))
+	print ("\n\n########################\n\n")
+
+	write_regions(args.RA, args.Dec, icut)
+
+	if args.csv is not None:
+		obsid = args.obsid if args.obsid is not None else os.path.basename(os.getcwd())
+		update_pileup_csv(args.csv, obsid, icut)
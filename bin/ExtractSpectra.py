@@ -0,0 +1,23 @@
+''' Extract source and background spectra from one read of a cleaned event file '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTExtract import extract_spectra
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("EventFile", type=str, help="Cleaned event file, e.g. pc_cl.evt")
+	parser.add_argument("Regions", type=str, nargs="+", help="Pairs of region file and output pha, e.g. pc_src.reg pc_src.pha pc_back.reg pc_back.pha")
+
+	args = parser.parse_args()
+	if len(args.Regions) % 2 != 0:
+		parser.error("Regions must be given as region/pha pairs")
+
+	outputs = list(zip(args.Regions[::2], args.Regions[1::2]))
+	extract_spectra(args.EventFile, outputs)
+	for regfile, phafile in outputs:
+		print("%s -> %s" %(regfile, phafile))
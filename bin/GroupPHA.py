@@ -0,0 +1,37 @@
+''' Group a PHA file (grppha equivalent), or regroup every observation of a reduced directory '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTGroup import group_pha, change_backscale, regroup_tree
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("Input", type=str, help="Source pha, or the reduced data directory with --tree")
+	parser.add_argument("Output", type=str, nargs="?", default=None, help="Output pha (default: pc/wt_grp.pha with --tree)")
+	parser.add_argument("--back", type=str, default=None, help="BACKFILE, e.g. pc_back.pha")
+	parser.add_argument("--rmf", type=str, default=None, help="RESPFILE, e.g. pc.rmf")
+	parser.add_argument("--arf", type=str, default=None, help="ANCRFILE, e.g. pc_src.arf")
+	parser.add_argument("--method", type=str, default="min", choices=["min", "snr", "optimal"], help="Grouping strategy")
+	parser.add_argument("--value", type=float, default=20, help="Minimum counts (min, optimal) or signal to noise (snr)")
+	parser.add_argument("--bad", type=str, default="0-29", help="Bad channels")
+	parser.add_argument("--backscal", type=float, default=None, help="Only change BACKSCAL (chkey) and write Output")
+	parser.add_argument("--tree", action="store_true", help="Regroup OBS_ID/{pc,wt}_src.pha under Input")
+
+	args = parser.parse_args()
+
+	if args.tree:
+		output = args.Output if args.Output is not None else "%s_grp.pha"
+		for name in regroup_tree(args.Input, output, args.method, args.value, args.bad):
+			print(name)
+	elif args.Output is None:
+		parser.error("Output is required")
+	elif args.backscal is not None:
+		change_backscale(args.Input, args.Output, args.backscal)
+	elif args.method == "optimal" and args.rmf is None:
+		parser.error("--rmf is required with --method optimal")
+	else:
+		group_pha(args.Input, args.Output, args.back, args.rmf, args.arf, args.method, args.value, args.bad)
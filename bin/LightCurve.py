@@ -0,0 +1,31 @@
+''' Background subtracted light curve of every observation of a source '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTLightCurve import source_light_curve, CHUNK
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("ReprocessedDir", type=str, help="Reprocessed data directory")
+	parser.add_argument("--binsize", "-b", type=float, help="Bin length in s", default=100.)
+	parser.add_argument("--selection", "-s", type=str, help="run_selection.dat from TestReduction.sh", default=None)
+	parser.add_argument("--emin", type=float, help="Lower energy in keV (default: all channels)", default=None)
+	parser.add_argument("--emax", type=float, help="Upper energy in keV (default: all channels)", default=None)
+	parser.add_argument("--minfrac", type=float, help="Drop bins with a smaller good time fraction", default=0.)
+	parser.add_argument("--chunk", type=int, help="Events read at once", default=CHUNK)
+	parser.add_argument("--output", "-o", type=str, help="Output table, format taken from the extension (e.g. .ecsv, .fits)", default="light_curve.ecsv")
+
+	args = parser.parse_args()
+
+	band = None
+	if args.emin is not None or args.emax is not None:
+		band = (args.emin if args.emin is not None else 0., args.emax if args.emax is not None else 1e3)
+
+	tabl = source_light_curve(args.ReprocessedDir, binsize=args.binsize, runSelection=args.selection,
+							  band=band, minfrac=args.minfrac, chunk=args.chunk)
+	tabl.write(args.output, overwrite=True)
+	print("%d bins from %d observations written to %s" %(len(tabl), len(set(tabl["ObsID"])), args.output))
@@ -0,0 +1,27 @@
+''' Plot the SED and model of every fit in a results store '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTPlots import plot_store
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("Store", type=str, help="Results store directory (BatchFit --store)")
+	parser.add_argument("Output", type=str, help="Multipage PDF (*.pdf) or a directory for one PNG per fit")
+	parser.add_argument("--fit-ids", type=str, help="Comma separated FIT_IDs to plot (default: all)", default=None)
+	parser.add_argument("--nworkers", "-j", type=int, help="Number of worker processes (a PDF is then split per worker)", default=1)
+	parser.add_argument("--observed", action="store_true", help="Only plot the observed (absorbed) spectrum")
+
+	args = parser.parse_args()
+
+	fit_ids = None
+	if args.fit_ids is not None:
+		fit_ids = [int(i) for i in args.fit_ids.split(",")]
+
+	written = plot_store(args.Store, args.Output, fit_ids=fit_ids, nworkers=args.nworkers,
+						 bintrinsic=not args.observed)
+	print("%d file(s) written" %len(written))
@@ -0,0 +1,29 @@
+''' Reduce and group XRT data with the dependency-graph engine
+	Same stages as ReduceXRT.sh; stages whose inputs are unchanged are skipped '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTReduce import ReductionEngine, read_pileup_csv
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-r", "--ra", type=float, required=True, help="Source RA in degrees")
+	parser.add_argument("-d", "--dec", type=float, required=True, help="Source Dec in degrees")
+	parser.add_argument("-f", "--datadir", type=str, required=True, help="Reduced directory containing OBS_ID/swOBS_ID*cl.evt")
+	parser.add_argument("-p", "--pileup", type=str, help="Pile-up csv in the format OBS_ID,NPIXELS", default=None)
+	parser.add_argument("-j", "--nworkers", type=int, help="Number of stages run at once", default=4)
+	parser.add_argument("--force", action="store_true", help="Run every stage even if it is up to date")
+
+	args = parser.parse_args()
+
+	pileup = read_pileup_csv(args.pileup) if args.pileup is not None else None
+	engine = ReductionEngine(args.datadir, args.ra, args.dec, pileup,
+							 nworkers=args.nworkers, force=args.force)
+	status = engine.run()
+
+	failed = [obsid for obsid, modes in status.items() if "FAILED" in modes.values()]
+	sys.exit(1 if failed else 0)
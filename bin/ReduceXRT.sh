@@ -48,6 +48,12 @@ then
   exit
 fi
 
+# Absolute paths, the loop below works from inside each OBS_ID directory
+DATADIR="$( cd "$DATADIR" && pwd )"
+if [ -n "$PILEUPFILE" ]; then
+  PILEUPFILE="$( cd "$( dirname "$PILEUPFILE" )" && pwd )/$( basename "$PILEUPFILE" )"
+fi
+
 echo "RA: $RA"
 echo "DEC: $DEC"
 echo "Data: $DATADIR"
@@ -96,23 +102,24 @@ exit
 EOF
 }
 
-# Run grppha to change the backscale for WT mode
+# Extract several region spectra from one read of the events
+# Usage: extract_spectra_native EVT REG1 PHA1 [REG2 PHA2 ...]
+function extract_spectra_native()
+{
+  python $SUBDIR/ExtractSpectra.py "$@"
+}
+
+# Change the backscale for WT mode (grppha chkey BACKSCAL)
 function change_backscale()
 {
 
   SCALE=$1
   FILEIN=$2
   FILEOUT=$3
-  grppha<<EOF
-$FILEIN
-!$FILEOUT
-chkey BACKSCAL $SCALE
-exit
-
-EOF
+  python $SUBDIR/GroupPHA.py $FILEIN $FILEOUT --backscal $SCALE
 }
 
-# Grouping various files together for xspec
+# Grouping various files together for xspec (in-process grppha)
 # Assuming a minimum of 20 counts per bin
 function group_pha()
 {
@@ -122,17 +129,7 @@ function group_pha()
   BACKPHA=$3
   RMF=$4
   ARF=$5
-  grppha<<EOF
-$SRCPHA
-!$GRPPHA
-bad 0-29
-group min 20
-chkey BACKFILE ./$BACKPHA
-chkey RESPFILE ./$RMF
-chkey ANCRFILE ./$ARF
-exit
-
-EOF
+  python $SUBDIR/GroupPHA.py $SRCPHA $GRPPHA --back $BACKPHA --rmf $RMF --arf $ARF --bad 0-29 --method min --value 20
 }
 
 # Run extract_image for either pc or wt cleaned events in that directory
@@ -205,8 +202,7 @@ function extract_spectra_all()
 
   if [ -f $PCFILE ]; then
     rm -f pc_src.arf
-    extract_spectrum "$PCFILE" "pc_src.reg" "pc_src.pha"
-    extract_spectrum "$PCFILE" "pc_back.reg" "pc_back.pha"
+    extract_spectra_native "$PCFILE" pc_src.reg pc_src.pha pc_back.reg pc_back.pha
     xrtmkarf phafile=pc_src.pha srcx=-1 srcy=-1 outfile=pc_src.arf psfflag=yes expofile=pc_ex.img
     group_pha "pc_src.pha" "pc_grp.pha" "pc_back.pha" "pc.rmf" "pc_src.arf"
   fi
@@ -216,8 +212,7 @@ function extract_spectra_all()
   # Extract WT file
   if [ -f $WTFILE ]; then
     rm -f wt_src.arf
-    extract_spectrum "$WTFILE" "wt_src.reg" "wt_src.pha"
-    extract_spectrum "$WTFILE" "wt_back.reg" "wt_back.pha"
+    extract_spectra_native "$WTFILE" wt_src.reg wt_src.pha wt_back.reg wt_back.pha
     xrtmkarf phafile=wt_src.pha srcx=-1 srcy=-1 outfile=wt_src.arf psfflag=yes expofile=wt_ex.img
 
     # Not needed
@@ -256,31 +251,15 @@ function write_RegionsWT()
 }
 
 
+# Find the smallest number of excluded pixels that brings the
+# source annulus below 0.5 cts/s and write pc_src.reg/pc_back.reg
+# The events are read once, no xselect run per trial radius
 function correct_pileUP()
 {
-  COUNTR=1
-  ICUT=0
-
   PCFILE=pc_cl.evt
 
   if [ -f $PCFILE ]; then
-
-    # While the return of the python scripts is not 0
-    while [ $COUNTR -ne 0 ]
-    do
-
-      # Create the on region
-      write_RegionsPC $ICUT
-      # Extract the spectrum
-      extract_spectrum pc_cl.evt pc_src.reg pc_src.pha
-      # Test the new count rates
-      python $SUBDIR/TestCountRate.py pc_src.pha
-      COUNTR=$?
-      echo $COUNTR
-      # Iterate
-      ICUT=$[ICUT+1]
-
-    done
+    python $SUBDIR/CorrectPileUp.py $PCFILE $RA $DEC --csv $DATADIR/pileup_solved.csv
   fi
 }
 
@@ -0,0 +1,27 @@
+''' Write run_selection.dat for a whole Reprocessed directory in one process
+	Only primary headers are read, and a header index makes rescans cheap '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTSelection import scan
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("ReprocessedDir", type=str, help="Reprocessed data directory")
+	parser.add_argument("--exposureratio", "-ratio", type=float, help="If the ratio between PC and WT exposures is greater than this number, PC mode is selected, otherwise, WT mode is selected", default=10.)
+	parser.add_argument("--threads", "-j", type=int, help="Number of threads reading headers", default=16)
+	parser.add_argument("--nocheck", action="store_true", help="Also list observations whose reduction is incomplete")
+	parser.add_argument("--output", "-o", type=str, help="Output file, relative to ReprocessedDir", default="run_selection.dat")
+
+	args = parser.parse_args()
+
+	if not os.path.isdir(args.ReprocessedDir):
+		print("DIR NOT FOUND")
+		sys.exit(1)
+
+	scan(args.ReprocessedDir, ratio=args.exposureratio, nthreads=args.threads,
+		 check=not args.nocheck, output=args.output)
@@ -1,6 +1,5 @@
 ''' scripts to test if we are below the pileup count rate threshold'''
 from astropy.io import fits
-from astropy.table import Table
 import sys
 
 
@@ -8,13 +7,13 @@ import sys
 if __name__ == "__main__":
 
     file = sys.argv[1]
-    ffits = fits.open(file)
-
     cutoff = 0.5
 
-    # convert spectra to Table
-    tabl_spec = Table.read(ffits[1])
-    rate = sum(tabl_spec["COUNTS"]) / tabl_spec.meta["EXPOSURE"]
+    # Only the SPECTRUM extension is needed
+    with fits.open(file) as ffits:
+        counts = ffits[1].data["COUNTS"]
+        exposure = ffits[1].header["EXPOSURE"]
+        rate = counts.sum() / exposure
 
     print ("\n\n########################\n\n")
     print ("\t\tCount Rate: %0.2f cts/s" %(rate))
@@ -1,10 +1,13 @@
 ''' Select mode exposures '''
 
-from astropy.io import fits
 import argparse
+import os
 from pathlib import Path
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTSelection import HeaderIndex, observation_exposures, select_mode
+
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument("ReprocessedDir", type=str, help="Reprocessed data directory")
@@ -14,54 +17,17 @@ if __name__ == "__main__":
 	args = parser.parse_args()
 	ObsID = str(args.ObsID)
 	RepDir = args.ReprocessedDir
-	input_dir = RepDir + '/' + ObsID
 	ratio = args.exposureratio
 
 	if Path(RepDir).is_dir() == False:
 		print("DIR NOT FOUND")
 		sys.exit()
 
-	file_WT = "/sw" + ObsID + "xwtw2po_cl.evt"
-	file_PC2 = "/sw" + ObsID + "xpcw2po_cl.evt"
-	file_PC3 = "/sw" + ObsID + "xpcw3po_cl.evt"
-
-	path_to_fWT = Path(input_dir+file_WT)
-	path_to_fPC2 = Path(input_dir+file_PC2)
-	path_to_fPC3 = Path(input_dir+file_PC3)
-
-	if path_to_fWT.is_file():
-		hWT = fits.open(input_dir+file_WT)
-		exposure_WT = hWT[0].header["EXPOSURE"]
-	else:
-		exposure_WT = 0
-
-	if path_to_fPC3.is_file():
-		hPC3 = fits.open(input_dir+file_PC3)
-		exposure_PC3 = hPC3[0].header["EXPOSURE"]
-	else:
-		exposure_PC3 = 0
+	# Only the primary headers are read; nothing is persisted for a single ObsID
+	index = HeaderIndex(os.devnull)
+	mode = select_mode(*observation_exposures(RepDir, ObsID, index), ratio=ratio)
 
-	if path_to_fPC2.is_file():
-		hPC2 = fits.open(input_dir+file_PC2)
-		exposure_PC2 = hPC2[0].header["EXPOSURE"]
-	else:
-		exposure_PC2 = 0
-
-
-	if exposure_WT > 0.:
-		if exposure_PC3 > 0.:
-			if exposure_PC3/exposure_WT > ratio:
-				print(ObsID, "PC")
-			else:
-				print(ObsID, "WT")
-		elif exposure_PC2 > 0.:
-			if exposure_PC2/exposure_WT > ratio:
-				print(ObsID, "PC")
-			else:
-				print(ObsID, "WT")
-		else:
-			print(ObsID, "WT")
-	elif exposure_PC3 > 0. or exposure_PC2 > 0.:
-		print(ObsID, "PC")
-	else:
+	if mode is None:
 		print("SKIP")
+	else:
+		print(ObsID, mode)
@@ -0,0 +1,52 @@
+''' Check the import time of the XRTAnalysis modules against a budget '''
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that must not be imported as a side effect of a plain import
+HEAVY = ["xspec", "matplotlib.pyplot", "astropy.units", "astropy.table", "scipy.optimize"]
+
+# Imports and timing are done in a fresh interpreter
+PROBE = """
+import sys, time
+sys.path.insert(0, %r)
+t0 = time.perf_counter()
+import numpy
+t1 = time.perf_counter()
+import %s
+t2 = time.perf_counter()
+heavy = [m for m in %r if m in sys.modules]
+print(t1 - t0, t2 - t1, ",".join(heavy))
+"""
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--budget", "-b", type=float, help="Allowed import time in ms, on top of numpy", default=25.)
+	parser.add_argument("--repeat", "-n", type=int, help="Number of fresh interpreters, the fastest one is kept", default=5)
+	parser.add_argument("--modules", "-m", type=str, help="Comma separated modules to import", default="XRTAnalysis,__deabsorb,XRTBatch")
+
+	args = parser.parse_args()
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis")
+
+	best = None
+	for i in range(args.repeat):
+		out = subprocess.run([sys.executable, "-c", PROBE %(path, args.modules, HEAVY)],
+							 capture_output=True, text=True, check=True).stdout.split()
+		elapsed = float(out[1]) * 1.e3
+		heavy = out[2].split(",") if len(out) > 2 else []
+		if best is None or elapsed < best:
+			best = elapsed
+
+	print ("\n\n########################\n\n")
+	print ("\t\tImport time: %0.1f ms (budget %0.1f ms)" %(best, args.budget))
+	if heavy:
+		print ("\t\tEagerly imported: %s" %(", ".join(heavy)))
+	print ("\n\n########################\n\n")
+
+	if best <= args.budget and not heavy:
+		sys.exit(0)
+	else:
+		sys.exit(1)
@@ -0,0 +1,44 @@
+''' Split one observation into time-resolved spectra and optionally fit them '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTTimeResolved import time_resolve, fit_slices
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("ObsDir", type=str, help="Reduced OBS_ID directory (with {pc,wt}_cl.evt, regions, RMF and ARF)")
+	parser.add_argument("Mode", type=str, help="pc or wt")
+	parser.add_argument("--method", "-m", type=str, help="uniform, counts, blocks or edges", default="counts")
+	parser.add_argument("--value", "-v", type=float, help="Bin length in s (uniform), source counts per bin (counts) or p0 (blocks)", default=2000)
+	parser.add_argument("--edges", type=str, help="Text file of TSTART TSTOP (MET, s) per line, for --method edges", default=None)
+	parser.add_argument("--outdir", type=str, help="Output directory (default OBS_ID/TimeResolved_<mode>)", default=None)
+	parser.add_argument("--group", type=int, help="Minimum counts per group", default=20)
+	parser.add_argument("--fit", type=float, help="Fit every bin with this nH (1e22 cm^-2)", default=None)
+	parser.add_argument("--backend", type=str, help="xspec or numpy", default="xspec")
+	parser.add_argument("--nworkers", "-j", type=int, help="Number of worker processes for the fits", default=None)
+	parser.add_argument("--output", "-o", type=str, help="Fit results table", default="time_resolved.ecsv")
+
+	args = parser.parse_args()
+
+	value = args.value
+	if args.method == "edges":
+		with open(args.edges) as f:
+			value = [[float(v) for v in line.split()[:2]] for line in f if line.strip() and not line.startswith("#")]
+
+	outdir = args.outdir
+	if outdir is None:
+		outdir = os.path.join(args.ObsDir, "TimeResolved_%s" %args.Mode)
+
+	index = time_resolve(args.ObsDir, mode=args.Mode, method=args.method, value=value,
+						 outdir=outdir, group=args.group)
+	print("%d time bins written to %s" %(len(index["LABEL"]), outdir))
+
+	if args.fit is not None:
+		tabl = fit_slices(outdir, args.fit, nworkers=args.nworkers, backend=args.backend)
+		scalars = [name for name in tabl.colnames if tabl[name].dtype.kind != "O"]
+		tabl[scalars].write(args.output, overwrite=True)
+		print("%d fits written to %s" %(len(tabl), args.output))
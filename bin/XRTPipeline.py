@@ -0,0 +1,31 @@
+''' Run xrtpipeline over Data/ with several jobs at once
+	Observations already reprocessed from unchanged inputs are skipped '''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "XRTAnalysis"))
+from XRTPipelineRunner import PipelineRunner
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-r", "--ra", type=float, required=True, help="Source RA in degrees")
+	parser.add_argument("-d", "--dec", type=float, required=True, help="Source Dec in degrees")
+	parser.add_argument("-f", "--srcdir", type=str, required=True, help="Directory containing Data/OBS_ID/xrt and Data/OBS_ID/auxil")
+	parser.add_argument("-j", "--njobs", type=int, help="Number of xrtpipeline jobs run at once", default=4)
+	parser.add_argument("--retries", type=int, help="Retries of a failed job", default=2)
+	parser.add_argument("--force", action="store_true", help="Reprocess even if the inputs did not change")
+	parser.add_argument("--executable", type=str, help="xrtpipeline executable", default="xrtpipeline")
+
+	args = parser.parse_args()
+
+	if not os.path.isdir(os.path.join(args.srcdir, "Data")):
+		print("ERROR: \"%s\" doesn't exist.." %os.path.join(args.srcdir, "Data"))
+		sys.exit(1)
+
+	runner = PipelineRunner(args.srcdir, args.ra, args.dec, njobs=args.njobs,
+							retries=args.retries, force=args.force, executable=args.executable)
+	results = runner.run()
+	sys.exit(1 if any(s.startswith("failed") for s in results.values()) else 0)